@@ -0,0 +1,128 @@
+'''Benchmarks of constructing ophyd objects
+
+The detector trees are made with `ophyd.sim.make_fake_device`, so no IOC
+is needed; the signals are fake but go through the same ``OphydObject``
+and ``Signal`` initialization as the real ones. Run directly with::
+
+    python -m benchmarks.ophyd_objects
+'''
+import sys
+import tracemalloc
+
+from ophyd import Component as Cpt, Signal
+from ophyd.areadetector import SimDetector
+from ophyd.areadetector.plugins import ImagePlugin, StatsPlugin
+from ophyd.sim import make_fake_device
+
+from .scpi_signals import run
+
+
+def retained_memory(func):
+    '''The memory (bytes) still allocated by func() once it returns
+
+    The result of func is kept alive while measuring.
+    '''
+    tracemalloc.start()
+    try:
+        result = func()  # noqa: F841
+        retained, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return retained
+
+
+def detector_class(stats_plugins):
+    '''A fake SimDetector with an image plugin and stats_plugins stats'''
+    components = {'image1': Cpt(ImagePlugin, 'image1:')}
+    for index in range(1, stats_plugins + 1):
+        components['stats{}'.format(index)] = Cpt(StatsPlugin,
+                                                  'Stats{}:'.format(index))
+    cls = type('BenchDetector', (SimDetector, ), components)
+    return make_fake_device(cls)
+
+
+class DetectorTreeSuite:
+    params = [1, 5]
+    param_names = ['stats_plugins']
+
+    def setup(self, stats_plugins):
+        self.cls = detector_class(stats_plugins)
+
+    def _build(self):
+        det = self.cls('XF:BENCH{Det}', name='det')
+        # components of area detectors are lazy; instantiate all of them
+        return sum(1 for _ in det.walk_signals(include_lazy=True))
+
+    def _build_tree(self):
+        det = self.cls('XF:BENCH{Det}', name='det')
+        return det, list(det.walk_signals(include_lazy=True))
+
+    def time_construct(self, stats_plugins):
+        self._build()
+
+    def peakmem_construct(self, stats_plugins):
+        self._build()
+
+    def track_signals(self, stats_plugins):
+        return self._build()
+
+    track_signals.unit = 'signals'
+
+    def track_retained_memory(self, stats_plugins):
+        return retained_memory(self._build_tree)
+
+    track_retained_memory.unit = 'bytes'
+
+
+class SignalSuite:
+    def setup(self):
+        self.sig = Signal(name='sig')
+        self.subscribed = Signal(name='subscribed')
+        for _ in range(3):
+            self.subscribed.subscribe(lambda **kwargs: None, run=False)
+
+    def time_construct(self):
+        Signal(name='sig')
+
+    def time_subscribe(self):
+        sig = Signal(name='sig')
+        sig.subscribe(lambda **kwargs: None, run=False)
+
+    def time_put(self):
+        self.sig.put(1)
+
+    def time_put_subscribed(self):
+        self.subscribed.put(1)
+
+    def time_run_subs(self):
+        self.sig._run_subs(sub_type=self.sig.SUB_VALUE, value=1,
+                           timestamp=None)
+
+    def track_memory_per_signal(self):
+        count = 10000
+        return retained_memory(
+            lambda: [Signal(name='sig') for _ in range(count)]) / count
+
+    track_memory_per_signal.unit = 'bytes'
+
+
+SUITES = (DetectorTreeSuite, SignalSuite)
+
+
+def main(duration=0.5):
+    run(SUITES, duration)
+    for suite, name, args in ((DetectorTreeSuite, 'track_retained_memory',
+                               (1, )),
+                              (DetectorTreeSuite, 'track_retained_memory',
+                               (5, )),
+                              (SignalSuite, 'track_memory_per_signal', ())):
+        bench = suite()
+        bench.setup(*args)
+        label = '{}.{}{}'.format(suite.__name__, name,
+                                 list(args) if args else '')
+        print('{:<52} {:>12.1f} kB'.format(
+            label, getattr(bench, name)(*args) / 1e3))
+
+
+if __name__ == '__main__':
+    main(*map(float, sys.argv[1:2]))
@@ -0,0 +1,280 @@
+'''Benchmarks of the SCPI signal layer against a simulated instrument
+
+The classes follow the asv conventions (``setup``, ``time_*``, ``peakmem_*``
+and ``track_*`` methods) so that ``asv run`` tracks them between releases.
+Running the module directly prints ops/sec, p50/p99 latency and peak
+memory of each case instead::
+
+    python -m benchmarks.scpi_signals
+
+The simulated instrument has no latency, so these measure the software
+overhead of the hot path rather than the instrument.
+'''
+import itertools
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+from ophyd.scpi_like import (ScpiSignal, ScpiSignalBase, ScpiSignalFileSave,
+                             ArrayStatistics, StatCalculator, decode_array,
+                             encode_binary_block)
+from ophyd.scpi_sim import sim_multimeter
+
+
+def wait(status, timeout=10):
+    '''Wait for a status without the 50 ms polling of ophyd.status.wait'''
+    finished = threading.Event()
+    status.add_callback(finished.set)
+    if not finished.wait(timeout):
+        raise TimeoutError('{} did not finish'.format(status))
+
+
+def measure(func, *, duration=0.5, min_calls=5):
+    '''Call func repeatedly and summarize the latency of the calls
+
+    Returns
+    -------
+    summary : dict
+        ops_per_sec, p50 and p99 (seconds), calls and peak_memory (bytes
+        allocated at the peak of one call, as seen by tracemalloc)
+    '''
+    func()  # warm up
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    latencies = []
+    end = time.perf_counter() + duration
+    while len(latencies) < min_calls or time.perf_counter() < end:
+        t0 = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - t0)
+
+    latencies = np.asarray(latencies)
+    return {'ops_per_sec': len(latencies) / latencies.sum(),
+            'p50': float(np.percentile(latencies, 50)),
+            'p99': float(np.percentile(latencies, 99)),
+            'calls': len(latencies),
+            'peak_memory': peak_memory}
+
+
+class ScpiSignalBaseSuite:
+    def setup(self):
+        self.dmm = sim_multimeter()
+        self.sig = ScpiSignalBase(control_layer=self.dmm, cmd_name='volt')
+        self.cached = ScpiSignalBase(control_layer=self.dmm, cmd_name='nplc',
+                                     cache_ttl=60)
+
+    def time_get(self):
+        self.sig.get()
+
+    def time_get_cached(self):
+        self.cached.get()
+
+    def time_read(self):
+        self.sig.read()
+
+    def time_describe(self):
+        self.sig.describe()
+
+    def track_get_p99(self):
+        return measure(self.sig.get, duration=0.2)['p99']
+
+    track_get_p99.unit = 'seconds'
+
+
+class ScpiSignalSetSuite:
+    params = [None, True]
+    param_names = ['command_queue']
+
+    def setup(self, command_queue):
+        self.dmm = sim_multimeter()
+        self.sig = ScpiSignal(control_layer=self.dmm, cmd_name='nplc',
+                              command_queue=command_queue)
+
+    def time_set(self, command_queue):
+        wait(self.sig.set(1.))
+
+    def track_set_p99(self, command_queue):
+        return measure(lambda: wait(self.sig.set(1.)), duration=0.2)['p99']
+
+    track_set_p99.unit = 'seconds'
+
+
+class FileSaveSuite:
+    params = [[1000, 100000], [None, 'npy_stack']]
+    param_names = ['points', 'container']
+
+    def setup(self, points, container):
+        self.dmm = sim_multimeter(points=points)
+        self.dmm.set(None, name='init')
+        self.save_path = tempfile.mkdtemp()
+        container_kwargs = {'max_frames': 10000} if container else None
+        self.sig = ScpiSignalFileSave(control_layer=self.dmm,
+                                      cmd_name='fetch',
+                                      save_path=self.save_path,
+                                      container=container,
+                                      container_kwargs=container_kwargs)
+        self.sig.stage()
+
+    def teardown(self, points, container):
+        self.sig.unstage()
+        shutil.rmtree(self.save_path, ignore_errors=True)
+
+    def time_trigger(self, points, container):
+        wait(self.sig.trigger())
+        list(self.sig.collect_asset_docs())
+
+    def peakmem_trigger(self, points, container):
+        wait(self.sig.trigger())
+        list(self.sig.collect_asset_docs())
+
+
+class ArrayReplySuite:
+    params = [[1000, 1000000], ['binary', 'ascii', 'list', 'ascii_split']]
+    param_names = ['points', 'reply']
+
+    def setup(self, points, reply):
+        array = np.random.RandomState(0).standard_normal(points)
+        if reply == 'binary':
+            self.reply = encode_binary_block(array, '>f4') + b'\n'
+        elif reply == 'list':
+            self.reply = array.tolist()
+        else:
+            self.reply = ','.join('{:+.6E}'.format(value)
+                                  for value in array) + '\n'
+
+    def time_decode(self, points, reply):
+        if reply == 'ascii_split':
+            # what a getter_type converting the text itself does
+            np.array(self.reply.strip().split(','), dtype=float)
+        else:
+            decode_array(self.reply, '>f4')
+
+    def peakmem_decode(self, points, reply):
+        self.time_decode(points, reply)
+
+
+class StatCalculatorSuite:
+    params = [[10000, 1000000], ['separate', 'fused']]
+    param_names = ['points', 'engine']
+
+    funcs = [np.sum, np.mean, np.std, np.min, np.max, len]
+
+    def setup(self, points, engine):
+        self.array = np.random.RandomState(0).standard_normal(points)
+        self.count = 0
+        statistics = None
+        if engine == 'fused':
+            statistics = ArrayStatistics(lambda: self.array,
+                                         get_key=lambda: self.count)
+        self.calcs = [StatCalculator(name=func.__name__, stat_func=func,
+                                     img=lambda: self.array,
+                                     statistics=statistics)
+                      for func in self.funcs]
+
+    def time_statistics(self, points, engine):
+        # a new array for each point of a scan
+        self.count += 1
+        for calc in self.calcs:
+            calc.trigger()
+
+    def peakmem_statistics(self, points, engine):
+        self.count += 1
+        for calc in self.calcs:
+            calc.trigger()
+
+
+class GenerateOphydObjSuite:
+    def setup(self):
+        try:
+            import instrbuilder.scpi as scpi
+            from ophyd import ee_instruments
+        except ImportError:
+            raise NotImplementedError('generate_ophyd_obj needs instrbuilder')
+
+        class SimSCPI(type(sim_multimeter()), scpi.SCPI):
+            'A simulated control layer that passes for an instrbuilder SCPI'
+
+        dmm = sim_multimeter()
+        self.dmm = SimSCPI(dmm.instrument, name='dmm')
+        self.ee_instruments = ee_instruments
+
+    def time_generate(self):
+        # the class cache is cleared to time a fresh build from the plan
+        self.ee_instruments._class_cache.clear()
+        self.ee_instruments.generate_ophyd_obj('SimDmm', self.dmm)
+
+    def time_generate_uncached(self):
+        self.ee_instruments._class_cache.clear()
+        self.ee_instruments._plan_cache.clear()
+        self.ee_instruments.generate_ophyd_obj('SimDmm', self.dmm)
+
+    def time_instantiate(self):
+        self.ee_instruments._class_cache.clear()
+        cls, _ = self.ee_instruments.generate_ophyd_obj('SimDmm', self.dmm)
+        dev = cls(name='dmm')
+        dev.read_configuration()
+
+
+SUITES = (ScpiSignalBaseSuite, ScpiSignalSetSuite, FileSaveSuite,
+          ArrayReplySuite, StatCalculatorSuite, GenerateOphydObjSuite)
+
+
+def _cases(suites):
+    '''Every (suite, time_ method, params) combination, asv style
+
+    The peakmem_ methods are left out; `measure` reports peak memory.
+    '''
+    for suite in suites:
+        params = getattr(suite, 'params', [])
+        if params and not isinstance(params[0], list):
+            params = [params]
+        for name in sorted(dir(suite)):
+            if not name.startswith('time_'):
+                continue
+            for args in itertools.product(*params):
+                yield suite, name, args
+
+
+def run(suites, duration=0.5):
+    '''Measure the time_ methods of suites and print a table'''
+    row = '{:<52} {:>12} {:>10} {:>10} {:>12}'
+    print(row.format('benchmark', 'ops/sec', 'p50 [us]', 'p99 [us]',
+                     'peak [kB]'))
+    for suite, name, args in _cases(suites):
+        label = '{}.{}{}'.format(suite.__name__, name,
+                                 list(args) if args else '')
+        bench = suite()
+        try:
+            bench.setup(*args)
+        except NotImplementedError as ex:
+            print('{:<52} skipped: {}'.format(label, ex))
+            continue
+        try:
+            summary = measure(lambda: getattr(bench, name)(*args),
+                              duration=duration)
+        finally:
+            if hasattr(bench, 'teardown'):
+                bench.teardown(*args)
+        print(row.format(label, '{:.1f}'.format(summary['ops_per_sec']),
+                         '{:.1f}'.format(summary['p50'] * 1e6),
+                         '{:.1f}'.format(summary['p99'] * 1e6),
+                         '{:.1f}'.format(summary['peak_memory'] / 1e3)))
+
+
+def main(duration=0.5):
+    run(SUITES, duration)
+
+
+if __name__ == '__main__':
+    main(*map(float, sys.argv[1:2]))
@@ -5,13 +5,21 @@
 
 # standard library imports 
 import functools
+import hashlib
+import json
+import logging
+import os
+import threading
+import weakref
+from collections import OrderedDict
 
 # imports that may require package installation
 import numpy as np
 import scipy.signal as signal
 
 from instrbuilder.config import data_save
-from ophyd.scpi_like import ScpiSignal, ScpiSignalBase, ScpiSignalFileSave, StatCalculator
+from ophyd.scpi_like import (ScpiSignal, ScpiSignalBase, ScpiSignalFileSave, StatCalculator, ScpiDevice,
+                              ArrayStatistics, RunningStatistics)
 from ophyd import Device, Component, Signal
 from ophyd.device import Kind
 
@@ -19,34 +27,152 @@ import instrbuilder.scpi as scpi # check if instance is a member of this class
 import instrbuilder.ic as ic 
 import instrbuilder.instruments as instruments
 
+logger = logging.getLogger(__name__)
+
 class BlankCommHandle:
     def __init__(self):
         self.write = None
         self.ask = None
 
 
-def create_filter(order, sample_rate, tau):
+def create_filter(order, sample_rate, tau, output='ba'):
     cutoff_freq = 1 / (2 * np.pi * tau)
     norm_cutoff_freq = cutoff_freq / (sample_rate / 2)  # [from 0 - 1]
 
-    num, denom = signal.iirfilter(N=order, Wn=norm_cutoff_freq,
-                                  rp=None, rs=None, btype='lowpass', analog=False,
-                                  ftype='butter', output='ba')
-    return num, denom
+    return signal.iirfilter(N=order, Wn=norm_cutoff_freq,
+                            rp=None, rs=None, btype='lowpass', analog=False,
+                            ftype='butter', output=output)
 
 
-def apply_filter(arr, num, denom, sample_rate, tau, final_stat_function):
-    output_signal = signal.filtfilt(num, denom, arr)
+@functools.lru_cache(maxsize=32)
+def create_filter_sos(order, sample_rate, tau):
+    """The lowpass of create_filter as second-order sections (cached; do not modify)"""
+    return create_filter(order=order, sample_rate=sample_rate, tau=tau, output='sos')
 
+
+def decimate_filtered(output_signal, sample_rate, tau):
+    """Drop the filter settling time and keep one point per time constant"""
     tau_settle = 5
     settle_idx = int(tau_settle * tau / (1 / sample_rate))
     decimate_length = int(tau / (1 / sample_rate))
 
-    arr_downsample = output_signal[settle_idx::decimate_length]
+    return output_signal[settle_idx::decimate_length]
+
+
+def apply_filter(arr, num, denom, sample_rate, tau, final_stat_function):
+    output_signal = signal.filtfilt(num, denom, arr)
+    arr_downsample = decimate_filtered(output_signal, sample_rate, tau)
     # print('Filter data length after decimation ={}'.format(len(arr_downsample)))
     return final_stat_function(arr_downsample)
 
 
+class FilterCache:
+    """Filtered and decimated copies of the current array of a source
+
+    Each distinct (order, sample_rate, tau) filter runs once per new array
+    (zero-phase, with second-order sections); every statistic of that filter
+    then reads the same decimated result.
+
+    Parameters
+    ----------
+    get_array : callable
+        Returns the current array (e.g. ScpiSignalFileSave.get_array)
+    get_key : callable, optional
+        Returns a value that changes with each new array (e.g. the
+        ``array_count`` of a ScpiSignalFileSave)
+    """
+    def __init__(self, get_array, get_key=None):
+        self._get_array = get_array
+        self._get_key = get_key
+        self._key = None
+        self._filtered = {}
+        self._lock = threading.Lock()
+
+    def get(self, order, sample_rate, tau):
+        with self._lock:
+            arr = self._get_array()
+            if arr is None:
+                return None
+            key = (id(arr) if self._get_key is None
+                   else (self._get_key(), id(arr)))
+            if key != self._key:
+                self._filtered.clear()
+                self._key = key
+
+            settings = (order, sample_rate, tau)
+            if settings not in self._filtered:
+                output_signal = signal.sosfiltfilt(create_filter_sos(*settings), arr)
+                self._filtered[settings] = decimate_filtered(output_signal, sample_rate, tau)
+            return self._filtered[settings]
+
+
+class StreamingFilter:
+    """The lowpass of FilterCache applied to an array that arrives in chunks
+
+    The filter state (``zi``) is carried from one chunk to the next, the
+    output is decimated as it is produced (dropping the settling time, as
+    decimate_filtered does) and the decimated points update running
+    statistics, so an acquisition of any length is processed in constant
+    memory. Unlike the zero-phase filtering of FilterCache the filter is
+    causal, like the time constant of a lock-in amplifier.
+
+    Parameters
+    ----------
+    order : int
+    sample_rate : float
+    tau : float
+        Filter time constant
+
+    Attributes
+    ----------
+    statistics : RunningStatistics
+        Statistics of the decimated output; ``get`` is forwarded to it so a
+        StreamingFilter can serve StatCalculator signals
+    """
+    def __init__(self, order, sample_rate, tau):
+        self.order = order
+        self.sample_rate = sample_rate
+        self.tau = tau
+        self.sos = create_filter_sos(order, sample_rate, tau)
+        tau_settle = 5
+        self.settle_idx = int(tau_settle * tau / (1 / sample_rate))
+        self.decimate_length = max(int(tau / (1 / sample_rate)), 1)
+        self.statistics = RunningStatistics()
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Start over, as for a new acquisition"""
+        with self._lock:
+            self._zi = None
+            self._index = 0
+            self.statistics.reset()
+
+    def update(self, chunk):
+        """Filter the next chunk; returns the decimated output points"""
+        chunk = np.asarray(chunk, dtype=float).ravel()
+        with self._lock:
+            if not len(chunk):
+                return chunk
+            if self._zi is None:
+                # start from the steady state of the first reading
+                self._zi = signal.sosfilt_zi(self.sos) * chunk[0]
+            output_signal, self._zi = signal.sosfilt(self.sos, chunk, zi=self._zi)
+
+            # the first point of this chunk on the decimation grid
+            if self._index <= self.settle_idx:
+                first = self.settle_idx - self._index
+            else:
+                first = -(self._index - self.settle_idx) % self.decimate_length
+            self._index += len(chunk)
+            decimated = output_signal[first::self.decimate_length]
+            self.statistics.update(decimated)
+            return decimated
+
+    def get(self, stat_name):
+        return self.statistics.get(stat_name)
+
+
 class ManualDevice(Device):
     val = Component(Signal, name='val')
 
@@ -67,59 +193,170 @@ class BasicStatistics(Device):
 
     def __init__(self, array_source, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        # one pass over each new array serves every statistic
+        self.statistics = ArrayStatistics(array_source.get_array,
+                                          get_key=lambda: getattr(array_source, 'array_count', None))
         for func in self.func_list:
             getattr(self, func.__name__)._img = array_source.get_array
+            getattr(self, func.__name__)._statistics = self.statistics
             # update the name
             getattr(self, func.__name__).name = array_source.name + getattr(self, func.__name__).name
 
 
 class FilterStatistics(Device):
+    """Statistics of an array after lowpass filtering and decimation
+
+    Each filter runs once per new array and is shared by all of its
+    statistics (see FilterCache).
+
+    In streaming mode the data are instead filtered chunk by chunk as they
+    arrive (see StreamingFilter) and the statistics are running values over
+    everything since the last `reset`. Chunks are passed to `update`; a
+    source with a ``SUB_CHUNK`` subscription (e.g. ScpiBurstFlyer) feeds
+    them automatically.
+
+    Parameters
+    ----------
+    array_source : ScpiSignalFileSave or ScpiBurstFlyer
+    sample_rate : float, optional
+        Sample rate of the array; defaults to the class attribute
+    tau : float, optional
+        Filter time constant; defaults to the class attribute
+    orders : dict, optional
+        Filter order keyed by filter name (see filter_orders)
+    streaming : bool, optional
+        Filter chunks as they arrive instead of complete arrays
+    """
 
-    # TODO: How to not re-run the filter for each statistic,
-    #       by re-assigning _img below?
-
-    components = {}
-
-    # use functools.partial to input all parameters but the data array
-    #   generate the filter numerator and denominator here
-
-    order = 1  # db/octave = order*6dB
     sample_rate = 400e3/64/16*8  # with on-board oscillator
     tau = 10e-3  # consistent with SR810
+    filter_orders = {'filter_6dB': 1,   # db/octave = order*6dB
+                     'filter_24dB': 4}
 
-    func_list = ['filter_6dB', 'filter_24dB']
-
-    num, denom = create_filter(order=order, sample_rate=sample_rate, tau=tau)
-    func_name = 'filter_6dB'
-
+    func_list = list(filter_orders)
     stat_funcs = [np.mean, np.std]
-    for stat_func in stat_funcs:
-        func = functools.partial(apply_filter, num=num, denom=denom, sample_rate=sample_rate,
-                                 tau=tau, final_stat_function=stat_func)
-        components[func_name + '_' + stat_func.__name__] = Component(StatCalculator, name=func, img=None,
-                                                                     stat_func=func, kind=Kind.hinted, precision=5)
-
-    order = 4  # db/octave = order*24dB
-    num, denom = create_filter(order=order, sample_rate=sample_rate, tau=tau)
-    func_name = 'filter_24dB'
-    for stat_func in stat_funcs:
-        func = functools.partial(apply_filter, num=num, denom=denom, sample_rate=sample_rate,
-                                 tau=tau, final_stat_function=stat_func)
-        components[func_name + '_' + stat_func.__name__] = Component(StatCalculator, name=func, img=None,
-                                                                     stat_func=func, kind=Kind.hinted, precision=5)
+
+    components = {}
+    for func_name in func_list:
+        for stat_func in stat_funcs:
+            components[func_name + '_' + stat_func.__name__] = Component(StatCalculator, img=None,
+                                                                         stat_func=stat_func,
+                                                                         kind=Kind.hinted, precision=5)
     locals().update(components)
 
-    def __init__(self, array_source, *args, **kwargs):
+    def __init__(self, array_source, *args, sample_rate=None, tau=None, orders=None, streaming=False,
+                 **kwargs):
         super().__init__(*args, **kwargs)
+        self.streaming = streaming
+        self.streams = {}
+        self.filter_settings = {}
+        for func, order in self.filter_orders.items():
+            self.filter_settings[func] = dict(order=order,
+                                              sample_rate=self.sample_rate if sample_rate is None else sample_rate,
+                                              tau=self.tau if tau is None else tau)
+        for func, order in (orders or {}).items():
+            self.set_filter(func, order=order)
+
+        self.filtered = None
+        if streaming:
+            for func in self.func_list:
+                self._build_stream(func)
+            if hasattr(array_source, 'SUB_CHUNK'):
+                array_source.subscribe(self.update, event_type=array_source.SUB_CHUNK, run=False)
+        else:
+            self.filtered = FilterCache(array_source.get_array,
+                                        get_key=lambda: getattr(array_source, 'array_count', None))
         for func in self.func_list:
             for stat_func in self.stat_funcs:
-                getattr(self, func + '_' + stat_func.__name__)._img = array_source.get_array
+                if not streaming:
+                    getattr(self, func + '_' + stat_func.__name__)._img = functools.partial(self.get_filtered, func)
                 # update the name
                 getattr(self, func + '_' + stat_func.__name__).name = array_source.name + getattr(self, func + '_' +  stat_func.__name__).name
 
+    def _build_stream(self, func):
+        self.streams[func] = StreamingFilter(**self.filter_settings[func])
+        for stat_func in self.stat_funcs:
+            getattr(self, func + '_' + stat_func.__name__)._statistics = self.streams[func]
 
-def generate_ophyd_obj(name, scpi_obj):
-    components = {}
+    def set_filter(self, func, **settings):
+        """Change the order, sample_rate and/or tau of one filter
+
+        In streaming mode the running statistics of the filter start over.
+        """
+        if func not in self.filter_settings:
+            raise KeyError('unknown filter {!r}; must be one of {}'.format(func, self.func_list))
+        unknown = set(settings) - {'order', 'sample_rate', 'tau'}
+        if unknown:
+            raise TypeError('unknown filter settings {}'.format(sorted(unknown)))
+        self.filter_settings[func].update(settings)
+        if func in self.streams:
+            self._build_stream(func)
+
+    def get_filtered(self, func):
+        """The filtered and decimated array of filter ``func``"""
+        if self.filtered is None:
+            raise RuntimeError('streaming FilterStatistics keep no filtered array')
+        return self.filtered.get(**self.filter_settings[func])
+
+    def update(self, chunk, **kwargs):
+        """Filter the next chunk of a streaming acquisition
+
+        Extra keyword arguments (from a subscription) are ignored.
+        """
+        for stream in list(self.streams.values()):
+            stream.update(chunk)
+
+    def reset(self):
+        """Restart the filters and running statistics of a streaming acquisition"""
+        for stream in self.streams.values():
+            stream.reset()
+
+
+def save_png(filename, data):
+    with open(filename, 'wb') as out_f:
+        out_f.write(bytearray(data))
+
+
+# classes and file-save settings a cached plan may refer to by name
+_PLAN_CLASSES = {cls.__name__: cls for cls in (ScpiSignalBase, ScpiSignal, ScpiSignalFileSave)}
+_PLAN_SAVES = {'npy': {},
+               'png': dict(save_func=save_png, save_spec='PNG', save_ext='png')}
+
+# (instrument class, command table hash) -> plan
+_plan_cache = {}
+# control layer -> {(class name, plan key, config_cache_ttl): device class}; both
+# are held weakly, so a class lives only as long as it (or its control layer) is used
+_class_cache = weakref.WeakKeyDictionary()
+
+
+def _plan_entry(cls, cmd_name, configs, kind=Kind.normal, save=None, **kwargs):
+    """One component of a plan, in a JSON-friendly form"""
+    return {'cls': cls.__name__, 'cmd_name': cmd_name, 'configs': configs,
+            'kind': int(kind), 'save': save, 'kwargs': kwargs}
+
+
+def command_table_key(scpi_obj):
+    """Key the components of scpi_obj by instrument class and command table
+
+    Only the command attributes that decide which components are generated
+    go into the hash.
+    """
+    digest = hashlib.sha1()
+    for cmd_key, cmd in scpi_obj._cmds.items():
+        fields = [cmd_key] + [getattr(cmd, attr, None) for attr in
+                              ('name', 'ascii_str', 'is_config', 'setter', 'getter_inputs',
+                               'setter_inputs', 'read_write')]
+        fields.append(getattr(cmd.getter_type, 'returns_array', 'no returns_array'))
+        digest.update(repr(fields).encode())
+    digest.update(repr(getattr(scpi_obj, '_channels', None)).encode())
+
+    cls = type(scpi_obj)
+    return '{}.{}'.format(cls.__module__, cls.__qualname__), digest.hexdigest()
+
+
+def _build_plan(scpi_obj):
+    """Walk the command table of scpi_obj and plan a component per command"""
+    plan = OrderedDict()
     for cmd_key, cmd in scpi_obj._cmds.items():
         if cmd.is_config:
             comp_kind = Kind.config
@@ -129,77 +366,71 @@ def generate_ophyd_obj(name, scpi_obj):
         if isinstance(scpi_obj, scpi.SCPI):
             if hasattr(cmd.getter_type, 'returns_array'):
                 if cmd.name == 'burst_volt':
-                    components[cmd.name] = Component(ScpiSignalFileSave, name=cmd.name,
-                                                     control_layer=scpi_obj, cmd_name=cmd.name,
-                                                     save_path=data_save.directory,
-                                                     kind=Kind.normal,
-                                                     precision=10,  # this precision won't print the full file name,
-                                                                    # but enough to be unique
-                                                     configs={'reads_per_trigger': 1024, 'aperture': 20e-6,
-                                                              'trig_source': 'EXT', 'trig_count': 1})
+                    plan[cmd.name] = _plan_entry(ScpiSignalFileSave, cmd.name,
+                                                 save='npy',
+                                                 kind=Kind.normal,
+                                                 precision=10,  # this precision won't print the full file name,
+                                                                # but enough to be unique
+                                                 configs={'reads_per_trigger': 1024, 'aperture': 20e-6,
+                                                          'trig_source': 'EXT', 'trig_count': 1})
 
                 if cmd.name == 'burst_volt_timer':
-                    components[cmd.name] = Component(ScpiSignalFileSave, name=cmd.name,
-                                                     control_layer=scpi_obj, cmd_name=cmd.name,
-                                                     save_path=data_save.directory,
-                                                     kind=Kind.normal,
-                                                     precision=10,  # this precision won't print the full file name,
-                                                                    # but enough to be unique
-                                                     configs={'reads_per_trigger': 8, 'aperture': 20e-6,
-                                                              'trig_source': 'EXT', 'trig_count': 2048,
-                                                              'sample_timer': 320e-6, 'repeats': 1})
-                                                              # 'sample_timer': 102.4e-6, 'repeats': 1})
+                    plan[cmd.name] = _plan_entry(ScpiSignalFileSave, cmd.name,
+                                                 save='npy',
+                                                 kind=Kind.normal,
+                                                 precision=10,  # this precision won't print the full file name,
+                                                                # but enough to be unique
+                                                 configs={'reads_per_trigger': 8, 'aperture': 20e-6,
+                                                          'trig_source': 'EXT', 'trig_count': 2048,
+                                                          'sample_timer': 320e-6, 'repeats': 1})
+                                                          # 'sample_timer': 102.4e-6, 'repeats': 1})
                 if cmd.getter_type.returns_array:
                     print(
                         'Skipping command {}. Returns an array but a status monitor dictionary is not prepared'.format(
                             cmd.name))
             else:
                 if cmd.setter and cmd.getter_inputs == 0 and cmd.setter_inputs < 2:  # a setter
-                    components[cmd.name] = Component(ScpiSignal, control_layer=scpi_obj, cmd_name=cmd.name,
-                                                     configs={}, kind=comp_kind)
+                    plan[cmd.name] = _plan_entry(ScpiSignal, cmd.name, configs={}, kind=comp_kind)
                 if (not cmd.setter) and cmd.getter_inputs == 0:  # a getter (only)
-                    components[cmd.name] = Component(ScpiSignalBase, control_layer=scpi_obj, cmd_name=cmd.name,
-                                                     configs={}, kind=comp_kind)
+                    plan[cmd.name] = _plan_entry(ScpiSignalBase, cmd.name, configs={}, kind=comp_kind)
 
                 #  -----------------------  Multimeter  -----------------------
                 if isinstance(scpi_obj, instruments.KeysightMultimeter):
                     # AC/DC configurations.
                     #   Create DC versions
                     if cmd.setter and cmd.getter_inputs == 1 and cmd.setter_inputs == 2 and '{ac_dc}' in cmd.ascii_str:
-                        components[cmd.name + '_dc'] = Component(ScpiSignal, control_layer=scpi_obj, cmd_name=cmd.name,
-                                                                 configs={'ac_dc': 'DC'}, kind=comp_kind)
+                        plan[cmd.name + '_dc'] = _plan_entry(ScpiSignal, cmd.name,
+                                                             configs={'ac_dc': 'DC'}, kind=comp_kind)
                     if (not cmd.setter) and cmd.getter_inputs == 1 and '{ac_dc}' in cmd.ascii_str:
-                        components[cmd.name + '_dc'] = Component(ScpiSignalBase, control_layer=scpi_obj, cmd_name=cmd.name,
-                                                                 configs={'ac_dc': 'DC'}, kind=comp_kind)
+                        plan[cmd.name + '_dc'] = _plan_entry(ScpiSignalBase, cmd.name,
+                                                             configs={'ac_dc': 'DC'}, kind=comp_kind)
                     # AC/DC configurations.
                     #   Create AC versions
                     if cmd.setter and cmd.getter_inputs == 1 and cmd.setter_inputs == 2 and '{ac_dc}' in cmd.ascii_str:
-                        components[cmd.name + '_ac'] = Component(ScpiSignal, control_layer=scpi_obj, cmd_name=cmd.name,
-                                                                 configs={'ac_dc': 'AC'}, kind=comp_kind)
+                        plan[cmd.name + '_ac'] = _plan_entry(ScpiSignal, cmd.name,
+                                                             configs={'ac_dc': 'AC'}, kind=comp_kind)
                     if (not cmd.setter) and cmd.getter_inputs == 1 and '{ac_dc}' in cmd.ascii_str:
-                        components[cmd.name + '_ac'] = Component(ScpiSignalBase, control_layer=scpi_obj, cmd_name=cmd.name,
-                                                                 configs={'ac_dc': 'AC'}, kind=comp_kind)
+                        plan[cmd.name + '_ac'] = _plan_entry(ScpiSignalBase, cmd.name,
+                                                             configs={'ac_dc': 'AC'}, kind=comp_kind)
 
                 #  -----------------------  PowerSupply  --------------
                 if isinstance(scpi_obj, instruments.RigolPowerSupply):
                     #   Create components per chanel
                     for chan in scpi_obj._channels:
                         if cmd.setter and cmd.getter_inputs == 1 and cmd.setter_inputs == 2 and '{chan}' in cmd.ascii_str:
-                            components[cmd.name + '_chan{}'.format(chan)] = Component(ScpiSignal, control_layer=scpi_obj, cmd_name=cmd.name,
-                                                                                      configs={'chan': chan}, kind=comp_kind)
+                            plan[cmd.name + '_chan{}'.format(chan)] = _plan_entry(ScpiSignal, cmd.name,
+                                                                                  configs={'chan': chan}, kind=comp_kind)
                         if (not cmd.setter) and cmd.getter_inputs == 1 and '{channel}' in cmd.ascii_str:
-                            components[cmd.name + '_chan{}'.format(chan)] = Component(ScpiSignalBase, control_layer=scpi_obj, cmd_name=cmd.name,
-                                                                                      configs={'chan': chan}, kind=comp_kind)
+                            plan[cmd.name + '_chan{}'.format(chan)] = _plan_entry(ScpiSignalBase, cmd.name,
+                                                                                  configs={'chan': chan}, kind=comp_kind)
                 #  -----------------------  SRSLockIn LockIn  --------------
                 if isinstance(scpi_obj, instruments.SRSLockIn):
                     # Create components for long SCPI commands, those that need configuration inputs
-                    components['off_exp'] = Component(ScpiSignal,
-                                                      control_layer=scpi_obj, cmd_name='off_exp',
-                                                      configs={'chan': 2})  # offset and expand
+                    plan['off_exp'] = _plan_entry(ScpiSignal, 'off_exp',
+                                                  configs={'chan': 2})  # offset and expand
 
-                    components['ch1_disp'] = Component(ScpiSignal,
-                                                       control_layer=scpi_obj, cmd_name='ch1_disp',
-                                                       configs={'ratio': 0})  # ratio the display to None (0), Aux1 (1) or Aux2 (2)
+                    plan['ch1_disp'] = _plan_entry(ScpiSignal, 'ch1_disp',
+                                                   configs={'ratio': 0})  # ratio the display to None (0), Aux1 (1) or Aux2 (2)
 
 
                 #  -----------------------  Oscilloscope  -----------------------
@@ -207,17 +438,10 @@ def generate_ophyd_obj(name, scpi_obj):
                     if hasattr(cmd.getter_type, 'returns_array'):
                         if cmd.name == 'display_data':
                             print('Creating display data command')
-
-                            def save_png(filename, data):
-                                with open(filename, 'wb') as out_f:
-                                    out_f.write(bytearray(data))
-
-                            components[cmd.name] = Component(ScpiSignalFileSave, name=cmd.name,
-                                                             control_layer=scpi_obj, cmd_name=cmd.name,
-                                                             save_path=data_save.directory,
-                                                             save_func=save_png, save_spec='PNG', save_ext='png',
-                                                             kind=Kind.normal,
-                                                             precision=10)  # this precision won't print the full file name, but enough to be unique
+                            plan[cmd.name] = _plan_entry(ScpiSignalFileSave, cmd.name, configs={},
+                                                         save='png',
+                                                         kind=Kind.normal,
+                                                         precision=10)  # this precision won't print the full file name, but enough to be unique
 
                         elif cmd.getter_type.returns_array:
                             print('Skipping Oscilloscpe command {}.'.format(cmd.name))
@@ -225,44 +449,134 @@ def generate_ophyd_obj(name, scpi_obj):
 
                     else:
                         if cmd.setter and cmd.getter_inputs == 0 and cmd.setter_inputs < 2:
-                            components[cmd.name] = Component(ScpiSignal, control_layer=scpi_obj, cmd_name=cmd.name,
-                                                             configs={}, kind=comp_kind)
+                            plan[cmd.name] = _plan_entry(ScpiSignal, cmd.name, configs={}, kind=comp_kind)
                         if (not cmd.setter) and cmd.getter_inputs == 0:
-                            components[cmd.name] = Component(ScpiSignalBase, control_layer=scpi_obj, cmd_name=cmd.name,
-                                                             configs={}, kind=comp_kind)
+                            plan[cmd.name] = _plan_entry(ScpiSignalBase, cmd.name, configs={}, kind=comp_kind)
 
                     #   Create components per chanel
                     channels = [1, 2, 3, 4]
                     for chan in channels:
                         if cmd.setter and cmd.getter_inputs == 1 and cmd.setter_inputs == 2 and '{chan}' in cmd.ascii_str:
-                            components[cmd.name + '_chan{}'.format(chan)] = Component(ScpiSignal, control_layer=scpi_obj, cmd_name=cmd.name,
-                                                                                      configs={'chan': chan}, kind=comp_kind)
+                            plan[cmd.name + '_chan{}'.format(chan)] = _plan_entry(ScpiSignal, cmd.name,
+                                                                                  configs={'chan': chan}, kind=comp_kind)
                         if (not cmd.setter) and cmd.getter_inputs == 1 and '{chan}' in cmd.ascii_str:
-                            components[cmd.name + '_chan{}'.format(chan)] = Component(ScpiSignalBase, control_layer=scpi_obj, cmd_name=cmd.name,
-                                                                                      configs={'chan': chan}, kind=comp_kind)
+                            plan[cmd.name + '_chan{}'.format(chan)] = _plan_entry(ScpiSignalBase, cmd.name,
+                                                                                  configs={'chan': chan}, kind=comp_kind)
 
                     if cmd.name == 'meas_phase':  # requires two channels to find phase difference
-                        components[cmd.name] = Component(ScpiSignalBase, control_layer=scpi_obj, cmd_name=cmd.name,
-                                                         configs={'chan1': 1, 'chan2': 2}, kind=comp_kind)
+                        plan[cmd.name] = _plan_entry(ScpiSignalBase, cmd.name,
+                                                     configs={'chan1': 1, 'chan2': 2}, kind=comp_kind)
 
 
         elif isinstance(scpi_obj, ic.IC):
             if cmd.read_write in ['R/W', 'W']:
-                components[cmd.name] = Component(ScpiSignal, control_layer=scpi_obj, cmd_name=cmd.name,
-                                                 configs={}, kind=comp_kind)
+                plan[cmd.name] = _plan_entry(ScpiSignal, cmd.name, configs={}, kind=comp_kind)
             elif cmd.read_write in ['R']:
-                components[cmd.name] = Component(ScpiSignal, control_layer=scpi_obj, cmd_name=cmd.name,
-                                                 configs={}, kind=comp_kind)
+                plan[cmd.name] = _plan_entry(ScpiSignal, cmd.name, configs={}, kind=comp_kind)
         else:
             print('unexpected Class type')
 
-    components['unconnected'] = scpi_obj.unconnected
-
-    # create device subclass using type
-    ophyd_dev = type(name, (Device,), components)
+    return plan
+
+
+def _load_plan(scpi_obj, cache_dir=None):
+    """The plan for scpi_obj from memory, disk (if cache_dir is set) or a fresh walk"""
+    key = command_table_key(scpi_obj)
+    try:
+        return key, _plan_cache[key]
+    except KeyError:
+        pass
+
+    plan = None
+    if cache_dir is not None:
+        path = os.path.join(cache_dir, '{}-{}.json'.format(*key))
+        try:
+            with open(path) as f:
+                cached = json.load(f, object_pairs_hook=OrderedDict)
+            if cached['key'] == list(key):
+                plan = cached['plan']
+        except (OSError, ValueError, KeyError):
+            logger.debug('No usable cached plan at %s', path, exc_info=True)
+
+    if plan is None:
+        plan = _build_plan(scpi_obj)
+        if cache_dir is not None:
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+                with open(tmp_path, 'w') as f:
+                    json.dump({'key': list(key), 'plan': plan}, f)
+                os.replace(tmp_path, path)
+            except (OSError, TypeError):
+                logger.warning('Could not cache the plan for %s at %s', key[0], path, exc_info=True)
+
+    _plan_cache[key] = plan
+    return key, plan
+
+
+def _components_from_plan(plan, scpi_obj, config_cache_ttl=None):
+    components = {}
+    for attr, entry in plan.items():
+        cls = _PLAN_CLASSES[entry['cls']]
+        kind = Kind(entry['kind'])
+        kwargs = dict(entry['kwargs'])
+        if entry['save'] is not None:
+            kwargs.update(save_path=data_save.directory, **_PLAN_SAVES[entry['save']])
+        if config_cache_ttl is not None and kind & Kind.config:
+            kwargs['cache_ttl'] = config_cache_ttl
+        components[attr] = Component(cls, lazy=True,
+                                     control_layer=scpi_obj, cmd_name=entry['cmd_name'],
+                                     configs=dict(entry['configs']), kind=kind, **kwargs)
+    return components
+
+
+def generate_ophyd_obj(name, scpi_obj, config_cache_ttl=None, cache_dir=None):
+    """Build a Device subclass with a component per command of scpi_obj
+
+    Which components to create is planned once per instrument class and
+    command table (see command_table_key) and the plan is reused, from
+    memory or from ``cache_dir``; repeated calls for the same scpi_obj return
+    the same class. Components are lazy and only instantiated on first use.
+
+    Parameters
+    ----------
+    name : str
+        The name of the generated class
+    scpi_obj : instrbuilder.scpi.SCPI or instrbuilder.ic.IC
+        The instrument control layer
+    config_cache_ttl : float, optional
+        Cache the values of configuration signals for this many seconds
+        (see ScpiSignalBase.cache_ttl). Defaults to None (no caching)
+    cache_dir : str, optional
+        Directory to keep plans in (as JSON) across sessions. Defaults to
+        None (in memory only)
+
+    Returns
+    -------
+    ophyd_dev : type
+        The ScpiDevice subclass
+    components : dict
+        The components of ophyd_dev
+    """
+    key, plan = _load_plan(scpi_obj, cache_dir=cache_dir)
+    class_key = (name, key, config_cache_ttl)
+    try:
+        classes = _class_cache.setdefault(scpi_obj, weakref.WeakValueDictionary())
+    except TypeError:
+        # scpi_obj can not be weakly referenced; build a new class every time
+        classes = {}
+    ophyd_dev = classes.get(class_key)
+    if ophyd_dev is None:
+        components = _components_from_plan(plan, scpi_obj, config_cache_ttl=config_cache_ttl)
+        components['unconnected'] = scpi_obj.unconnected
+
+        # create device subclass using type
+        ophyd_dev = type(name, (ScpiDevice,), components)
+        ophyd_dev._plan_components = components
+        classes[class_key] = ophyd_dev
 
     # return components for now as a debug hook.
-    return ophyd_dev, components
+    return ophyd_dev, dict(ophyd_dev._plan_components)
 
 
 # ------------------------------------------------------------
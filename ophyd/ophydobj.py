@@ -1,10 +1,14 @@
+from concurrent.futures import ThreadPoolExecutor
 from itertools import count
 
 import time
 import logging
+import threading
 
 from enum import IntFlag
 
+from .utils.timers import timer_scheduler
+
 
 class Kind(IntFlag):
     """
@@ -20,11 +24,127 @@ class Kind(IntFlag):
     hinted = 0b101  # Notice that bool(hinted & normal) is True.
 
 
+_NO_LABELS = frozenset()
+
+
 class UnknownSubscription(KeyError):
     "Subclass of KeyError.  Raised for unknown event type"
     ...
 
 
+_callback_executor = None
+_callback_lock = threading.Lock()
+
+
+def _get_callback_executor():
+    global _callback_executor
+    with _callback_lock:
+        if _callback_executor is None:
+            _callback_executor = ThreadPoolExecutor(
+                max_workers=8, thread_name_prefix='ophyd-callbacks')
+        return _callback_executor
+
+
+class ThrottledCallback:
+    '''A subscription callback run off the thread that generates the events
+
+    Calling the object stores its arguments and returns at once; the
+    callback is later run with the newest arguments on a shared pool of
+    callback threads. Events that arrive while the callback is waiting or
+    running replace each other (the latest value wins), so a slow callback
+    sees fewer, newer events and does not hold up the other subscribers.
+    One call of the callback is in progress at a time.
+
+    Made by `OphydObject.subscribe` for the ``max_rate`` and ``coalesce``
+    options.
+
+    Parameters
+    ----------
+    callback : callable
+        The callback, which should not raise
+    max_rate : float, optional
+        The most calls per second; by default the callback is run as soon
+        as a thread is free
+    '''
+    __slots__ = ('callback', 'period', '_lock', '_latest', '_scheduled',
+                 '_timer', '_last_run', '_cancelled', '_dropped')
+
+    def __init__(self, callback, *, max_rate=None):
+        if max_rate is not None and not max_rate > 0:
+            raise ValueError('max_rate must be positive, not {!r}'
+                             ''.format(max_rate))
+        self.callback = callback
+        self.period = 1. / max_rate if max_rate is not None else 0.
+        self._lock = threading.Lock()
+        self._latest = None
+        self._scheduled = False
+        self._timer = None
+        self._last_run = None
+        self._cancelled = False
+        self._dropped = 0
+
+    def __call__(self, *args, **kwargs):
+        with self._lock:
+            if self._cancelled:
+                return
+            if self._latest is not None:
+                self._dropped += 1
+            self._latest = (args, kwargs)
+            if self._scheduled:
+                return
+            self._scheduled = True
+            self._schedule()
+
+    def _schedule(self):
+        '''Run the callback when the period allows (lock held)'''
+        delay = 0.
+        if self._last_run is not None:
+            delay = self._last_run + self.period - time.monotonic()
+        if delay > 0:
+            self._timer = timer_scheduler.call_later(
+                delay, _get_callback_executor().submit, self._run)
+        else:
+            self._timer = None
+            _get_callback_executor().submit(self._run)
+
+    def _run(self):
+        with self._lock:
+            if self._cancelled or self._latest is None:
+                self._scheduled = False
+                return
+            (args, kwargs), self._latest = self._latest, None
+            self._last_run = time.monotonic()
+        try:
+            self.callback(*args, **kwargs)
+        finally:
+            with self._lock:
+                if self._latest is not None and not self._cancelled:
+                    self._schedule()
+                else:
+                    self._scheduled = False
+
+    def cancel(self):
+        '''Drop the pending event and stop running the callback
+
+        A call already in progress is not interrupted.
+        '''
+        with self._lock:
+            self._cancelled = True
+            self._latest = None
+            if self._timer is not None:
+                self._timer.cancel()
+
+    @property
+    def pending(self):
+        '''An event is waiting to be passed to the callback'''
+        return self._latest is not None
+
+    @property
+    def dropped(self):
+        '''The number of events replaced by newer ones before being run'''
+        return self._dropped
+
+
 class OphydObject:
     '''The base class for all objects in Ophyd
 
@@ -49,13 +169,28 @@ class OphydObject:
     name
     '''
 
+    # the attributes of every object are slots; subclasses that do not
+    # declare __slots__ (and assignment of other attributes) use __dict__
+    __slots__ = ('__dict__', '__weakref__', '_ophyd_labels_', '_kind',
+                 '_attr_name', '_name', '_parent', '_callbacks',
+                 '_unwrapped_callbacks', '_cid_to_event_mapping', '_cb_count',
+                 '_callback_snapshot', '_args_cache', '_log')
+
     _default_sub = None
+    # the event types of the class, from its SUB_* attributes; computed
+    # once per class by __init_subclass__ rather than per instance
+    _subscription_table = frozenset()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._subscription_table = frozenset(
+            getattr(cls, k) for k in dir(cls)
+            if k.startswith('SUB') or k.startswith('_SUB'))
 
     def __init__(self, *, name=None, attr_name='', parent=None, labels=None,
                  kind=None):
-        if labels is None:
-            labels = set()
-        self._ophyd_labels_ = set(labels)
+        # objects without labels share one empty frozenset
+        self._ophyd_labels_ = set(labels) if labels else _NO_LABELS
         if kind is None:
             kind = Kind.normal
         self.kind = kind
@@ -71,31 +206,81 @@ class OphydObject:
         self._name = name
         self._parent = parent
 
-        self.subscriptions = {getattr(self, k)
-                              for k in dir(type(self))
-                              if (k.startswith('SUB') or
-                                  k.startswith('_SUB'))}
-
+        # the callback registries are allocated on the first subscription
+        # (see _allocate_callbacks); most objects never get one
+        self._callbacks = None
+        self._unwrapped_callbacks = None
+        self._cid_to_event_mapping = None
+        self._cb_count = None
+        self._callback_snapshot = None
+        # cache of last inputs to _run_subs, the semi-private way
+        # to trigger the callbacks for a given subscription to be run
+        # (allocated on the first _run_subs)
+        self._args_cache = None
+        # the logger adapter is created on first use (see log)
+        self._log = None
+
+    def _allocate_callbacks(self):
+        '''Allocate the callback registries, if not done yet'''
+        if self._callbacks is not None:
+            return
         # dictionary of wrapped callbacks
         self._callbacks = {k: {} for k in self.subscriptions}
         # this is to maintain api on clear_sub
         self._unwrapped_callbacks = {k: {} for k in self.subscriptions}
         # map cid -> back to which event it is in
         self._cid_to_event_mapping = dict()
-        # cache of last inputs to _run_subs, the semi-private way
-        # to trigger the callbacks for a given subscription to be run
-        self._args_cache = {k: None for k in self.subscriptions}
         # count of subscriptions we have handed out, used to give unique ids
         self._cb_count = count()
-        # Create logger name from parent or from module class
-        if self.parent:
-            base_log = self.parent.log.name
-            name = self.name.lstrip(self.parent.name + '_')
-        else:
-            base_log = self.__class__.__module__
-            name = self.name
-        # Instantiate logger
-        self.log = logging.getLogger(base_log + '.' + name)
+        # event type -> tuple of the wrapped callbacks, which is what
+        # _run_subs iterates over; replaced (not mutated) by
+        # _update_callback_snapshot whenever a callback is added or removed
+        self._callback_snapshot = {k: () for k in self.subscriptions}
+
+    def _update_callback_snapshot(self, event_type):
+        '''Rebuild the callback snapshot of event_type after a change'''
+        self._callback_snapshot[event_type] = tuple(
+            self._callbacks[event_type].values())
+
+    @property
+    def subscriptions(self):
+        '''The event types of this object (see `event_types`)
+
+        Shared by the instances of a class; assigning a set of event types
+        gives this object a table of its own.
+        '''
+        return self._subscription_table
+
+    @subscriptions.setter
+    def subscriptions(self, event_types):
+        self._subscription_table = frozenset(event_types)
+        if self._callbacks is not None:
+            for event_type in self._subscription_table:
+                self._callbacks.setdefault(event_type, {})
+                self._unwrapped_callbacks.setdefault(event_type, {})
+                self._callback_snapshot.setdefault(event_type, ())
+
+    @property
+    def log(self):
+        '''The logger of this object, created on first use
+
+        Named after the logger of the parent (or the module, for a root
+        object) and the name of this object.
+        '''
+        log = self._log
+        if log is None:
+            if self.parent:
+                base_log = self.parent.log.name
+                name = self.name.lstrip(self.parent.name + '_')
+            else:
+                base_log = self.__class__.__module__
+                name = self.name
+            log = self._log = logging.getLogger(base_log + '.' + name)
+        return log
+
+    @log.setter
+    def log(self, log):
+        self._log = log
 
     def _validate_kind(self, val):
         if isinstance(val, str):
@@ -189,7 +374,7 @@ class OphydObject:
 
         No exceptions are raised if the callback functions fail.
         '''
-        if sub_type not in self.subscriptions:
+        if sub_type not in self._subscription_table:
             raise UnknownSubscription(
                 "Unknown subscription {}, must be one of {!r}"
                 .format(sub_type, self.subscriptions))
@@ -203,14 +388,25 @@ class OphydObject:
         if 'timestamp' in kwargs and kwargs['timestamp'] is None:
             kwargs['timestamp'] = time.time()
 
-        # Shallow-copy the callback arguments for replaying the
-        # callback at a later time (e.g., when a new subscription is made)
-        self._args_cache[sub_type] = (tuple(args), dict(kwargs))
-
-        for cb in list(self._callbacks[sub_type].values()):
+        # Keep the callback arguments for replaying the callback at a later
+        # time (e.g., when a new subscription is made). args and kwargs are
+        # new objects made for this call, and each callback gets its own
+        # copy of kwargs, so they are not copied again here.
+        args_cache = self._args_cache
+        if args_cache is None:
+            args_cache = self._args_cache = {}
+        args_cache[sub_type] = (args, kwargs)
+
+        snapshot = self._callback_snapshot
+        if snapshot is None:
+            return
+        # the snapshot is a tuple, so callbacks added or removed by a
+        # callback take effect on the next call
+        for cb in snapshot[sub_type]:
             cb(*args, **kwargs)
 
-    def subscribe(self, callback, event_type=None, run=True):
+    def subscribe(self, callback, event_type=None, run=True, *,
+                  max_rate=None, coalesce=False):
         '''Subscribe to events this event_type generates.
 
         The callback will be called as ``cb(*args, **kwargs)`` with
@@ -247,6 +443,14 @@ class OphydObject:
             This maps to the ``sub_type`` kwargs in `_run_subs`
         run : bool, optional
             Run the callback now
+        max_rate : float, optional
+            Run the callback at most this many times per second. Implies
+            coalesce.
+        coalesce : bool, optional
+            Run the callback on a callback thread instead of the thread that
+            generated the event, with only the newest of the events that
+            arrived since it last ran (see `ThrottledCallback`). Use this
+            for slow consumers of fast events, such as displays.
 
         See Also
         --------
@@ -290,15 +494,20 @@ class OphydObject:
                         'Subscription %s callback exception (%s)',
                         sub_type, self)
             return inner
+        wrapped = wrap_cb(callback)
+        if max_rate is not None or coalesce:
+            wrapped = ThrottledCallback(wrapped, max_rate=max_rate)
+        self._allocate_callbacks()
         # get next cid
         cid = next(self._cb_count)
-        wrapped = wrap_cb(callback)
         self._unwrapped_callbacks[event_type][cid] = callback
         self._callbacks[event_type][cid] = wrapped
         self._cid_to_event_mapping[cid] = event_type
+        self._update_callback_snapshot(event_type)
 
         if run:
-            cached = self._args_cache[event_type]
+            cached = (self._args_cache.get(event_type)
+                      if self._args_cache is not None else None)
             if cached is not None:
                 args, kwargs = cached
                 wrapped(*args, **kwargs)
@@ -307,8 +516,14 @@ class OphydObject:
 
     def _reset_sub(self, event_type):
         '''Remove all subscriptions in an event type'''
+        if self._callbacks is None:
+            return
+        for cb in self._callbacks[event_type].values():
+            if isinstance(cb, ThrottledCallback):
+                cb.cancel()
         self._callbacks[event_type].clear()
         self._unwrapped_callbacks[event_type].clear()
+        self._update_callback_snapshot(event_type)
 
     def clear_sub(self, cb, event_type=None):
         '''Remove a subscription, given the original callback function
@@ -323,6 +538,8 @@ class OphydObject:
             The event to unsubscribe from (if None, removes it from all event
             types)
         '''
+        if self._callbacks is None:
+            return
         if event_type is None:
             event_types = self.event_types
         else:
@@ -345,13 +562,20 @@ class OphydObject:
         cid : int
            token return by :meth:`subscribe`
         """
+        if self._cid_to_event_mapping is None:
+            return
         ev_type = self._cid_to_event_mapping.pop(cid, None)
         if ev_type is None:
             return
         del self._unwrapped_callbacks[ev_type][cid]
-        del self._callbacks[ev_type][cid]
+        cb = self._callbacks[ev_type].pop(cid)
+        if isinstance(cb, ThrottledCallback):
+            cb.cancel()
+        self._update_callback_snapshot(ev_type)
 
     def unsubscribe_all(self):
+        if self._callbacks is None:
+            return
         for ev_type in self._callbacks:
             self._reset_sub(ev_type)
 
@@ -1,4 +1,5 @@
 # vi: ts=4 sw=4
+import asyncio
 import logging
 import time
 import threading
@@ -6,17 +7,811 @@ import functools
 from collections import deque
 import os
 import itertools
+import operator
+from collections import OrderedDict
+from tempfile import mkdtemp
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import numpy as np
 import wrapt
+try:
+    import h5py
+except ImportError:
+    h5py = None
 
-from .status import Status
+from .status import Status, DeviceStatus, wait
 from .signal import Signal
+from .device import Device
+from .flyers import FlyerInterface
+from .ophydobj import Kind
 from .sim import SynSignal, NullStatus, new_uid
+from .utils.timers import timer_scheduler
 
 logger = logging.getLogger(__name__)
 
 
+def _convert_reply(cmd, reply):
+    '''Convert a raw instrument reply the way the control layer getter does
+
+    Applies ``cmd.getter_type`` and then maps the result back through the
+    command lookup table (if there is one).
+    '''
+    val = cmd.getter_type(reply)
+    if cmd.lookup:
+        try:
+            val = list(cmd.lookup.keys())[list(cmd.lookup.values()).index(val)]
+        except ValueError:
+            logger.warning('%s value of %r not in the lookup table',
+                           cmd.name, val)
+    return val
+
+
+def _format_set(control_layer, cmd, value, configs):
+    '''Format the command that writes value, the way the control layer does
+
+    The value is mapped through the command lookup table and range checked
+    (if the control layer checks ranges) first; a value of None sends the
+    bare header (e.g. 'INIT').
+
+    Raises
+    ------
+    ValueError
+        If the command has a lookup table that does not contain value
+    '''
+    if value is None:
+        return cmd.ascii_str.format(value='', **configs).rstrip()
+    if cmd.lookup:
+        if value not in cmd.lookup:
+            raise ValueError('{!r} is not in the lookup table of {}'
+                             ''.format(value, cmd.name))
+        value = cmd.lookup[value]
+    check_set_range = getattr(control_layer, 'check_set_range', None)
+    if check_set_range is not None:
+        check_set_range(value, cmd.name)
+    return cmd.ascii_str.format(value=value, **configs)
+
+
+def _program_message(commands):
+    '''Join several SCPI commands or queries into a single program message
+
+    Every header except the common commands (``*OPC?``, ``*RST``, ...) is
+    prefixed with a ':' so that it is resolved from the root of the command
+    tree. Without it, a header following a hierarchical one is resolved
+    relative to that header's path (``MEAS:VOLT:DC?;MODE?`` is read as
+    ``MEAS:VOLT:DC?;MEAS:VOLT:MODE?``).
+    '''
+    parts = []
+    for command in commands:
+        command = command.strip()
+        if not command.startswith((':', '*')):
+            command = ':' + command
+        parts.append(command)
+    return ';'.join(parts)
+
+
+def parse_binary_block(data, dtype='>f4', *, offset=0):
+    '''View an IEEE 488.2 binary block as an array, without copying
+
+    Both definite-length (``#<n><length><data>``) and indefinite-length
+    (``#0<data>`` up to a newline terminator) blocks are supported.
+
+    Parameters
+    ----------
+    data : bytes, bytearray or memoryview
+        The reply, starting with the block at ``offset``
+    dtype : numpy dtype or str, optional
+        Type and byte order of the elements; most instruments send
+        big-endian data unless the byte order is swapped (FORM:BORD SWAP)
+    offset : int, optional
+        Position of the '#' in data
+
+    Returns
+    -------
+    array : numpy.ndarray
+        A (read-only, if ``data`` is bytes) view of the payload
+    end : int
+        Position just after the block
+    '''
+    dtype = np.dtype(dtype)
+    view = memoryview(data)
+    if view[offset:offset + 1] != b'#':
+        raise ValueError('Not a binary block: {!r}'
+                         ''.format(bytes(view[offset:offset + 16])))
+    ndigits = int(bytes(view[offset + 1:offset + 2]))
+    start = offset + 2 + ndigits
+    if ndigits:
+        length = int(bytes(view[offset + 2:start]))
+        if start + length > len(view):
+            raise ValueError('Binary block of {} bytes is truncated to {}'
+                             ''.format(length, len(view) - start))
+    else:
+        length = len(view) - start
+        if bytes(view[-1:]) == b'\n':
+            length -= 1
+    count = length // dtype.itemsize
+    array = np.frombuffer(data, dtype=dtype, count=count, offset=start)
+    return array, start + length
+
+
+def encode_binary_block(array, dtype=None):
+    '''Pack an array into a definite-length block ``#<n><length><data>``'''
+    data = np.ascontiguousarray(array, dtype=dtype).tobytes()
+    length = str(len(data))
+    return b'#' + str(len(length)).encode() + length.encode() + data
+
+
+def parse_ascii_array(reply, dtype=float):
+    '''Parse a comma separated reply to an array
+
+    The fields are split and then converted by numpy in one call, so a
+    field that is not a number raises ValueError instead of cutting the
+    array short (as ``np.fromstring`` with ``sep`` does).
+    '''
+    if isinstance(reply, (bytes, bytearray, memoryview)):
+        reply = bytes(reply).decode('latin-1')
+    reply = reply.strip()
+    if not reply:
+        return np.zeros(0, dtype=dtype)
+    fields = reply.split(',')
+    try:
+        return np.array(fields, dtype=dtype)
+    except ValueError:
+        # e.g. quoted fields
+        return np.array([field.strip(' "\'') for field in fields],
+                        dtype=dtype)
+
+
+def decode_array(reply, dtype='>f4'):
+    '''Convert an array reply of any form to a numpy array
+
+    Binary blocks are viewed in place (see `parse_binary_block`), comma
+    separated text is parsed with `parse_ascii_array` (to the native byte
+    order version of ``dtype``) and sequences are converted with
+    ``np.asarray``.
+    '''
+    if isinstance(reply, np.ndarray):
+        return reply
+    if isinstance(reply, str):
+        if reply.startswith('#'):
+            reply = reply.encode('latin-1')
+        else:
+            return parse_ascii_array(reply,
+                                     np.dtype(dtype).newbyteorder('='))
+    if isinstance(reply, (bytes, bytearray, memoryview)):
+        if bytes(reply[:1]) == b'#':
+            return parse_binary_block(reply, dtype)[0]
+        return parse_ascii_array(reply, np.dtype(dtype).newbyteorder('='))
+    return np.asarray(reply, dtype=dtype)
+
+
+class ArrayReply:
+    '''A ``getter_type`` for array commands: decodes with `decode_array`
+
+    Control layers that see the ``binary`` attribute pass the raw reply
+    (bytes) rather than text.
+
+    Parameters
+    ----------
+    dtype : numpy dtype or str, optional
+    '''
+    returns_array = True
+    binary = True
+
+    def __init__(self, dtype='>f4'):
+        self.dtype = np.dtype(dtype)
+
+    def __call__(self, reply):
+        return decode_array(reply, self.dtype)
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, self.dtype.str)
+
+
+def batch_get(signals, *, max_commands=16):
+    '''Read a group of SCPI signals with as few instrument round-trips as possible
+
+    Signals that share a control layer are queried together with one compound
+    query (``CMD1?;CMD2?;...``) and the reply is split back into per-signal
+    values.  If the reply can not be matched to the queries the affected
+    signals are read one at a time instead.  Signals with a fresh cached
+    value (see ``ScpiSignalBase.cache_ttl``) are not queried.
+
+    Parameters
+    ----------
+    signals : iterable of ScpiSignalBase
+        The signals to read; each must be ``batchable``
+    max_commands : int, optional
+        The maximum number of queries sent in one program message
+
+    Returns
+    -------
+    values : dict
+        Mapping of signal to value
+    '''
+    values = {}
+    by_layer = OrderedDict()
+    for sig in signals:
+        if sig.cached:
+            values[sig] = sig._readback
+        else:
+            by_layer.setdefault(id(sig._control_layer), []).append(sig)
+
+    for group in by_layer.values():
+        for start in range(0, len(group), max_commands):
+            chunk = group[start:start + max_commands]
+            values.update(_batch_get_chunk(chunk))
+    return values
+
+
+def _batch_get_chunk(chunk):
+    'Read signals (all on one control layer) with a single compound query'
+    if len(chunk) == 1:
+        sig, = chunk
+        return {sig: sig.get()}
+
+    control_layer = chunk[0]._control_layer
+    try:
+        query = _program_message(sig._query_string() for sig in chunk)
+        replies = chunk[0]._ask(query).strip().split(';')
+        if len(replies) != len(chunk):
+            raise ValueError('Expected {} replies to {!r}, got {}'
+                             ''.format(len(chunk), query, len(replies)))
+        converted = [_convert_reply(sig._cmd, reply)
+                     for sig, reply in zip(chunk, replies)]
+    except Exception:
+        logger.debug('Batched read on %s failed; reading signals one at '
+                     'a time', control_layer.name, exc_info=True)
+        return {sig: sig.get() for sig in chunk}
+
+    timestamp = time.time()
+    values = {}
+    for sig, value in zip(chunk, converted):
+        sig._update_readback(value, timestamp)
+        values[sig] = value
+    return values
+
+
+_parallel_executor = None
+_parallel_lock = threading.Lock()
+_parallel_local = threading.local()
+
+
+def _get_parallel_executor():
+    global _parallel_executor
+    with _parallel_lock:
+        if _parallel_executor is None:
+            _parallel_executor = ThreadPoolExecutor(
+                max_workers=8, thread_name_prefix='scpi-parallel-get')
+        return _parallel_executor
+
+
+def parallel_get(signals, *, max_commands=16):
+    '''Read signals of several instruments concurrently
+
+    Signals are grouped by control layer. The groups are read at the same
+    time, one thread per instrument, so reading from several instruments
+    takes about as long as the slowest of them; within a group the
+    batchable signals are read with compound queries (see `batch_get`)
+    and the others one at a time. Composites with ``sub_reads`` are
+    expanded, recursively, into the signals they are computed from, so each
+    instrument is read by exactly one thread; their values are combined
+    once everything has been read. Other signals without a control layer
+    are read on their own.
+
+    Parameters
+    ----------
+    signals : iterable of Signal
+        The signals to read; duplicates are read once
+    max_commands : int, optional
+        The maximum number of queries sent in one program message
+
+    Returns
+    -------
+    values : dict
+        Mapping of signal to value
+    '''
+    # every composite comes after its sub-reads
+    expanded = OrderedDict()
+
+    def expand(sig):
+        if sig in expanded:
+            return
+        sub_reads = getattr(sig, 'sub_reads', None)
+        expanded[sig] = sub_reads is not None
+        for sub in sub_reads or ():
+            expand(sub)
+        expanded.move_to_end(sig)
+
+    for sig in signals:
+        expand(sig)
+    composites = [sig for sig, composite in expanded.items() if composite]
+
+    groups = OrderedDict()
+    for sig in (sig for sig, composite in expanded.items() if not composite):
+        control_layer = getattr(sig, '_control_layer', sig)
+        groups.setdefault(id(control_layer), []).append(sig)
+    groups = list(groups.values())
+
+    def read_group(group):
+        batch = [sig for sig in group
+                 if isinstance(sig, ScpiSignalBase) and sig.batchable]
+        values = batch_get(batch, max_commands=max_commands)
+        for sig in group:
+            if sig not in values:
+                values[sig] = sig.get()
+        return values
+
+    def read_group_in_worker(group):
+        _parallel_local.worker = True
+        return read_group(group)
+
+    values = {}
+    # reads nested in a worker (e.g. inside the get_func of a composite
+    # without sub_reads) are not sent to the pool again, as waiting on it
+    # from inside could exhaust it
+    if len(groups) < 2 or getattr(_parallel_local, 'worker', False):
+        for group in groups:
+            values.update(read_group(group))
+    else:
+        executor = _get_parallel_executor()
+        futures = [executor.submit(read_group_in_worker, group)
+                   for group in groups[1:]]
+        values.update(read_group(groups[0]))
+        for future in futures:
+            values.update(future.result())
+    for sig in composites:
+        values[sig] = sig._combine(values)
+    return values
+
+
+class _QueuedCommand:
+    __slots__ = ('func', 'args', 'kwargs', 'message', 'future', 'submitted')
+
+    def __init__(self, func, args, kwargs, message=None):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.message = message
+        self.future = Future()
+        self.submitted = time.monotonic()
+
+
+class ScpiCommandQueue:
+    '''Serialize access to one SCPI-like control layer
+
+    A single worker thread owns the control layer: get, set and raw
+    ask/write requests are queued and executed one at a time, in order, so
+    replies from different signals on the same instrument can not interleave.
+    Every request returns a `concurrent.futures.Future` right away.
+
+    Raw writes need no reply, so the caller never waits on them.
+    Consecutive writes waiting in the queue are pipelined: they are sent as
+    one program message (``CMD1 x;CMD2 y``).
+
+    Use `ScpiCommandQueue.for_control_layer` to share one queue between all
+    of the signals of an instrument.
+
+    Parameters
+    ----------
+    control_layer :
+        The instrument control layer object with get, set, _ask and _write
+    max_pipeline : int, optional
+        The maximum number of writes joined into one program message
+    '''
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, control_layer, *, max_pipeline=16):
+        self._control_layer = control_layer
+        self.max_pipeline = max_pipeline
+        self._requests = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closed = False
+
+        self.max_depth = 0
+        self.submitted = 0
+        self.completed = 0
+        self.pipelined = 0
+        self._total_latency = 0.
+        self.max_latency = 0.
+
+    @classmethod
+    def for_control_layer(cls, control_layer):
+        '''The queue shared by all users of ``control_layer``'''
+        with cls._shared_lock:
+            try:
+                queue = cls._shared[id(control_layer)]
+            except KeyError:
+                queue = cls._shared[id(control_layer)] = cls(control_layer)
+            return queue
+
+    @property
+    def control_layer(self):
+        return self._control_layer
+
+    @property
+    def depth(self):
+        '''The number of requests waiting to be executed'''
+        return len(self._requests)
+
+    @property
+    def stats(self):
+        '''Depth and latency (submission to completion, in s) statistics'''
+        completed = self.completed
+        return {'depth': self.depth,
+                'max_depth': self.max_depth,
+                'submitted': self.submitted,
+                'completed': completed,
+                'pipelined': self.pipelined,
+                'mean_latency': (self._total_latency / completed
+                                 if completed else 0.),
+                'max_latency': self.max_latency}
+
+    def _submit(self, request):
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('The command queue for {} is closed'
+                                   ''.format(self._control_layer.name))
+            self._requests.append(request)
+            self.submitted += 1
+            self.max_depth = max(self.max_depth, len(self._requests))
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._worker, daemon=True,
+                    name='scpi queue {}'.format(self._control_layer.name))
+                self._thread.start()
+            self._cond.notify()
+        return request.future
+
+    def submit(self, func, *args, **kwargs):
+        '''Queue ``func(*args, **kwargs)`` to run on the worker thread'''
+        return self._submit(_QueuedCommand(func, args, kwargs))
+
+    def get(self, name, configs={}):
+        '''Queue a control layer ``get``; the future holds the value'''
+        return self.submit(self._control_layer.get, name=name,
+                           configs=configs)
+
+    def set(self, value, name, configs={}):
+        '''Queue a control layer ``set``; the future holds its return'''
+        return self.submit(self._control_layer.set, value, name=name,
+                           configs=configs)
+
+    def ask(self, message):
+        '''Queue a raw query; the future holds the reply'''
+        return self.submit(self._control_layer._ask, message)
+
+    def write(self, message):
+        '''Queue a raw write that may be pipelined with other writes'''
+        return self._submit(_QueuedCommand(None, (), {}, message=message))
+
+    def flush(self, timeout=None):
+        '''Block until everything queued so far has been executed'''
+        return self.submit(lambda: None).result(timeout)
+
+    def close(self):
+        '''Finish the queued requests and stop the worker thread'''
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+        with self._shared_lock:
+            if self._shared.get(id(self._control_layer)) is self:
+                del self._shared[id(self._control_layer)]
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._requests:
+                if self._closed:
+                    return None
+                self._cond.wait()
+            batch = [self._requests.popleft()]
+            if batch[0].message is not None:
+                while (self._requests and len(batch) < self.max_pipeline and
+                       self._requests[0].message is not None):
+                    batch.append(self._requests.popleft())
+            return batch
+
+    def _worker(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            for request in batch:
+                request.future.set_running_or_notify_cancel()
+            if batch[0].message is not None:
+                outcomes = self._send_writes(batch)
+            else:
+                req, = batch
+                outcomes = [self._call(req.func, *req.args, **req.kwargs)]
+
+            now = time.monotonic()
+            for request in batch:
+                latency = now - request.submitted
+                self._total_latency += latency
+                self.max_latency = max(self.max_latency, latency)
+            self.completed += len(batch)
+
+            for request, (result, error) in zip(batch, outcomes):
+                if error is not None:
+                    request.future.set_exception(error)
+                else:
+                    request.future.set_result(result)
+
+    @staticmethod
+    def _call(func, *args, **kwargs):
+        'Call func; return (result, None), or (None, exception) if it raised'
+        try:
+            return func(*args, **kwargs), None
+        except Exception as ex:
+            return None, ex
+
+    def _send_writes(self, batch):
+        '''Write a batch as one program message
+
+        If the pipelined message fails, every write of the batch fails with
+        the same error. The writes are not sent again: the instrument may
+        already have executed some of them, and commands such as ``INIT``
+        or ``*TRG`` must not run twice. (The error queue does not say which
+        unit of a program message was at fault.)
+        '''
+        outcome = self._call(self._control_layer._write,
+                             _program_message(req.message for req in batch))
+        if outcome[1] is None:
+            self.pipelined += len(batch) - 1
+        elif len(batch) > 1:
+            logger.debug('Pipelined write of %d commands to %s failed',
+                         len(batch), self._control_layer.name,
+                         exc_info=outcome[1])
+        return [outcome] * len(batch)
+
+
+class ScpiSetpointCache:
+    '''The last value confirmed for each setter of one instrument
+
+    Values are keyed by command name and configs, and recorded when a write
+    succeeds or a read returns. Signals using the cache skip writing a
+    value equal to the recorded one (see ``setpoint_cache`` of
+    `ScpiSignalBase`). Anything that changes the instrument behind the
+    back of the signals (``*RST``, the front panel, another program) makes
+    the recorded values stale; call `forget` then.
+
+    Use `ScpiSetpointCache.for_control_layer` to share one cache between
+    all of the signals of an instrument.
+    '''
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+        self.suppressed = 0
+        self.written = 0
+
+    @classmethod
+    def for_control_layer(cls, control_layer):
+        '''The cache shared by all users of ``control_layer``'''
+        with cls._shared_lock:
+            # the control layer is kept, so its id can not be reused by a
+            # new control layer that would inherit the recorded values
+            owner, cache = cls._shared.get(id(control_layer), (None, None))
+            if owner is not control_layer:
+                cache = cls()
+                cls._shared[id(control_layer)] = (control_layer, cache)
+            return cache
+
+    @staticmethod
+    def key(cmd_name, configs):
+        '''The key of a command and its configs'''
+        return (cmd_name, tuple(sorted(configs.items())))
+
+    def matches(self, key, value):
+        '''Is value the recorded value of key?'''
+        with self._lock:
+            try:
+                known = self._values[key]
+            except KeyError:
+                return False
+        try:
+            return bool(known == value)
+        except (TypeError, ValueError):
+            # e.g. arrays, whose comparison is ambiguous
+            return False
+
+    def suppress(self, key, value):
+        '''Should a write of value to key be skipped (and counted)?'''
+        if not self.matches(key, value):
+            return False
+        with self._lock:
+            self.suppressed += 1
+        return True
+
+    def confirm(self, key, value):
+        '''Record value as the current value of key'''
+        with self._lock:
+            self._values[key] = value
+
+    def record_write(self, key, value, success=True):
+        '''Count a write of value to key; record the value if it succeeded'''
+        with self._lock:
+            self.written += 1
+            if success:
+                self._values[key] = value
+            else:
+                self._values.pop(key, None)
+
+    def forget(self, key=None):
+        '''Drop the recorded value of key, or of every key by default'''
+        with self._lock:
+            if key is None:
+                self._values.clear()
+            else:
+                self._values.pop(key, None)
+
+    @property
+    def stats(self):
+        '''Counts of suppressed and written values'''
+        return {'suppressed': self.suppressed,
+                'written': self.written,
+                'known': len(self._values)}
+
+
+class ScpiStatusMonitor:
+    '''Watch an instrument status until it crosses a threshold
+
+    The status is polled in a background thread so that the caller (typically
+    the RunEngine via ``trigger``) gets a Status object back immediately.
+    Polling starts at ``poll_time`` and backs off geometrically (by
+    ``backoff``) up to ``max_poll_time`` to save bus bandwidth on long
+    acquisitions.  If ``use_srq`` is set and the communication handle of the
+    control layer has a ``wait_for_srq`` method (e.g. a pyvisa resource), the
+    monitor waits for the service request instead of sleeping between polls.
+
+    Parameters
+    ----------
+    read_func : callable
+        Returns the current status value, ``f() -> value``
+    threshold_function : callable
+        ``f(value, threshold_level) -> bool``; True once the status is reached
+    threshold_level : any
+        Passed on to `threshold_function`
+    poll_time : float
+        The initial time between polls, in seconds
+    max_poll_time : float, optional
+        The longest time between polls; defaults to ``10 * poll_time``
+    backoff : float, optional
+        Factor applied to the poll time after each unsuccessful poll
+    srq_wait : callable, optional
+        ``f(timeout_ms)`` that blocks until a service request (or raises on
+        timeout)
+    '''
+    def __init__(self, *, read_func, threshold_function, threshold_level,
+                 poll_time, max_poll_time=None, backoff=1.5, srq_wait=None):
+        self._read_func = read_func
+        self._threshold_function = threshold_function
+        self._threshold_level = threshold_level
+        self.poll_time = poll_time
+        if max_poll_time is None:
+            max_poll_time = 10 * poll_time
+        self.max_poll_time = max(max_poll_time, poll_time)
+        self.backoff = backoff
+        self._srq_wait = srq_wait
+        self._watches = set()  # the cancel events of the active watches
+        self._lock = threading.Lock()
+
+    def reached(self):
+        'Read the status once and check it against the threshold'
+        return self._threshold_function(self._read_func(),
+                                        self._threshold_level)
+
+    def _wait(self, interval, cancelled):
+        if self._srq_wait is not None and not cancelled.is_set():
+            try:
+                self._srq_wait(int(interval * 1000))
+            except Exception:
+                # timed out (or unsupported); poll anyway
+                pass
+            else:
+                return
+        cancelled.wait(interval)
+
+    def watch(self, status, on_reached=None):
+        '''Poll in the background and finish ``status`` at the threshold
+
+        Polling stops as soon as the status is done, e.g. when it times out,
+        so a stale watch never calls ``on_reached`` later on.
+
+        Parameters
+        ----------
+        status : StatusBase
+            Marked finished (successfully) once the threshold is crossed and
+            unsuccessfully if polling fails or is cancelled
+        on_reached : callable, optional
+            Called (with no arguments) before the status is finished
+        '''
+        cancelled = threading.Event()
+        with self._lock:
+            self._watches.add(cancelled)
+
+        def poll():
+            interval = self.poll_time
+            try:
+                while True:
+                    if cancelled.is_set():
+                        status._finished(success=False)
+                        return
+                    if self.reached():
+                        break
+                    self._wait(interval, cancelled)
+                    interval = min(interval * self.backoff,
+                                   self.max_poll_time)
+                if cancelled.is_set():
+                    # cancelled (or timed out) during the last read
+                    status._finished(success=False)
+                    return
+                if on_reached is not None:
+                    on_reached()
+            except Exception:
+                logger.exception('Status monitor failed')
+                status._finished(success=False)
+            else:
+                status._finished()
+            finally:
+                with self._lock:
+                    self._watches.discard(cancelled)
+
+        status.add_callback(cancelled.set)
+        threading.Thread(target=poll, daemon=True).start()
+        return status
+
+    def cancel(self):
+        'Stop polling; the watched statuses are marked as failed'
+        with self._lock:
+            watches = list(self._watches)
+        for cancelled in watches:
+            cancelled.set()
+
+
+_set_executor = None
+_set_lock = threading.Lock()
+
+
+def _get_set_executor():
+    '''The shared pool for delayed writes and the statuses they finish
+
+    Blocking writes and status callbacks run on this pool, never on the
+    timer scheduler thread, so that neither holds up the other timers.
+    '''
+    global _set_executor
+    with _set_lock:
+        if _set_executor is None:
+            _set_executor = ThreadPoolExecutor(
+                max_workers=8, thread_name_prefix='scpi-set')
+        return _set_executor
+
+
+def _finish_after_delay(pending, status, delay, func, *args):
+    '''Call func(*args) on the shared set pool after delay
+
+    The shared timer scheduler only hands func over to the pool. The timer
+    is tracked in ``pending`` (keyed by ``status``) until the status
+    finishes, so that `stop` can cancel it.
+    '''
+    pending[status] = timer_scheduler.call_later(
+        delay, _get_set_executor().submit, func, *args)
+    status.add_callback(lambda: pending.pop(status, None))
+
+
+def _cancel_delayed(pending):
+    '''Cancel the timers of `_finish_after_delay`, failing their statuses'''
+    for status, handle in list(pending.items()):
+        if handle.cancel():
+            pending.pop(status, None)
+            status._finished(success=False)
+
+
 class ScpiSignalBase(Signal):
     """A read-only (without a setter) SCPI-like signal
     SCPI generically indicates a non-pyepics instrument that has a control layer and a list of commands
@@ -32,16 +827,60 @@ class ScpiSignalBase(Signal):
     name  # TODO -- remove ??
     configs : dict, optional 
         The configuration dictionary that is sent to get if its a long getter
+    status_monitor : dict, optional
+        Wait for another command to reach a threshold (e.g. a count of
+        readings in a buffer) on trigger. Required keys are ``trig_name``,
+        ``trig_configs``, ``name``, ``configs``, ``threshold_function``,
+        ``threshold_level``, ``poll_time``, ``post_name`` and
+        ``post_configs``. Optional keys are ``max_poll_time``,
+        ``backoff``, ``use_srq`` and ``timeout``; see `ScpiStatusMonitor`
+    command_queue : ScpiCommandQueue or bool, optional
+        Send all instrument requests through this queue; if True, use the
+        queue shared by every signal on the control layer. Sets of plain
+        setters (see `settable_in_batch`) are queued as raw writes, so
+        consecutive sets are pipelined. By default the control layer is
+        called directly from the calling thread
+    cache_ttl : float, optional
+        Serve ``get`` from the last value read for this many seconds instead
+        of querying the instrument. Meant for configuration signals that
+        rarely change; writes through `ScpiSignal.set` invalidate the cache.
+        Defaults to None (no caching)
+    setpoint_cache : ScpiSetpointCache or bool, optional
+        Record the values written and read in this cache, and skip writing
+        a value equal to the recorded one (`ScpiSignal.set` with
+        ``force=True`` writes anyway); if True, use the cache shared by
+        every signal on the control layer. By default every set is written
+    array_dtype : numpy dtype or str, optional
+        Decode the values from the control layer as arrays of this type
+        (binary blocks, comma separated text or sequences; see
+        `decode_array`). By default values are used as returned
 
     """
     def __init__(self, *, control_layer, cmd_name, name=None,
                  precision=7, configs={}, dtype='number',
-                 shape=[], status_monitor=None,
+                 shape=[], status_monitor=None, command_queue=None,
+                 cache_ttl=None, array_dtype=None, setpoint_cache=None,
                  **kwargs):
 
         cmd = control_layer._cmds[cmd_name]
 
+        if command_queue is True:
+            command_queue = ScpiCommandQueue.for_control_layer(control_layer)
+        elif command_queue is False:
+            command_queue = None
+        self._command_queue = command_queue
+        if setpoint_cache is True:
+            setpoint_cache = ScpiSetpointCache.for_control_layer(control_layer)
+        elif setpoint_cache is False:
+            setpoint_cache = None
+        self._setpoints = setpoint_cache
+        self._setpoint_key = ScpiSetpointCache.key(cmd_name, configs)
+        self.cache_ttl = cache_ttl
+        self._cache_expires = None
+        self.array_dtype = None if array_dtype is None else np.dtype(array_dtype)
         self._control_layer = control_layer 
+        self._cmd = cmd
+        self._configs = configs
         composite_name = control_layer.name + '_' + cmd_name
         super().__init__(name=composite_name, **kwargs)
         self._read_name = composite_name
@@ -52,6 +891,7 @@ class ScpiSignalBase(Signal):
         self.dtype = dtype
         self.shape = shape
         self.delay = None
+        self._delayed = {}  # status -> TimerHandle of a pending delayed set
 
         # TODO: limits 
         # if control_layer._cmds[cmd_name].limits is not None:
@@ -73,40 +913,178 @@ class ScpiSignalBase(Signal):
             @wrapt.decorator
             def only_one_return(wrapped, instance, args, kwargs):
                 return wrapped(*args, **kwargs)[0]
-            self.get = functools.partial(control_layer.get, name=cmd.name, configs=configs)
+            self._get_func = functools.partial(self._control_get, name=cmd.name, configs=configs)
         else:
-            self.get = functools.partial(control_layer.get, name=cmd.name, configs=configs)
+            self._get_func = functools.partial(self._control_get, name=cmd.name, configs=configs)
 
         # TODO -- better way to do this? 
         # setup the setter in case this signal is a setter (will be converted to self.set in the subclass)
-        self._set = functools.partial(control_layer.set, name=cmd.name, configs=configs)
+        self._set = functools.partial(self._control_set, name=cmd.name, configs=configs)
 
         self._status_monitor = status_monitor 
         if status_monitor is not None:
             def trig_func():
                 for tname in status_monitor['trig_name']:
-                    control_layer.set(None, name=tname,
-                        configs=status_monitor['trig_configs'])
+                    self._control_set(None, name=tname,
+                                      configs=status_monitor['trig_configs'])
 
             self._trigger_func = trig_func
-            self._status_read = functools.partial(control_layer.get, name=status_monitor['name'],
+            self._status_read = functools.partial(self._control_get, name=status_monitor['name'],
                                                   configs=status_monitor['configs'])
-            self._threshold_function = status_monitor['threshold_function']
-            self._threshold_level = status_monitor['threshold_level']
-            self._poll_time = status_monitor['poll_time']
-            self._post_status = functools.partial(control_layer.set, name=status_monitor['post_name'],
+            self._post_status = functools.partial(self._control_set, name=status_monitor['post_name'],
                                                   configs=status_monitor['post_configs'])
+            srq_wait = None
+            if status_monitor.get('use_srq', False):
+                comm_handle = getattr(control_layer, 'comm_handle', None)
+                srq_wait = getattr(comm_handle, 'wait_for_srq', None)
+            self._monitor = ScpiStatusMonitor(
+                read_func=self._status_read,
+                threshold_function=status_monitor['threshold_function'],
+                threshold_level=status_monitor['threshold_level'],
+                poll_time=status_monitor['poll_time'],
+                max_poll_time=status_monitor.get('max_poll_time'),
+                backoff=status_monitor.get('backoff', 1.5),
+                srq_wait=srq_wait)
+            self._monitor_timeout = status_monitor.get('timeout')
+
+    def _control_get(self, name, configs):
+        if self._command_queue is None:
+            return self._control_layer.get(name=name, configs=configs)
+        return self._command_queue.get(name, configs).result()
+
+    def _control_set(self, value, name, configs):
+        if self._command_queue is None:
+            return self._control_layer.set(value, name=name, configs=configs)
+        return self._command_queue.set(value, name, configs).result()
+
+    def _ask(self, message):
+        if self._command_queue is None:
+            return self._control_layer._ask(message)
+        return self._command_queue.ask(message).result()
+
+    @property
+    def command_queue(self):
+        '''The ScpiCommandQueue requests go through (or None)'''
+        return self._command_queue
+
+    @property
+    def setpoint_cache(self):
+        '''The ScpiSetpointCache of this signal (or None)'''
+        return self._setpoints
+
+    def get(self, **kwargs):
+        '''Query the instrument for the current value
+
+        If ``cache_ttl`` is set the cached value is returned while it is
+        still fresh.
+        '''
+        if self.cached:
+            return self._readback
+        value = self._decode(self._get_func())
+        self._update_readback(value, time.time())
+        return value
+
+    def _decode(self, value):
+        'Decode a reply as an array of array_dtype, if that is set'
+        if self.array_dtype is not None:
+            value = decode_array(value, self.array_dtype)
+        return value
+
+    def _update_readback(self, value, timestamp):
+        self._readback = value
+        self._timestamp = timestamp
+        if self._setpoints is not None:
+            self._setpoints.confirm(self._setpoint_key, value)
+        if self.cache_ttl is not None:
+            self._cache_expires = time.monotonic() + self.cache_ttl
+
+    @property
+    def cached(self):
+        '''Is there a cached value that has not expired?'''
+        return (self._cache_expires is not None and
+                time.monotonic() < self._cache_expires)
+
+    def invalidate(self):
+        '''Drop the cached value; the next get queries the instrument'''
+        self._cache_expires = None
+
+    def refresh(self):
+        '''Query the instrument, updating the cache, and return the value'''
+        self.invalidate()
+        return self.get()
+
+    @property
+    def batchable(self):
+        '''Can this signal be read as part of a compound query?
+
+        Only plain getters qualify: commands with getter overrides or that
+        return arrays/images, and unconnected control layers, are read
+        individually.
+        '''
+        cmd = self._cmd
+        return (self.array_dtype is None and
+                hasattr(self._control_layer, '_ask') and
+                not getattr(self._control_layer, 'unconnected', False) and
+                getattr(cmd, 'getter', True) and
+                getattr(cmd, 'getter_override', None) is None and
+                not getattr(cmd, 'returns_image', False) and
+                not hasattr(cmd.getter_type, 'returns_array'))
+
+    def _query_string(self):
+        'The query sent to the instrument to read this signal'
+        return self._cmd.ascii_str_get.format(**self._configs)
+
+    @property
+    def settable_in_batch(self):
+        '''Can this signal be written as part of a compound write?
+
+        Like `batchable`, but for setters: commands with setter overrides
+        and unconnected control layers are written individually.
+        '''
+        cmd = self._cmd
+        return (hasattr(self._control_layer, '_ask') and
+                not getattr(self._control_layer, 'unconnected', False) and
+                getattr(cmd, 'setter', True) and
+                getattr(cmd, 'setter_override', None) is None)
+
+    def _record_write(self, value, success):
+        '''Update the setpoint cache (if any) around a write of value
+
+        ``success`` is None when the write starts (while it is pending the
+        instrument state is unknown), then True or False once it is done.
+        '''
+        if self._setpoints is None:
+            return
+        if success is None:
+            self._setpoints.forget(self._setpoint_key)
+        else:
+            self._setpoints.record_write(self._setpoint_key, value, success)
+
+    def _write_string(self, value):
+        '''The command sent to the instrument to set this signal to value
+
+        See `_format_set`, which the simulated control layer ``set`` uses
+        too.
+        '''
+        return _format_set(self._control_layer, self._cmd, value,
+                           self._configs)
 
     def trigger(self):
-        # first wait until another signal is ready, i.e. a count of readings in a buffer
+        if self._status_monitor is None:
+            super().trigger()
+            return NullStatus()
+
+        # the reading is ready once another signal reaches a threshold,
+        # i.e. a count of readings in a buffer; watch it in the background
+        self._trigger_func()
+        st = DeviceStatus(self, timeout=self._monitor_timeout)
+        return self._monitor.watch(st, on_reached=lambda: self._post_status(None))
+
+    def stop(self, *, success=False):
+        '''Stop waiting on a triggered status monitor or a delayed set'''
         if self._status_monitor is not None:
-            self._trigger_func()
-            while not (self._threshold_function(self._status_read(), self._threshold_level)):
-                time.sleep(self._poll_time)
-            self._post_status(None)
-        # now trigger
-        super().trigger()
-        return NullStatus()
+            self._monitor.cancel()
+        _cancel_delayed(self._delayed)
 
     def _repr_info(self):
         yield ('read_name', self._read_name)
@@ -170,28 +1148,249 @@ class ScpiSignal(ScpiSignalBase):
     configs : dict, optional 
         The configuration dictionary that is sent to get if its a long getter
     """
-    def set(self, value):        
+    def set(self, value, *, force=False):
+        '''Write value to the instrument
+
+        Parameters
+        ----------
+        value : any
+        force : bool, optional
+            Write even if value is the recorded setpoint (with a
+            ``setpoint_cache``); by default such writes are skipped and a
+            finished status is returned
+
+        Returns
+        -------
+        status : Status
+        '''
+        if (not force and self._setpoints is not None and
+                self._setpoints.suppress(self._setpoint_key, value)):
+            return Status(self, done=True, success=True)
+
         st = Status()
+        self.invalidate()
+        self._record_write(value, None)
 
         def check_return(ret):
+            # a read may have re-filled the cache while the write was pending
+            self.invalidate()
             if ret[0]:
                 st._finished()
 
-        if self.delay:
-            def sleep_and_finish():
-                ret = self._set(value=value)
-                time.sleep(self.delay)  # in sim.py time is imported as ttime, not sure why
-                check_return(ret)
-
-            threading.Thread(target=sleep_and_finish, daemon=True).start()
+        if self._command_queue is not None:
+            # queue the write without waiting for it; plain setters are
+            # queued as raw writes, which are pipelined with their
+            # neighbours (see ScpiCommandQueue)
+            pipelined = self.settable_in_batch
+            try:
+                if pipelined:
+                    future = self._command_queue.write(
+                        self._write_string(value))
+                else:
+                    future = self._command_queue.set(value, self._cmd.name,
+                                                     self._configs)
+            except Exception:
+                logger.exception('Setting %s to %r failed', self.name, value)
+                self._record_write(value, False)
+                st._finished(success=False)
+                return st
+
+            def written():
+                try:
+                    ret = future.result()
+                except Exception:
+                    logger.exception('Setting %s to %r failed', self.name,
+                                     value)
+                    self._record_write(value, False)
+                    st._finished(success=False)
+                    return
+                if pipelined:
+                    ret = (True, None)
+                self._record_write(value, bool(ret[0]))
+                if self.delay:
+                    _finish_after_delay(self._delayed, st, self.delay,
+                                        check_return, ret)
+                else:
+                    check_return(ret)
+
+            # finish the status off the queue worker thread: a status
+            # callback reading through the queue would otherwise wait on
+            # the worker that is running it
+            future.add_done_callback(
+                lambda future: _get_set_executor().submit(written))
+
+        elif self.delay:
+            # write on the shared set pool, then wait out the delay on the
+            # shared scheduler rather than in a sleeping thread
+            def write_then_delay():
+                try:
+                    ret = self._set(value=value)
+                except Exception:
+                    logger.exception('Setting %s to %r failed', self.name,
+                                     value)
+                    self._record_write(value, False)
+                    st._finished(success=False)
+                    return
+                self._record_write(value, bool(ret[0]))
+                _finish_after_delay(self._delayed, st, self.delay,
+                                    check_return, ret)
+
+            _get_set_executor().submit(write_then_delay)
 
         else:
             ret = self._set(value=value)
+            self._record_write(value, bool(ret[0]))
             check_return(ret)
 
         return st
 
 
+class AsyncControlLayerAdapter:
+    '''Expose a blocking SCPI-like control layer through coroutines
+
+    ``get`` and ``set`` are coroutines with the same signatures as the
+    wrapped control layer methods.  The blocking calls run on a
+    single-worker executor owned by the adapter, so requests to one
+    instrument are serialized and no thread is started per request.
+    Natively asynchronous control layers only need to provide the same
+    interface (``name``, ``_cmds`` and coroutine ``get``/``set``).
+
+    Parameters
+    ----------
+    control_layer :
+        The instrument control layer object with get, set and ``_cmds``
+    executor : concurrent.futures.Executor, optional
+        Where the blocking calls are run; defaults to a new single-worker
+        ThreadPoolExecutor
+    '''
+    def __init__(self, control_layer, *, executor=None):
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=1)
+        self._control_layer = control_layer
+        self._executor = executor
+        self.name = control_layer.name
+        self._cmds = control_layer._cmds
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(func, *args, **kwargs))
+
+    async def get(self, name, configs={}):
+        return await self._run(self._control_layer.get, name=name,
+                               configs=configs)
+
+    async def set(self, value, name, configs={}):
+        return await self._run(self._control_layer.set, value, name=name,
+                               configs=configs)
+
+
+class AsyncScpiSignalBase(ScpiSignalBase):
+    """A read-only SCPI-like signal on an asyncio control layer
+
+    The control layer ``get`` is awaited on ``loop``. `get_async` is the
+    awaitable reader; `get` blocks the calling thread on the event loop so
+    that the signal can still be read synchronously (e.g. by ``read()``),
+    but must not be called from the thread running the loop.
+
+    Keyword arguments are passed on to the base class (ScpiSignalBase)
+    initializer; status monitors are not supported
+
+    Parameters
+    ----------
+    control_layer :
+        A control layer with coroutine get and set methods, for example an
+        `AsyncControlLayerAdapter`
+    loop : asyncio.EventLoop, optional
+        The loop the control layer coroutines run on; uses
+        ``asyncio.get_event_loop()`` if unspecified
+    """
+    def __init__(self, *, control_layer, cmd_name, loop=None, **kwargs):
+        if kwargs.get('status_monitor') is not None:
+            raise ValueError('Status monitors are not supported on '
+                             'asyncio SCPI signals')
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        self.loop = loop
+        super().__init__(control_layer=control_layer, cmd_name=cmd_name,
+                         **kwargs)
+
+    def _submit(self, coro):
+        'Schedule a coroutine on the loop, returning a concurrent Future'
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def _run_blocking(self, coro):
+        if not self.loop.is_running():
+            return self.loop.run_until_complete(coro)
+
+        try:
+            # within a coroutine or callback this is the running loop
+            running_loop = asyncio.get_event_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self.loop:
+            coro.close()
+            raise RuntimeError('Can not block on the event loop from within '
+                               'it; await get_async() instead')
+        return self._submit(coro).result()
+
+    async def get_async(self):
+        '''Query the instrument for the current value'''
+        if self.cached:
+            return self._readback
+        value = self._decode(await self._get_func())
+        self._update_readback(value, time.time())
+        return value
+
+    def get(self, **kwargs):
+        return self._run_blocking(self.get_async())
+
+    @property
+    def batchable(self):
+        return False
+
+
+class AsyncScpiSignal(AsyncScpiSignalBase):
+    """A read-write SCPI-like signal on an asyncio control layer
+
+    `set` returns immediately; the write (and the optional ``delay``) is
+    awaited on the event loop, which finishes the returned Status. If the
+    loop is not running `set` runs it until the write completes.
+
+    Keyword arguments are passed on to the base class (AsyncScpiSignalBase)
+    initializer
+    """
+    async def set_async(self, value):
+        '''Write a value to the instrument, waiting ``delay`` afterwards'''
+        self.invalidate()
+        ret = await self._set(value=value)
+        self.invalidate()
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        return ret
+
+    def set(self, value):
+        st = Status(self)
+
+        def finish(future):
+            try:
+                ret = future.result()
+            except Exception:
+                logger.exception('Setting %s to %r failed', self.name, value)
+                st._finished(success=False)
+            else:
+                st._finished(success=bool(ret[0]))
+
+        if self.loop.is_running():
+            self._submit(self.set_async(value)).add_done_callback(finish)
+        else:
+            future = asyncio.ensure_future(self.set_async(value),
+                                           loop=self.loop)
+            future.add_done_callback(finish)
+            self.loop.run_until_complete(future)
+        return st
+
+
 class ScpiCompositeBase(Signal):
     """A read-only SCPI-like signal that originates from a composite function of multiple SCPI actions
 
@@ -200,16 +1399,22 @@ class ScpiCompositeBase(Signal):
     Parameters
     ----------
     get_func :
-        The command to read a value
+        The command to read a value; with ``sub_reads`` it is called with
+        the values of the sub-reads, in order, and combines them
     name : str
         The name of the command
     configs : dict, optional
         The configuration dictionary that is sent to get if its a long getter
+    sub_reads : sequence of ScpiSignalBase, optional
+        The signals the value is computed from. Declaring them lets the
+        sub-reads run concurrently on different instruments (see
+        `parallel_get`), also together with the other signals of a
+        `ScpiDevice`, instead of one after another inside ``get_func``
 
     """
     def __init__(self, *, get_func, name,
                 precision = 7, configs = {}, dtype = 'number',
-                shape = [], status_monitor = None,
+                shape = [], status_monitor = None, sub_reads=None,
                 **kwargs):
 
         self._read_name = name
@@ -220,6 +1425,7 @@ class ScpiCompositeBase(Signal):
         self.dtype = dtype
         self.shape = shape
         self.delay = None
+        self._delayed = {}  # status -> TimerHandle of a pending delayed set
 
         # TODO: limits
         # if control_layer._cmds[cmd_name].limits is not None:
@@ -237,7 +1443,7 @@ class ScpiCompositeBase(Signal):
         # self.enum_strs = list(control_layer._cmds[cmd.name].lookup.keys())
 
         self._get = get_func
-        self.get = self._get
+        self.sub_reads = None if sub_reads is None else tuple(sub_reads)
 
         # TODO -- better way to do this?
         # setup the setter in case this signal is a setter (will be converted to self.set in the subclass)
@@ -246,6 +1452,22 @@ class ScpiCompositeBase(Signal):
         if status_monitor is not None:
             print('Status monitor is not implemented for SCPI overrides')
 
+    def get(self, **kwargs):
+        '''Compute the value, running the sub-reads concurrently'''
+        if self.sub_reads is None:
+            value = self._get()
+            self._readback = value
+            self._timestamp = time.time()
+            return value
+        return parallel_get([self])[self]
+
+    def _combine(self, values):
+        '''Apply get_func to the values of the sub-reads (signal -> value)'''
+        value = self._get(*[values[sig] for sig in self.sub_reads])
+        self._readback = value
+        self._timestamp = time.time()
+        return value
+
     def trigger(self):
         super().trigger()
         return NullStatus()
@@ -320,10 +1542,11 @@ class ScpiCompositeSignal(ScpiCompositeBase):
 
     def __init__(self, *, get_func, name, set_func,
                 precision = 7, configs = {}, dtype = 'number',
-                shape = [], status_monitor = None,
+                shape = [], status_monitor = None, sub_reads=None,
                 **kwargs):
         self._set = set_func
-        super().__init__(get_func=get_func, name=name, configs=configs)
+        super().__init__(get_func=get_func, name=name, configs=configs,
+                         sub_reads=sub_reads)
 
     def set(self, value):
         st = Status()
@@ -333,12 +1556,13 @@ class ScpiCompositeSignal(ScpiCompositeBase):
                 st._finished()
 
         if self.delay:
-            def sleep_and_finish():
-                time.sleep(self.delay) # in sim.py time is imported as ttime, not sure why
+            def write():
                 ret = self._set(value=value)
                 check_return(ret)
 
-            threading.Thread(target=sleep_and_finish, daemon=True).start()
+            # wait out the delay on the shared scheduler, then write on the
+            # shared set pool so the write does not block the scheduler
+            _finish_after_delay(self._delayed, st, self.delay, write)
 
         else:
             ret = self._set(value=value)
@@ -346,6 +1570,225 @@ class ScpiCompositeSignal(ScpiCompositeBase):
 
         return st
 
+    def stop(self, *, success=False):
+        '''Stop waiting on a delayed set'''
+        _cancel_delayed(self._delayed)
+
+
+class ArrayRingBuffer:
+    '''A reusable, preallocated ring of array buffers
+
+    Arrays are copied into the next buffer of the ring and handed out as
+    read-only views, so the save function, statistics and other readers all
+    share one copy and resident memory is capped at ``count`` arrays. A
+    buffer is not reused while a background save of it is still pending
+    (see `hold`).  Readers must not keep a view for longer than ``count``
+    new arrays.
+
+    The buffers are allocated on the first array; if a later array has a
+    different shape or dtype the ring is reallocated.
+
+    Parameters
+    ----------
+    count : int
+        The number of buffers in the ring
+    memmap_dir : str, optional
+        Back the ring with a ``np.memmap`` file in this directory instead of
+        anonymous memory
+    '''
+    def __init__(self, count, *, memmap_dir=None):
+        if count < 1:
+            raise ValueError('A ring needs at least one buffer')
+        self.count = count
+        self.memmap_dir = memmap_dir
+        self._buffers = None
+        self._memmap_path = None
+        self._holds = [[] for _ in range(count)]
+        self._next = 0
+
+    @property
+    def shape(self):
+        return None if self._buffers is None else self._buffers.shape[1:]
+
+    @property
+    def dtype(self):
+        return None if self._buffers is None else self._buffers.dtype
+
+    def _allocate(self, shape, dtype):
+        self._wait(range(self.count))
+        self.close()
+        shape = (self.count, ) + tuple(shape)
+        if self.memmap_dir is None:
+            self._buffers = np.empty(shape, dtype=dtype)
+        else:
+            self._memmap_path = os.path.join(
+                self.memmap_dir, 'ring_{}.dat'.format(new_uid()))
+            self._buffers = np.memmap(self._memmap_path, mode='w+',
+                                      dtype=dtype, shape=shape)
+
+    def _wait(self, slots):
+        for slot in slots:
+            for future in self._holds[slot]:
+                try:
+                    future.result()
+                except Exception:
+                    # reported by whoever queued the save
+                    pass
+            self._holds[slot] = []
+
+    def store(self, array):
+        '''Copy ``array`` into the next buffer
+
+        Returns
+        -------
+        slot : int
+            The buffer used, for `hold`
+        view : np.ndarray
+            A read-only view of the buffer
+        '''
+        array = np.asarray(array)
+        if (self._buffers is None or self.shape != array.shape or
+                self.dtype != array.dtype):
+            self._allocate(array.shape, array.dtype)
+
+        slot = self._next
+        self._next = (slot + 1) % self.count
+        self._wait([slot])
+        buffer = self._buffers[slot]
+        np.copyto(buffer, array)
+        view = buffer.view()
+        view.flags.writeable = False
+        return slot, view
+
+    def hold(self, slot, future):
+        '''Do not reuse ``slot`` until ``future`` is done'''
+        self._holds[slot].append(future)
+
+    def close(self):
+        '''Release the buffers (removing the memmap file, if any)'''
+        self._buffers = None
+        if self._memmap_path is not None:
+            try:
+                os.remove(self._memmap_path)
+            except OSError:
+                pass
+            self._memmap_path = None
+
+
+class Hdf5FrameWriter:
+    '''Append array frames to one chunked, resizable HDF5 dataset
+
+    The dataset is created on the first frame with shape ``(0, *frame.shape)``
+    and grows by ``chunk_frames`` frames at a time; one HDF5 chunk holds
+    one frame.
+
+    Parameters
+    ----------
+    file_path : str
+        The HDF5 file to create
+    dataset : str, optional
+        The name of the dataset in the file
+    chunk_frames : int, optional
+        How many frames the dataset grows by when it is full
+    compression : str, optional
+        HDF5 compression filter, e.g. 'gzip'
+    '''
+    spec = 'SCPI_HDF5_STACK'
+    ext = 'h5'
+
+    def __init__(self, file_path, *, dataset='data', chunk_frames=64,
+                 compression=None):
+        if h5py is None:
+            raise ImportError('h5py is required for the HDF5 container')
+        self.file_path = file_path
+        self.dataset = dataset
+        self.chunk_frames = chunk_frames
+        self.compression = compression
+        self._file = None
+        self._data = None
+        self._frames = 0
+        self._lock = threading.Lock()
+
+    @property
+    def resource_kwargs(self):
+        return {'dataset': self.dataset}
+
+    def write(self, frame, array):
+        '''Write ``array`` as frame number ``frame``'''
+        array = np.asarray(array)
+        with self._lock:
+            if self._data is None:
+                self._file = h5py.File(self.file_path, 'w')
+                self._data = self._file.create_dataset(
+                    self.dataset, shape=(0, ) + array.shape,
+                    maxshape=(None, ) + array.shape, dtype=array.dtype,
+                    chunks=(1, ) + array.shape,
+                    compression=self.compression)
+            if frame >= self._data.shape[0]:
+                self._data.resize(frame + self.chunk_frames, axis=0)
+            self._data[frame] = array
+            self._frames = max(self._frames, frame + 1)
+
+    def close(self):
+        '''Trim the unused frames and close the file'''
+        with self._lock:
+            if self._file is not None:
+                self._data.resize(self._frames, axis=0)
+                self._file.close()
+            self._file = self._data = None
+
+
+class NpyStackWriter:
+    '''Write array frames into one preallocated, memory-mapped .npy stack
+
+    The file is created on the first frame with shape
+    ``(max_frames, *frame.shape)`` and can be read back with ``np.load``
+    (optionally with ``mmap_mode``).
+
+    Parameters
+    ----------
+    file_path : str
+        The .npy file to create
+    max_frames : int
+        The number of frames to preallocate
+    '''
+    spec = 'SCPI_NPY_STACK'
+    ext = 'npy'
+
+    def __init__(self, file_path, *, max_frames):
+        self.file_path = file_path
+        self.max_frames = max_frames
+        self._stack = None
+        self._lock = threading.Lock()
+
+    @property
+    def resource_kwargs(self):
+        return {}
+
+    def write(self, frame, array):
+        '''Write ``array`` as frame number ``frame``'''
+        array = np.asarray(array)
+        with self._lock:
+            if self._stack is None:
+                self._stack = np.lib.format.open_memmap(
+                    self.file_path, mode='w+', dtype=array.dtype,
+                    shape=(self.max_frames, ) + array.shape)
+        if frame >= self.max_frames:
+            raise IndexError('The stack in {} only holds {} frames'
+                             ''.format(self.file_path, self.max_frames))
+        self._stack[frame] = array
+
+    def close(self):
+        '''Flush the stack to disk and close it'''
+        with self._lock:
+            if self._stack is not None:
+                self._stack.flush()
+            self._stack = None
+
+
+CONTAINER_WRITERS = {'hdf5': Hdf5FrameWriter,
+                     'npy_stack': NpyStackWriter}
+
 
 class ScpiSignalFileSave(ScpiSignalBase):
     """
@@ -372,13 +1815,52 @@ class ScpiSignalFileSave(ScpiSignalBase):
         Precision that will be used when printing the file name
     dtype : 'string', optional
         The data-type for live display callbacks 
+    save_workers : int, optional
+        If non-zero, save in the background on a pool of this many threads;
+        ``trigger`` returns at once and its Status finishes when the file
+        has been written. Defaults to 0 (save before ``trigger`` returns)
+    max_pending_saves : int, optional
+        The most arrays waiting to be written in the background; ``trigger``
+        blocks while this many are pending, which bounds memory use
+    container : {'hdf5', 'npy_stack'}, optional
+        Instead of one file per trigger, append every array as a frame of a
+        single file per run: a chunked, resizable HDF5 dataset
+        (`Hdf5FrameWriter`) or a preallocated memory-mapped .npy stack
+        (`NpyStackWriter`). Each datum then carries its frame index.
+        ``save_func``, ``save_spec`` and ``save_ext`` are not used
+    container_kwargs : dict, optional
+        Passed on to the container writer, e.g. ``{'max_frames': 1000}``
+        (required for 'npy_stack')
+    buffer_count : int, optional
+        Keep the arrays in a preallocated `ArrayRingBuffer` of this many
+        buffers; saves, ``get_array`` and statistics then share read-only
+        views of one copy. Use at least ``max_pending_saves + 1`` buffers
+        with background saves. Defaults to None (no ring)
+    buffer_memmap_dir : str, optional
+        Back the ring with a memory-mapped file in this directory
     """
 
     def __init__(self, *args, save_path=None,
                  save_func=np.save, save_spec='NPY_SEQ', save_ext='npy',
                  dtype = 'string', precision = 80,
+                 save_workers=0, max_pending_saves=4,
+                 container=None, container_kwargs=None,
+                 buffer_count=None, buffer_memmap_dir=None,
                  **kwargs):
         super().__init__(*args, **kwargs)
+        self._buffers = None
+        if buffer_count:
+            self._buffers = ArrayRingBuffer(buffer_count,
+                                            memmap_dir=buffer_memmap_dir)
+        if container is not None and container not in CONTAINER_WRITERS:
+            raise ValueError('container must be one of {}'
+                             ''.format(sorted(CONTAINER_WRITERS)))
+        self.container = container
+        self.container_kwargs = dict(container_kwargs or {})
+        self._writer = None
+        self.save_workers = save_workers
+        self._save_executor = None
+        self._pending_saves = threading.BoundedSemaphore(max_pending_saves)
         self.save_func = save_func
         self.save_ext = save_ext
         self._resource_uid = None
@@ -395,6 +1877,7 @@ class ScpiSignalFileSave(ScpiSignalBase):
         self._result = {}
         self._value = None # where we hold the image in memory so that a stats module 
                            # can do calculations 
+        self.array_count = 0  # bumped for each new _value; keys stats caches
         self.dtype = dtype
         self.precision = precision
 
@@ -412,21 +1895,72 @@ class ScpiSignalFileSave(ScpiSignalBase):
                     'resource_kwargs': {},
                     'path_semantics': os.name}
 
+        if self.container is not None:
+            # one file for the whole run; frames are appended to it
+            writer_cls = CONTAINER_WRITERS[self.container]
+            self._file_stem = '{}.{}'.format(self._resource_uid,
+                                             writer_cls.ext)
+            self._writer = writer_cls(
+                os.path.join(self.save_path, self._file_stem),
+                **self.container_kwargs)
+            resource.update(spec=writer_cls.spec,
+                            resource_path=self._file_stem,
+                            resource_kwargs=self._writer.resource_kwargs)
+
         resource['uid'] = self._resource_uid
         self._asset_docs_cache.append(('resource', resource))
 
     def trigger(self):
-        super().trigger()
+        st = super().trigger()
+        if st.done:
+            return self._acquire()
+
+        # wait for the status monitor before reading the array
+        status = DeviceStatus(self)
+
+        def acquire():
+            if not st.success:
+                status._finished(success=False)
+                return
+            saved = self._acquire()
+            saved.add_callback(lambda: status._finished(success=saved.success))
+
+        st.add_callback(acquire)
+        return status
+
+    def _acquire(self):
         # save file stash file name
         self._result.clear()
+        saves = []
         for idx, (name, reading) in enumerate(super().read().items()):
 
             datum_cnt = next(self._datum_counter)
+            slot = None
+            if self._buffers is not None:
+                # from here on everybody shares a view of the ring buffer
+                slot, reading['value'] = self._buffers.store(reading['value'])
+
+            if self._writer is not None:
+                saves.append(self._save_frame(datum_cnt, reading['value']))
+                if slot is not None and saves[-1] is not None:
+                    self._buffers.hold(slot, saves[-1])
+                datum = {'resource': self._resource_uid,
+                         'datum_kwargs': dict(frame=datum_cnt),
+                         'datum_id': '{}/{}'.format(self._resource_uid,
+                                                    datum_cnt)}
+                self._asset_docs_cache.append(('datum', datum))
+                self._value = reading['value']
+                self.array_count += 1
+                reading['value'] = datum['datum_id']
+                self._result[name] = reading
+                continue
 
             # Save the actual reading['value'] to disk. 
             # Instrbuilder pulls the value into memory, ophyd saves it to disk
-            self.save_func('{}_{}_{}.{}'.format(self._path_stem, idx, datum_cnt,
-                                             self.save_ext), reading['value'])
+            saves.append(self._save('{}_{}_{}.{}'.format(self._path_stem, idx, datum_cnt,
+                                                         self.save_ext), reading['value']))
+            if slot is not None and saves[-1] is not None:
+                self._buffers.hold(slot, saves[-1])
             datum = {'resource': self._resource_uid,
                      'datum_kwargs': dict(index=idx)}
 
@@ -439,10 +1973,73 @@ class ScpiSignalFileSave(ScpiSignalBase):
             # a reference to Registry.
             # but first store a copy of the "image"
             self._value = reading['value']
+            self.array_count += 1
             reading['value'] = datum_id
             self._result[name] = reading
 
-        return NullStatus()
+        return self._saved_status([future for future in saves
+                                   if future is not None])
+
+    def _save(self, file_path, array):
+        '''Save now, or queue the save and return its Future'''
+        return self._run_save(self.save_func, file_path, array)
+
+    def _save_frame(self, frame, array):
+        '''Write a frame to the container now, or queue it'''
+        return self._run_save(self._writer.write, frame, array)
+
+    def _run_save(self, func, *args):
+        if not self.save_workers:
+            func(*args)
+            return None
+
+        if self._save_executor is None:
+            self._save_executor = ThreadPoolExecutor(
+                max_workers=self.save_workers)
+        self._pending_saves.acquire()
+        try:
+            future = self._save_executor.submit(func, *args)
+        except Exception:
+            self._pending_saves.release()
+            raise
+        future.add_done_callback(lambda future: self._pending_saves.release())
+        return future
+
+    def _saved_status(self, futures):
+        '''A Status that finishes once all of the save futures are done'''
+        if not futures:
+            return NullStatus()
+
+        st = DeviceStatus(self)
+        pending = set(futures)
+        lock = threading.Lock()
+
+        def saved(future):
+            if future.exception() is not None:
+                logger.error('Saving %s failed', self.name,
+                             exc_info=future.exception())
+                st._finished(success=False)
+                return
+            with lock:
+                pending.discard(future)
+                done = not pending
+            if done:
+                st._finished()
+
+        for future in futures:
+            future.add_done_callback(saved)
+        return st
+
+    def flush(self):
+        '''Wait for all of the background saves to be written'''
+        if self._save_executor is not None:
+            self._save_executor.shutdown(wait=True)
+            self._save_executor = None
+
+    @property
+    def batchable(self):
+        # arrays are never read with a compound query
+        return False
 
     def read(self):
         # The "value" read is the filename; this filename will be put into the
@@ -450,6 +2047,7 @@ class ScpiSignalFileSave(ScpiSignalBase):
         return self._result
 
     def get_array(self):
+        '''The last array read (a read-only view when using a ring buffer)'''
         return self._value
 
     def describe(self):
@@ -466,7 +2064,16 @@ class ScpiSignalFileSave(ScpiSignalBase):
         for item in items:
             yield item
 
+    def destroy(self):
+        if self._buffers is not None:
+            self._buffers.close()
+        super().destroy()
+
     def unstage(self):
+        self.flush()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
         self._resource_uid = None
         self._datum_counter = None
         self._asset_docs_cache.clear()
@@ -475,6 +2082,221 @@ class ScpiSignalFileSave(ScpiSignalBase):
         self._result.clear()
 
 
+class ScpiHdf5StackHandler:
+    '''Read frames written by `Hdf5FrameWriter` (for databroker)'''
+    specs = {Hdf5FrameWriter.spec}
+
+    def __init__(self, filename, root='', dataset='data'):
+        if h5py is None:
+            raise ImportError('h5py is required to read HDF5 containers')
+        self._name = os.path.join(root, filename)
+        self._dataset = dataset
+        self._file = None
+
+    def __call__(self, frame):
+        if self._file is None:
+            self._file = h5py.File(self._name, 'r')
+        return self._file[self._dataset][frame]
+
+    def get_file_list(self, datum_kwarg_gen):
+        "This method is optional. It is not needed for access, but for export."
+        return [self._name]
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        self._file = None
+
+
+class ScpiNpyStackHandler:
+    '''Read frames written by `NpyStackWriter` (for databroker)'''
+    specs = {NpyStackWriter.spec}
+
+    def __init__(self, filename, root=''):
+        self._name = os.path.join(root, filename)
+        self._stack = None
+
+    def __call__(self, frame):
+        if self._stack is None:
+            self._stack = np.load(self._name, mmap_mode='r')
+        return np.array(self._stack[frame])
+
+    def get_file_list(self, datum_kwarg_gen):
+        "This method is optional. It is not needed for access, but for export."
+        return [self._name]
+
+
+def fused_statistics(array, *, block_size=1 << 16):
+    """Compute sum, mean, std, min, max and len in a single pass
+
+    The array is walked once in blocks small enough to stay in cache; every
+    statistic is accumulated from the same block instead of each numpy
+    reduction streaming the whole array from memory. The variance uses
+    sums of squares shifted by the first element to avoid cancellation.
+
+    Parameters
+    ----------
+    array : array-like
+    block_size : int, optional
+        Number of elements reduced at a time
+
+    Returns
+    -------
+    stats : dict
+        Keyed by the names in `ArrayStatistics.stat_names`; ``std`` is the
+        population standard deviation, as from ``np.std``
+    """
+    arr = np.asarray(array).ravel()
+    n = arr.size
+    if n == 0:
+        return {'sum': arr.sum(), 'mean': np.nan, 'std': np.nan,
+                'min': np.nan, 'max': np.nan, 'len': len(array)}
+    if arr.dtype.kind not in 'biuf':
+        # e.g. complex traces: no shortcut, fall back to numpy
+        return {'sum': np.sum(arr), 'mean': np.mean(arr), 'std': np.std(arr),
+                'min': np.min(arr), 'max': np.max(arr), 'len': len(array)}
+
+    shift = np.float64(arr[0])
+    total = 0
+    sum_sq = 0.
+    minimum = maximum = arr[0]
+    for start in range(0, n, block_size):
+        block = arr[start:start + block_size]
+        total = total + block.sum()
+        shifted = block.astype(np.float64) - shift
+        sum_sq += np.dot(shifted, shifted)
+        # np.minimum/np.maximum propagate NaN like np.min/np.max do
+        minimum = np.minimum(minimum, block.min())
+        maximum = np.maximum(maximum, block.max())
+
+    mean = total / n
+    offset = mean - shift
+    variance = max(sum_sq / n - offset * offset, 0.)
+    return {'sum': total, 'mean': mean, 'std': np.sqrt(variance),
+            'min': minimum, 'max': maximum, 'len': len(array)}
+
+
+class ArrayStatistics:
+    """Statistics of an array source, computed once per new array
+
+    Parameters
+    ----------
+    get_array : callable
+        Returns the current array (e.g. ``ScpiSignalFileSave.get_array``)
+    get_key : callable, optional
+        Returns a value that changes whenever a new array is available (e.g.
+        the ``array_count`` of a ``ScpiSignalFileSave``); without it the
+        identity of the array object is used
+    block_size : int, optional
+        Passed to `fused_statistics`
+    """
+    stat_names = ('sum', 'mean', 'std', 'min', 'max', 'len')
+
+    def __init__(self, get_array, *, get_key=None, block_size=1 << 16):
+        self._get_array = get_array
+        self._get_key = get_key
+        self.block_size = block_size
+        self._key = None
+        self._stats = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def stat_name(stat_func):
+        """The fused statistic equivalent to ``stat_func``, or None"""
+        names = {np.sum: 'sum', np.mean: 'mean', np.std: 'std',
+                 np.min: 'min', np.max: 'max', len: 'len'}
+        for func_name in ('amin', 'amax'):
+            func = getattr(np, func_name, None)
+            if func is not None:
+                names.setdefault(func, func_name[1:])
+        try:
+            return names.get(stat_func)
+        except TypeError:
+            # unhashable callables are never fused
+            return None
+
+    def get(self, stat_name):
+        """The named statistic of the current array (None without one)"""
+        if stat_name not in self.stat_names:
+            raise KeyError(stat_name)
+        with self._lock:
+            array = self._get_array()
+            if array is None:
+                return None
+            key = (id(array) if self._get_key is None
+                   else (self._get_key(), id(array)))
+            if self._stats is None or key != self._key:
+                self._stats = fused_statistics(array,
+                                               block_size=self.block_size)
+                self._key = key
+            return self._stats[stat_name]
+
+    def invalidate(self):
+        """Drop the cached statistics"""
+        with self._lock:
+            self._key = None
+            self._stats = None
+
+
+class RunningStatistics:
+    """Statistics of a stream of values, updated block by block
+
+    `update` merges each block into the count, mean and sum of squared
+    deviations with the parallel form of Welford's algorithm, so the memory
+    use is constant and the variance stays accurate over long streams.
+    ``get`` has the interface of `ArrayStatistics`, so these can serve
+    `StatCalculator` signals.
+    """
+    stat_names = ArrayStatistics.stat_names
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget every value"""
+        with self._lock:
+            self.count = 0
+            self.mean = 0.
+            self._m2 = 0.
+            self.min = None
+            self.max = None
+
+    def update(self, values):
+        """Add a block of values"""
+        values = np.asarray(values, dtype=float).ravel()
+        count = len(values)
+        if not count:
+            return
+        mean = values.mean()
+        m2 = np.square(values - mean).sum()
+        low, high = values.min(), values.max()
+        with self._lock:
+            total = self.count + count
+            delta = mean - self.mean
+            self.mean += delta * count / total
+            self._m2 += m2 + delta * delta * self.count * count / total
+            self.count = total
+            self.min = low if self.min is None else np.minimum(self.min, low)
+            self.max = (high if self.max is None else
+                        np.maximum(self.max, high))
+
+    def get(self, stat_name):
+        """The named statistic of the values so far (None without any)"""
+        if stat_name not in self.stat_names:
+            raise KeyError(stat_name)
+        with self._lock:
+            if not self.count:
+                return None
+            if stat_name == 'len':
+                return self.count
+            if stat_name == 'sum':
+                return self.mean * self.count
+            if stat_name == 'std':
+                return np.sqrt(self._m2 / self.count)
+            return getattr(self, stat_name)
+
+
 class StatCalculator(SynSignal):
     """
     Evaluate a statistic from a Device that produces a 1D or 2D np.array
@@ -490,15 +2312,22 @@ class StatCalculator(SynSignal):
         name of the signal where the value is stored (e.g 'cam_img')
     stat_func : callable
         For example: np.mean
+    statistics : ArrayStatistics, optional
+        shared statistics engine; when ``stat_func`` has a fused equivalent
+        the value is served from its cache instead of walking the array again
 
     Example
     -------
     """
 
-    def __init__(self, name, stat_func, img=None, **kwargs):
+    def __init__(self, name, stat_func, img=None, statistics=None, **kwargs):
         self._img = img
+        self._statistics = statistics
+        self._stat_name = ArrayStatistics.stat_name(stat_func)
 
         def func():
+            if self._statistics is not None and self._stat_name is not None:
+                return self._statistics.get(self._stat_name)
             if self._img is not None:
                 m = self._img()        # the actual numeric value of the image is "hidden",
                                            # not accessible by read()
@@ -511,3 +2340,566 @@ class StatCalculator(SynSignal):
                 return None
 
         super().__init__(func=func, name=name, **kwargs)
+
+
+class ScpiTransaction:
+    """Stage sets of SCPI-like signals and write them together
+
+    `commit` writes the staged values with one compound program message per
+    control layer (``CMD1 x;CMD2 y;*OPC?``), instead of one ``set`` per
+    signal. The trailing ``*OPC?`` is answered once the instrument has
+    executed every command of the message, so the whole batch costs a
+    single round-trip. Signals that can not be written in a batch (see
+    `ScpiSignalBase.settable_in_batch`) and other signals are set
+    individually. The staged order is kept: the batches collected so far
+    are sent before each individual set, and an individual set is complete
+    before anything staged after it is written. The longest ``delay`` of
+    the batched signals is waited once, for the whole batch. Values equal
+    to the recorded setpoint of a signal with a ``setpoint_cache`` are not
+    written.
+
+    As a context manager the transaction commits on exit, unless the block
+    raised::
+
+        with meter.transaction() as txn:
+            txn.set(meter.nplc, 1)
+            txn.set(meter.mode, 'AC')
+        wait(txn.status)
+
+    Parameters
+    ----------
+    max_commands : int, optional
+        The maximum number of writes joined into one program message
+    obj : any, optional
+        The object of the returned status
+    check_errors : bool, optional
+        Also query the error queue (``SYST:ERR?``) after each compound
+        write and fail the status on an error. Instruments execute the
+        rest of a message after a bad command and still answer ``*OPC?``,
+        so without this an invalid value goes unnoticed. Off by default
+        as older errors in the queue would be blamed on the transaction
+    timeout : float, optional
+        How long to wait for an individual set to complete before writing
+        what was staged after it; defaults to no limit
+
+    Attributes
+    ----------
+    status : StatusBase or None
+        The status returned by `commit`
+    unapplied : list
+        The (signal, value) pairs that were never written because an
+        earlier write of the commit failed
+    """
+    def __init__(self, *, max_commands=16, obj=None, check_errors=False,
+                 timeout=None):
+        self.max_commands = max_commands
+        self.check_errors = check_errors
+        self.timeout = timeout
+        self.obj = obj
+        self.status = None
+        self.unapplied = []
+        self._staged = OrderedDict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.discard()
+
+    @property
+    def staged(self):
+        '''The staged (signal, value) pairs, in the order they will be set'''
+        return list(self._staged.items())
+
+    def set(self, signal, value):
+        '''Stage setting signal to value
+
+        Staging a signal again replaces its value and moves it to the end.
+        '''
+        if self.status is not None:
+            raise RuntimeError('The transaction was already committed')
+        self._staged.pop(signal, None)
+        self._staged[signal] = value
+
+    def discard(self):
+        '''Drop the staged values'''
+        self._staged.clear()
+
+    def commit(self):
+        '''Write the staged values
+
+        Returns
+        -------
+        status : StatusBase
+            Finished when every write is complete and the delay has passed;
+            failed if the instrument did not confirm a compound write or an
+            individual set failed. The values that were never written after
+            a failure are listed in `unapplied`.
+        '''
+        if self.status is not None:
+            raise RuntimeError('The transaction was already committed')
+
+        staged = [(sig, value) for sig, value in self._staged.items()
+                  if not (isinstance(sig, ScpiSignalBase) and
+                          sig._setpoints is not None and
+                          sig._setpoints.suppress(sig._setpoint_key, value))]
+        self._staged.clear()
+
+        statuses = []
+        pending = OrderedDict()  # control layer id -> staged batch
+        delay = 0
+
+        def send(chunks):
+            '''Flush chunks in order; return the writes left unsent'''
+            nonlocal delay
+            for idx, chunk in enumerate(chunks):
+                if not self._flush(chunk):
+                    return list(itertools.chain.from_iterable(
+                        chunks[idx + 1:]))
+                delay = max([delay] + [sig.delay or 0 for sig, _ in chunk])
+            return None
+
+        unsent = None
+        for idx, (sig, value) in enumerate(staged):
+            if isinstance(sig, ScpiSignalBase) and sig.settable_in_batch:
+                key = id(sig._control_layer)
+                pending.setdefault(key, []).append((sig, value))
+                if len(pending[key]) >= self.max_commands:
+                    unsent = send([pending.pop(key)])
+                if unsent is not None:
+                    break
+                continue
+
+            # send what was staged before this signal first
+            chunks = list(pending.values())
+            pending.clear()
+            unsent = send(chunks)
+            if unsent is not None:
+                unsent.append((sig, value))
+                break
+            st = sig.set(value)
+            statuses.append(st)
+            if idx + 1 < len(staged):
+                try:
+                    wait(st, timeout=self.timeout)
+                except Exception:
+                    logger.exception('Setting %s to %r failed', sig.name,
+                                     value)
+                    unsent = []
+                    break
+        else:
+            unsent = send(list(pending.values()))
+            pending.clear()
+
+        st = Status(self.obj)
+        if unsent is not None:
+            self.unapplied = (unsent +
+                              list(itertools.chain.from_iterable(
+                                  pending.values())) +
+                              staged[idx + 1:])
+            if self.unapplied:
+                logger.error('A write failed; never applied: %s',
+                             ', '.join('{}={!r}'.format(sig.name, value)
+                                       for sig, value in self.unapplied))
+            st._finished(success=False)
+        elif delay:
+            timer_scheduler.call_later(delay, _get_set_executor().submit,
+                                       st._finished)
+        else:
+            st._finished()
+        self.status = functools.reduce(operator.and_, statuses, st)
+        return self.status
+
+    def _flush(self, chunk):
+        'Write signals (all on one control layer) with one compound message'
+        sig = chunk[0][0]
+        queries = ['*OPC?']
+        if self.check_errors:
+            queries.append('SYST:ERR?')
+        try:
+            message = _program_message(
+                [s._write_string(value) for s, value in chunk] + queries)
+            replies = sig._ask(message).strip().split(';')
+            if len(replies) != len(queries) or int(replies[0]) != 1:
+                raise ValueError('Unexpected reply {!r} to {!r}'
+                                 ''.format(';'.join(replies), message))
+            if self.check_errors and int(replies[1].split(',')[0]) != 0:
+                raise ValueError('{!r} raised the instrument error {}'
+                                 ''.format(message, replies[1]))
+        except Exception:
+            logger.exception('Compound write to %s failed',
+                             sig._control_layer.name)
+            success = False
+        else:
+            success = True
+        for s, value in chunk:
+            s.invalidate()
+            s._record_write(value, success)
+        return success
+
+
+class ScpiDevice(Device):
+    """A Device of SCPI-like signals that batches instrument reads
+
+    ``read()`` and ``read_configuration()`` gather every batchable
+    ``ScpiSignalBase`` component that shares a control layer and read them
+    with one compound query (see `batch_get`) instead of one round-trip per
+    signal. The instruments are read concurrently (see `parallel_get`),
+    together with the sub-reads of composite components, whose values are
+    combined afterwards. Other components are read as usual. Likewise
+    ``configure()`` writes the new values with one `ScpiTransaction`.
+
+    Attributes
+    ----------
+    batch_max_commands : int
+        The maximum number of queries (or writes) joined into one program
+        message; keep this within the input buffer of the slowest instrument
+    configure_timeout : float
+        How long ``configure()`` waits for the writes to complete
+    check_errors : bool
+        Check the instrument error queue after the writes of a transaction
+        (see `ScpiTransaction`)
+    """
+    batch_max_commands = 16
+    configure_timeout = 10
+    check_errors = False
+
+    def _batched_read(self, kind, method):
+        components = [cpt for _, cpt in self._get_components_of_kind(kind)]
+        signals = [cpt for cpt in components
+                   if isinstance(cpt, ScpiSignalBase) and cpt.batchable]
+        signals.extend(cpt for cpt in components
+                       if isinstance(cpt, ScpiCompositeBase) and
+                       cpt.sub_reads is not None)
+        values = parallel_get(signals, max_commands=self.batch_max_commands)
+
+        res = OrderedDict()
+        for cpt in components:
+            if cpt in values:
+                res[cpt.name] = {'value': values[cpt],
+                                 'timestamp': cpt.timestamp}
+            else:
+                res.update(getattr(cpt, method)())
+        return res
+
+    def read(self):
+        return self._batched_read(Kind.normal, 'read')
+
+    def read_configuration(self):
+        return self._batched_read(Kind.config, 'read_configuration')
+
+    def transaction(self):
+        '''A `ScpiTransaction` to stage sets of the signals of this device'''
+        return ScpiTransaction(max_commands=self.batch_max_commands, obj=self,
+                               check_errors=self.check_errors,
+                               timeout=self.configure_timeout)
+
+    def configure(self, d):
+        '''Configure the device for something during a run
+
+        Like `Device.configure`, except that every key is validated before
+        anything is written and the values are written in one transaction.
+
+        Parameters
+        ----------
+        d : dict
+            The configuration dictionary. To specify the order that
+            the changes should be made, use an OrderedDict.
+
+        Returns
+        -------
+        (old, new) tuple of dictionaries
+        Where old and new are pre- and post-configure configuration states.
+        '''
+        for key in d:
+            if key not in self.configuration_attrs:
+                # a little extra checking for a more specific error msg
+                if key not in self.component_names:
+                    raise ValueError("There is no signal named %s" % key)
+                else:
+                    raise ValueError("%s is not one of the "
+                                     "configuration_fields, so it cannot be "
+                                     "changed using configure" % key)
+
+        old = self.read_configuration()
+        with self.transaction() as txn:
+            for key, val in d.items():
+                txn.set(getattr(self, key), val)
+        wait(txn.status, timeout=self.configure_timeout, poll_rate=0.005)
+        new = self.read_configuration()
+        return old, new
+
+
+class ScpiBurstFlyer(FlyerInterface, Device):
+    """Stream a buffered burst acquisition of a SCPI instrument as a flyer
+
+    `kickoff` sets ``configs``, starts the acquisition with the
+    ``trigger_names`` commands and returns once it is running. A background
+    thread then polls the number of readings in the instrument memory
+    (``count_name``) and reads them back in chunks (``fetch_name``, which
+    gets the configs ``{'count': n}`` and must remove what it returns, e.g.
+    'DATA:REMove? {count}'), so the instrument acquires at its own rate
+    instead of one round-trip per point.
+
+    The readings are emitted as event pages (one page per chunk) from
+    `collect_pages`, or as events from `collect`, and can be collected
+    while the acquisition runs. With ``save_path`` each chunk is instead
+    saved to a .npy file (spec 'NPY_SEQ', see `ophyd.sim.NumpySeqHandler`)
+    and the events hold datum ids; see `collect_asset_docs`. Saved chunks
+    all hold ``chunk_size`` readings: a chunk is only read back once it is
+    full, and the last one of an acquisition is padded with NaN (``collected``
+    counts the readings without padding).
+
+    Parameters
+    ----------
+    control_layer :
+        The instrument control layer object
+    fetch_name : str
+        The command that reads and removes up to ``count`` readings
+    count_name : str
+        The command that returns the number of readings in memory
+    trigger_names : sequence of str, optional
+        Commands (sent without a value) that start the acquisition
+    configs : dict, optional
+        Values set, in order, before the trigger, keyed by command name
+    num_points : int, optional
+        The number of readings to acquire; `complete` waits for them. By
+        default the acquisition runs until `complete`, which sends
+        ``abort_name`` and then reads what is left in memory
+    abort_name : str, optional
+        The command that stops the acquisition
+    chunk_size : int, optional
+        The most readings requested at once
+    poll_time : float, optional
+        The time between polls of ``count_name`` while there is no data; it
+        backs off by ``backoff`` up to ``max_poll_time``
+    save_path : str, optional
+        Save the chunks to this directory
+    stream_name : str, optional
+        Defaults to the name of the flyer
+    command_queue : ScpiCommandQueue or bool, optional
+        Send the instrument requests through this queue; if True, use the
+        queue shared by every signal on the control layer (see
+        `ScpiSignalBase`)
+
+    Subscribers to ``SUB_CHUNK`` get each chunk as it is read back (keyword
+    arguments ``chunk`` and ``timestamp``), e.g. to process a continuous
+    acquisition on the fly.
+    """
+    SUB_CHUNK = 'chunk'
+
+    def __init__(self, *, control_layer, fetch_name, count_name,
+                 trigger_names=('init', ), configs=None, num_points=None,
+                 abort_name=None, chunk_size=1000, poll_time=0.01,
+                 max_poll_time=0.2, backoff=1.5, save_path=None,
+                 stream_name=None, command_queue=None, name=None, **kwargs):
+        if name is None:
+            name = control_layer.name + '_' + fetch_name
+        super().__init__(name=name, **kwargs)
+        self._control_layer = control_layer
+        if command_queue is True:
+            command_queue = ScpiCommandQueue.for_control_layer(control_layer)
+        elif command_queue is False:
+            command_queue = None
+        self._command_queue = command_queue
+        self.fetch_name = fetch_name
+        self.count_name = count_name
+        self.trigger_names = list(trigger_names)
+        self.configs = OrderedDict(configs or {})
+        self.num_points = num_points
+        self.abort_name = abort_name
+        self.chunk_size = chunk_size
+        self.poll_time = poll_time
+        self.max_poll_time = max_poll_time
+        self.backoff = backoff
+        self.save_path = save_path
+        self.stream_name = stream_name or self.name
+
+        self._pages = deque()
+        self._asset_docs_cache = deque()
+        self._thread = None
+        self._complete_status = None
+        self._finishing = threading.Event()
+        self._stopped = threading.Event()
+        self.collected = 0
+        self._resource_uid = None
+        self._path_stem = None
+        self._chunk_counter = None
+
+    def kickoff(self):
+        if self._complete_status is not None and not self._complete_status.done:
+            raise RuntimeError("Already kicked off.")
+
+        self._pages.clear()
+        self._finishing.clear()
+        self._stopped.clear()
+        self.collected = 0
+        if self.save_path is not None:
+            self._resource_uid = new_uid()
+            self._path_stem = os.path.join(self.save_path, self._resource_uid)
+            self._chunk_counter = itertools.count()
+            self._asset_docs_cache.append(
+                ('resource', {'spec': 'NPY_SEQ',
+                              'root': self.save_path,
+                              'resource_path': self._resource_uid,
+                              'resource_kwargs': {},
+                              'path_semantics': os.name,
+                              'uid': self._resource_uid}))
+
+        kickoff_status = DeviceStatus(self)
+        self._complete_status = DeviceStatus(self)
+        self._thread = threading.Thread(
+            target=self._acquire, args=(kickoff_status, ), daemon=True,
+            name='{} burst'.format(self.name))
+        self._thread.start()
+        return kickoff_status
+
+    def complete(self):
+        if self._complete_status is None:
+            raise RuntimeError("No collection in progress")
+        if self.num_points is None:
+            # wrap up: the acquisition thread aborts and drains the memory
+            self._finishing.set()
+        return self._complete_status
+
+    def stop(self, *, success=False):
+        self._stopped.set()
+        self._finishing.set()
+
+    @property
+    def command_queue(self):
+        '''The ScpiCommandQueue requests go through (or None)'''
+        return self._command_queue
+
+    def _control_get(self, name, configs):
+        if self._command_queue is None:
+            return self._control_layer.get(name=name, configs=configs)
+        return self._command_queue.get(name, configs).result()
+
+    def _control_set(self, value, name, configs):
+        if self._command_queue is None:
+            return self._control_layer.set(value, name=name, configs=configs)
+        return self._command_queue.set(value, name, configs).result()
+
+    def _acquire(self, kickoff_status):
+        try:
+            for cmd_name, value in self.configs.items():
+                self._control_set(value, name=cmd_name, configs={})
+            for trigger_name in self.trigger_names:
+                self._control_set(None, name=trigger_name, configs={})
+        except Exception:
+            logger.exception('Starting the acquisition of %s failed',
+                             self.name)
+            kickoff_status._finished(success=False)
+            self._complete_status._finished(success=False)
+            return
+        kickoff_status._finished()
+
+        last_time = time.time()
+        poll_time = self.poll_time
+        aborted = False
+        try:
+            while not self._stopped.is_set():
+                if (self._finishing.is_set() and not aborted and
+                        self.abort_name is not None):
+                    self._control_set(None, name=self.abort_name, configs={})
+                    aborted = True
+
+                available = int(self._control_get(name=self.count_name,
+                                                   configs={}))
+                wanted = self.chunk_size
+                if self.num_points is not None:
+                    available = min(available,
+                                    self.num_points - self.collected)
+                    wanted = min(wanted, self.num_points - self.collected)
+                draining = self._finishing.is_set() and (
+                    aborted or self.abort_name is None)
+                # saved chunks are read back full, except for the last one
+                if available > 0 and (available >= wanted or draining or
+                                      self.save_path is None):
+                    chunk = np.asarray(self._control_get(
+                        name=self.fetch_name,
+                        configs={'count': min(available, self.chunk_size)}))
+                    if len(chunk):
+                        now = time.time()
+                        # spread the readings over the time since last read
+                        times = np.linspace(last_time, now,
+                                            len(chunk) + 1)[1:]
+                        last_time = now
+                        self._store(chunk, times)
+                        poll_time = self.poll_time
+                        continue
+
+                if (self.num_points is not None and
+                        self.collected >= self.num_points):
+                    break
+                if draining:
+                    break
+                self._finishing.wait(poll_time)
+                poll_time = min(poll_time * self.backoff, self.max_poll_time)
+        except Exception:
+            logger.exception('Reading the burst of %s failed', self.name)
+            self._complete_status._finished(success=False)
+            return
+
+        self._complete_status._finished(success=not self._stopped.is_set())
+
+    def _store(self, chunk, times):
+        self.collected += len(chunk)
+        self._run_subs(sub_type=self.SUB_CHUNK, chunk=chunk,
+                       timestamp=float(times[-1]))
+        if self.save_path is None:
+            times = times.tolist()
+            self._pages.append({'time': times,
+                                'data': {self.name: chunk.tolist()},
+                                'timestamps': {self.name: times}})
+            return
+
+        index = next(self._chunk_counter)
+        if len(chunk) < self.chunk_size:
+            chunk = np.concatenate(
+                [chunk, np.full(self.chunk_size - len(chunk), np.nan)])
+        np.save('{}_{}.npy'.format(self._path_stem, index), chunk)
+        datum_id = '{}/{}'.format(self._resource_uid, index)
+        self._asset_docs_cache.append(
+            ('datum', {'resource': self._resource_uid,
+                       'datum_kwargs': {'index': index},
+                       'datum_id': datum_id}))
+        self._pages.append({'time': [times[-1]],
+                            'data': {self.name: [datum_id]},
+                            'timestamps': {self.name: [times[-1]]}})
+
+    def collect_pages(self):
+        '''Yield the readings read back so far as event pages'''
+        while self._pages:
+            yield self._pages.popleft()
+
+    def collect(self):
+        '''Yield the readings read back so far as events'''
+        for page in self.collect_pages():
+            for idx, timestamp in enumerate(page['time']):
+                yield {'time': timestamp,
+                       'data': {key: values[idx]
+                                for key, values in page['data'].items()},
+                       'timestamps': {key: values[idx] for key, values
+                                      in page['timestamps'].items()}}
+
+    def collect_asset_docs(self):
+        items = list(self._asset_docs_cache)
+        self._asset_docs_cache.clear()
+        for item in items:
+            yield item
+
+    def describe_collect(self):
+        '''Describe details for the flyer collect() method'''
+        source = 'SCPI:{}:{}'.format(self._control_layer.name,
+                                     self.fetch_name)
+        if self.save_path is None:
+            desc = {'source': source, 'dtype': 'number', 'shape': []}
+        else:
+            desc = {'source': source, 'dtype': 'array',
+                    'shape': [self.chunk_size], 'external': 'FILESTORE:'}
+        return {self.stream_name: OrderedDict([(self.name, desc)])}
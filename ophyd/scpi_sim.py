@@ -0,0 +1,535 @@
+'''A simulated SCPI instrument for testing and benchmarking scpi_like
+
+`SimScpiInstrument` answers SCPI program messages from a configurable
+command table, with per-message and per-command latency and jitter, and
+returns arrays as ASCII lists or IEEE 488.2 definite-length binary blocks.
+`SimControlLayer` exposes it with the control layer interface the
+``scpi_like`` signals expect (``get``, ``set``, ``_ask``, ``_write`` and
+``_cmds``), either in-process or through a `SimScpiServer` on a localhost
+socket.
+'''
+import logging
+import random
+import socket
+import socketserver
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from .scpi_like import (_convert_reply, _format_set, ArrayReply,
+                        encode_binary_block)
+
+
+logger = logging.getLogger(__name__)
+
+
+class SimCommand:
+    '''A command of a simulated instrument
+
+    The attributes mirror those of an instrbuilder command, so that the
+    ``scpi_like`` signals can use it unchanged.
+
+    Parameters
+    ----------
+    name : str
+        The name the signals refer to the command by
+    header : str
+        The SCPI header, e.g. 'VOLT:NPLC'
+    value : optional
+        The initial (and ``*RST``) value
+    getter_type : callable, optional
+        Converts the reply string to a value; defaults to the type of value
+    lookup : dict, optional
+        Maps user values to instrument values
+    is_config : bool, optional
+    setter : bool, optional
+        Can be written; a write with no value (e.g. 'INIT') triggers the
+        action of the command
+    getter : bool, optional
+        Can be queried
+    array_dtype : numpy dtype or str, optional
+        Reply to queries with a binary block of this type; otherwise arrays
+        are sent as comma separated ASCII
+    latency, jitter : float, optional
+        Extra processing time of this command, in seconds, on top of the
+        instrument default; jitter adds up to that much at random
+    action : callable, optional
+        Called as ``action(instrument, value)`` after each write
+    query : callable, optional
+        Computes the reply to a query, ``query(instrument, argument)``,
+        instead of the stored value
+    get_args : str, optional
+        Arguments of the query, formatted with the signal configs, e.g.
+        '{count}' for 'DATA:REM? {count}'
+    doc : str, optional
+    '''
+    def __init__(self, name, header, *, value=0., getter_type=None,
+                 lookup=None, is_config=False, setter=True, getter=True,
+                 array_dtype=None, latency=0., jitter=0., action=None,
+                 query=None, get_args=None, doc=''):
+        self.name = name
+        self.header = header
+        self.default = value
+        self.ascii_str = header + ' {value}'
+        self.ascii_str_get = header + '?'
+        if get_args:
+            self.ascii_str_get += ' ' + get_args
+        self.array_dtype = array_dtype
+        if getter_type is None:
+            if array_dtype is not None:
+                getter_type = ArrayReply(array_dtype)
+            elif isinstance(value, np.ndarray):
+                getter_type = ArrayReply(value.dtype)
+            elif isinstance(value, (bool, int)):
+                getter_type = int
+            elif isinstance(value, float):
+                getter_type = float
+            else:
+                getter_type = str
+        self.getter_type = getter_type
+        self.getter_override = None
+        self.lookup = dict(lookup or {})
+        self.is_config = is_config
+        self.setter = setter
+        self.getter = getter
+        self.getter_inputs = 0
+        self.setter_inputs = 1 if setter else 0
+        self.returns_image = False
+        self.latency = latency
+        self.jitter = jitter
+        self.action = action
+        self.query = query
+        self.doc = doc
+
+    def parse(self, argument):
+        '''Convert a written argument to the stored value'''
+        if isinstance(self.default, (bool, int)):
+            return int(float(argument))
+        if isinstance(self.default, float):
+            return float(argument)
+        return argument
+
+    def format(self, value):
+        '''Format a value as the reply to a query'''
+        if isinstance(value, np.ndarray):
+            if self.array_dtype is not None:
+                return encode_binary_block(value, self.array_dtype)
+            return ','.join(map(repr, value.tolist())).encode()
+        return str(value).encode()
+
+
+class SimScpiInstrument:
+    '''The instrument side of the simulation
+
+    Parameters
+    ----------
+    commands : iterable of SimCommand, optional
+    latency : float, optional
+        Time to handle any program message (the transport round trip), in
+        seconds
+    jitter : float, optional
+        Up to this much is added to each message at random
+    seed : int, optional
+        Seed of the jitter
+    idn : str, optional
+        The reply to ``*IDN?``
+    '''
+    def __init__(self, commands=(), *, latency=0., jitter=0., seed=None,
+                 idn='OPHYD,SIMSCPI,0,1.0'):
+        self.latency = latency
+        self.jitter = jitter
+        self.idn = idn
+        self._random = random.Random(seed)
+        self._lock = threading.RLock()
+        self.commands = {}
+        self.state = {}
+        self.errors = deque(maxlen=32)
+        self.stats = dict(messages=0, commands=0, queries=0, writes=0)
+        for cmd in commands:
+            self.add_command(cmd)
+
+    def add_command(self, cmd):
+        self.commands[cmd.header.upper()] = cmd
+        self.state[cmd.header.upper()] = cmd.default
+        return cmd
+
+    def __getitem__(self, header):
+        return self.state[header.lstrip(':').upper()]
+
+    def __setitem__(self, header, value):
+        self.state[header.lstrip(':').upper()] = value
+
+    def reset(self):
+        '''Restore the initial values (``*RST``)'''
+        with self._lock:
+            for key, cmd in self.commands.items():
+                self.state[key] = cmd.default
+
+    def _delay(self, latency, jitter):
+        delay = latency
+        if jitter:
+            delay += self._random.uniform(0, jitter)
+        return delay
+
+    def handle(self, message):
+        '''Process a program message
+
+        Headers are resolved the way a SCPI instrument does: a header with
+        a leading ':' starts from the root of the command tree, and one
+        without it from the path of the previous header in the message
+        (``MEAS:VOLT:DC?;RANG?`` queries ``MEAS:VOLT:RANG``). Common
+        commands (``*OPC?``, ...) do not change the path.
+
+        Returns
+        -------
+        reply : bytes or None
+            The replies to the queries of the message joined with ';' (no
+            terminator), or None if there were no queries
+        '''
+        with self._lock:
+            self.stats['messages'] += 1
+            delay = self._delay(self.latency, self.jitter)
+            replies = []
+            path = ''
+            for unit in message.strip().split(';'):
+                unit = unit.strip()
+                if not unit:
+                    continue
+                self.stats['commands'] += 1
+                header, _, argument = unit.partition(' ')
+                header, path = self._resolve(header.upper(), path)
+                if header.endswith('?'):
+                    self.stats['queries'] += 1
+                    replies.append(self._query(header[:-1],
+                                               argument.strip()))
+                else:
+                    self.stats['writes'] += 1
+                    self._command(header, argument.strip())
+                cmd = self.commands.get(header.rstrip('?'))
+                if cmd is not None:
+                    delay += self._delay(cmd.latency, cmd.jitter)
+            if delay > 0:
+                time.sleep(delay)
+
+        if not replies:
+            return None
+        return b';'.join(replies)
+
+    @staticmethod
+    def _resolve(header, path):
+        '''The full header and the path the next header is relative to'''
+        if header.startswith('*'):
+            return header, path
+        if header.startswith(':'):
+            header = header[1:]
+        elif path:
+            header = path + ':' + header
+        return header, header.rpartition(':')[0]
+
+    def _error(self, code, text):
+        self.errors.append('{},"{}"'.format(code, text))
+        return b''
+
+    def _query(self, header, argument=''):
+        if header == '*IDN':
+            return self.idn.encode()
+        if header == '*OPC':
+            return b'1'
+        if header in ('SYST:ERR', 'SYSTEM:ERROR'):
+            if self.errors:
+                return self.errors.popleft().encode()
+            return b'0,"No error"'
+
+        cmd = self.commands.get(header)
+        if cmd is None:
+            return self._error(-113, 'Undefined header')
+        if not cmd.getter:
+            return self._error(-110, 'Command header error')
+        if cmd.query is not None:
+            return cmd.format(cmd.query(self, argument))
+        return cmd.format(self.state[header])
+
+    def _command(self, header, argument):
+        if header == '*RST':
+            self.reset()
+            return
+        if header == '*CLS':
+            self.errors.clear()
+            return
+        if header in ('*OPC', '*WAI'):
+            return
+
+        cmd = self.commands.get(header)
+        if cmd is None:
+            self._error(-113, 'Undefined header')
+            return
+        if not cmd.setter:
+            self._error(-110, 'Command header error')
+            return
+
+        value = None
+        if argument:
+            try:
+                value = cmd.parse(argument)
+            except ValueError:
+                self._error(-104, 'Data type error')
+                return
+            self.state[header] = value
+        if cmd.action is not None:
+            cmd.action(self, value)
+
+
+class SimControlLayer:
+    '''A control layer for a simulated instrument
+
+    Pass this as the ``control_layer`` of ``ScpiSignalBase``, ``ScpiSignal``
+    or ``ScpiSignalFileSave``.
+
+    Parameters
+    ----------
+    instrument : SimScpiInstrument
+        The instrument; its command table is used in either case
+    address : (host, port), optional
+        Talk to the instrument through the `SimScpiServer` at this address
+        instead of calling it in-process
+    name : str, optional
+    timeout : float, optional
+        Socket timeout, in seconds
+    '''
+    def __init__(self, instrument, *, address=None, name='sim', timeout=5.):
+        self.name = name
+        self.unconnected = False
+        self.comm_handle = None
+        self.instrument = instrument
+        self.address = address
+        self._cmds = {cmd.name: cmd for cmd in instrument.commands.values()}
+        self._sock = None
+        self._stream = None
+        self._lock = threading.Lock()
+        if address is not None:
+            self._sock = socket.create_connection(address, timeout=timeout)
+            self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._stream = self._sock.makefile('rb')
+
+    def _ask_raw(self, message):
+        'Send a message and return the raw reply (bytes, no terminator)'
+        if self._sock is None:
+            reply = self.instrument.handle(message)
+            return b'' if reply is None else reply
+
+        with self._lock:
+            self._sock.sendall(message.encode() + b'\n')
+            return _read_reply(self._stream)
+
+    def _ask(self, message):
+        return self._ask_raw(message).decode('latin-1')
+
+    def _write(self, message):
+        if self._sock is None:
+            self.instrument.handle(message)
+            return
+        with self._lock:
+            self._sock.sendall(message.encode() + b'\n')
+
+    def get(self, name, configs={}):
+        cmd = self._cmds[name]
+        message = cmd.ascii_str_get.format(**configs)
+        if getattr(cmd.getter_type, 'binary', False):
+            return _convert_reply(cmd, self._ask_raw(message))
+        return _convert_reply(cmd, self._ask(message))
+
+    def set(self, value, name, configs={}):
+        try:
+            message = _format_set(self, self._cmds[name], value, configs)
+        except ValueError:
+            return (False, None)
+        self._write(message)
+        return (True, None)
+
+    def close(self):
+        if self._sock is not None:
+            self._stream.close()
+            self._sock.close()
+            self._sock = None
+
+
+def _read_reply(stream):
+    '''Read one reply; a leading binary block is read by its length'''
+    if stream.peek(1)[:1] == b'#':
+        header = stream.read(2)
+        length = stream.read(int(header[1:2]))
+        data = stream.read(int(length))
+        # the terminator (or further ';' separated replies)
+        return header + length + data + stream.readline().rstrip(b'\n')
+    return stream.readline().rstrip(b'\n')
+
+
+class _SimRequestHandler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def handle(self):
+        for line in self.rfile:
+            reply = self.server.instrument.handle(line.decode('latin-1'))
+            if reply is not None:
+                self.wfile.write(reply + b'\n')
+
+
+class _ThreadingTCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class SimScpiServer:
+    '''Serve a `SimScpiInstrument` on a localhost socket
+
+    Messages are newline terminated, as with a raw socket (port 5025)
+    connection to a LAN instrument.
+
+    Parameters
+    ----------
+    instrument : SimScpiInstrument
+    host : str, optional
+    port : int, optional
+        Defaults to 0, any free port; see ``address``
+    '''
+    def __init__(self, instrument, *, host='127.0.0.1', port=0):
+        self.instrument = instrument
+        self._server = _ThreadingTCPServer((host, port), _SimRequestHandler)
+        self._server.instrument = instrument
+        self._thread = None
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._server.serve_forever,
+                                            name='sim-scpi-server',
+                                            daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SimReadingBuffer:
+    '''The reading memory of a simulated triggered instrument
+
+    Parameters
+    ----------
+    rate : float, optional
+        Readings per second once started; by default all of the readings are
+        available as soon as the acquisition starts
+    seed : int, optional
+    '''
+    def __init__(self, *, rate=None, seed=None):
+        self.rate = rate
+        self._rng = np.random.RandomState(seed)
+        self._readings = np.zeros(0, dtype=np.float32)
+        self._started = None
+        self._stopped = None
+        self._removed = 0
+
+    def start(self, count):
+        self._readings = self._rng.standard_normal(count).astype(np.float32)
+        self._started = time.monotonic()
+        self._stopped = None
+        self._removed = 0
+
+    def abort(self):
+        self._stopped = self.acquired
+
+    @property
+    def acquired(self):
+        'The number of readings taken so far'
+        if self._stopped is not None:
+            return self._stopped
+        if self._started is None:
+            return 0
+        count = len(self._readings)
+        if self.rate is None:
+            return count
+        return min(count, int((time.monotonic() - self._started) *
+                              self.rate))
+
+    @property
+    def points(self):
+        'The number of readings in the memory'
+        return self.acquired - self._removed
+
+    def fetch(self):
+        'All of the readings taken so far'
+        return self._readings[:self.acquired]
+
+    def remove(self, count):
+        'Read and remove up to count of the oldest readings'
+        count = min(int(count), self.points)
+        readings = self._readings[self._removed:self._removed + count]
+        self._removed += count
+        return readings
+
+
+def sim_multimeter(name='dmm', *, latency=0., jitter=0., points=1000,
+                   sample_rate=None, seed=None):
+    '''A simulated multimeter with a triggered, buffered acquisition
+
+    Commands: volt, curr (readings), nplc, mode (config), trig_source,
+    sample_count (config), init (starts an acquisition of sample_count
+    readings; see `SimReadingBuffer`), abort, npts (readings in memory),
+    fetch (the readings so far) and data_remove (read and remove up to
+    ``count`` readings). Readings are sent as binary blocks of float32.
+
+    Parameters
+    ----------
+    sample_rate : float, optional
+        Readings per second of an acquisition; instantaneous by default
+
+    Returns
+    -------
+    control_layer : SimControlLayer
+    '''
+    buffer = SimReadingBuffer(rate=sample_rate, seed=seed)
+
+    def acquire(instrument, value):
+        buffer.start(int(instrument['SAMP:COUN']))
+
+    inst = SimScpiInstrument(latency=latency, jitter=jitter, seed=seed)
+    inst.buffer = buffer
+    for cmd in (SimCommand('volt', 'MEAS:VOLT:DC', value=1.5, setter=False),
+                SimCommand('curr', 'MEAS:CURR:DC', value=1e-3, setter=False),
+                SimCommand('nplc', 'VOLT:NPLC', value=10., is_config=True),
+                SimCommand('mode', 'VOLT:MODE', value=1, is_config=True,
+                           lookup={'DC': 1, 'AC': 2}),
+                SimCommand('trig_source', 'TRIG:SOUR', value='IMM',
+                           is_config=True),
+                SimCommand('sample_count', 'SAMP:COUN', value=points,
+                           is_config=True),
+                SimCommand('init', 'INIT', value=None, getter=False,
+                           action=acquire),
+                SimCommand('abort', 'ABOR', value=None, getter=False,
+                           action=lambda instrument, value: buffer.abort()),
+                SimCommand('npts', 'DATA:POIN', value=0, setter=False,
+                           query=lambda instrument, arg: buffer.points),
+                SimCommand('fetch', 'FETC', value=np.zeros(0, np.float32),
+                           array_dtype='<f4', setter=False,
+                           query=lambda instrument, arg: buffer.fetch()),
+                SimCommand('data_remove', 'DATA:REM',
+                           value=np.zeros(0, np.float32), array_dtype='<f4',
+                           setter=False, get_args='{count}',
+                           query=lambda instrument, arg: buffer.remove(arg))):
+        inst.add_command(cmd)
+    return SimControlLayer(inst, name=name)
@@ -2,6 +2,7 @@
 import logging
 import time
 import threading
+import types
 
 import numpy as np
 
@@ -52,9 +53,20 @@ class Signal(OphydObject):
     rtolerance : any, optional
         The relative tolerance associated with the value
     '''
+    __slots__ = ('cl', '_readback', '_destroyed', '_timestamp', '_set_thread',
+                 '_tolerance', 'rtolerance', '_own_metadata')
+
     SUB_VALUE = 'value'
     SUB_META = 'meta'
     _default_sub = SUB_VALUE
+    # Signal defaults to being connected, with full read/write access.
+    # Subclasses are expected to clear these on init, if applicable, by
+    # changing _metadata; until then this is shared by every signal
+    _default_metadata = types.MappingProxyType(dict(
+        connected=True,
+        read_access=True,
+        write_access=True
+    ))
 
     def __init__(self, *, name, value=0., timestamp=None, parent=None,
                  labels=None, kind=Kind.hinted, tolerance=None,
@@ -77,13 +89,8 @@ class Signal(OphydObject):
         # self.tolerance is a property
         self.rtolerance = rtolerance
 
-        # Signal defaults to being connected, with full read/write access.
-        # Subclasses are expected to clear these on init, if applicable.
-        self._metadata = dict(
-            connected=True,
-            read_access=True,
-            write_access=True
-        )
+        # a copy of _default_metadata is made when it is first changed
+        self._own_metadata = None
 
     def trigger(self):
         '''Call that is used by bluesky prior to read()'''
@@ -273,25 +280,49 @@ class Signal(OphydObject):
         else:
             return {'fields': []}
 
+    @property
+    def _metadata(self):
+        '''The metadata of the signal, to be changed in place
+
+        Signals share the read-only `_default_metadata` until this is first
+        accessed, which gives the signal its own copy.
+        '''
+        metadata = self._own_metadata
+        if metadata is None:
+            metadata = self._own_metadata = dict(self._default_metadata)
+        return metadata
+
+    @_metadata.setter
+    def _metadata(self, metadata):
+        self._own_metadata = metadata
+
+    @property
+    def _current_metadata(self):
+        'The metadata of the signal, without copying the shared default'
+        metadata = self._own_metadata
+        if metadata is None:
+            return self._default_metadata
+        return metadata
+
     @property
     def connected(self):
         'Is the signal connected to its associated hardware?'
-        return self._metadata.get('connected')
+        return self._current_metadata.get('connected')
 
     @property
     def read_access(self):
         'Can the signal be read?'
-        return self._metadata.get('read_access')
+        return self._current_metadata.get('read_access')
 
     @property
     def write_access(self):
         'Can the signal be written to?'
-        return self._metadata.get('write_access')
+        return self._current_metadata.get('write_access')
 
     @property
     def metadata(self):
         'All metadata associated with the signal'
-        return dict(self._metadata)
+        return dict(self._current_metadata)
 
     def destroy(self):
         '''Disconnect the Signal from the underlying control layer
@@ -581,7 +612,7 @@ class EpicsSignalBase(Signal):
 
             return new_instance
 
-    def subscribe(self, callback, event_type=None, run=True):
+    def subscribe(self, callback, event_type=None, run=True, **kwargs):
         if event_type is None:
             event_type = self._default_sub
 
@@ -602,7 +633,8 @@ class EpicsSignalBase(Signal):
                 self._read_pv.add_callback(self._read_changed,
                                            run_now=self._read_pv.connected)
 
-        return super().subscribe(callback, event_type=event_type, run=run)
+        return super().subscribe(callback, event_type=event_type, run=run,
+                                 **kwargs)
 
     def _ensure_connected(self, pv, *, timeout):
         'Ensure that `pv` is connected, with access/connection callbacks run'
@@ -871,7 +903,7 @@ class EpicsSignal(EpicsSignalBase):
         #  (2) a completely separate PV instance
         # It will not be None, until destroy() is called.
 
-    def subscribe(self, callback, event_type=None, run=True):
+    def subscribe(self, callback, event_type=None, run=True, **kwargs):
         if event_type is None:
             event_type = self._default_sub
 
@@ -893,7 +925,8 @@ class EpicsSignal(EpicsSignalBase):
                 self._write_pv.add_callback(self._write_changed,
                                             run_now=self._write_pv.connected)
 
-        return super().subscribe(callback, event_type=event_type, run=run)
+        return super().subscribe(callback, event_type=event_type, run=run,
+                                 **kwargs)
 
     def wait_for_connection(self, timeout=1.0):
         '''Wait for the underlying signals to initialize or connect'''
@@ -0,0 +1,245 @@
+import gc
+import importlib
+import json
+import sys
+import types
+import weakref
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+
+from ophyd.ophydobj import OphydObject
+
+signal = pytest.importorskip('scipy.signal')
+
+
+def fake_instrbuilder(directory):
+    '''Stand-ins for the instrbuilder modules that ee_instruments imports'''
+    modules = {name: types.ModuleType(name) for name in
+               ('instrbuilder', 'instrbuilder.config', 'instrbuilder.scpi',
+                'instrbuilder.ic', 'instrbuilder.instruments')}
+    modules['instrbuilder.config'].data_save = types.SimpleNamespace(
+        directory=directory)
+    modules['instrbuilder.scpi'].SCPI = type('SCPI', (), {})
+    modules['instrbuilder.ic'].IC = type('IC', (), {})
+    instruments = modules['instrbuilder.instruments']
+    for name in ('KeysightMultimeter', 'RigolPowerSupply', 'SRSLockIn',
+                 'KeysightOscilloscope'):
+        setattr(instruments, name, type(name, (), {}))
+    return modules
+
+
+@pytest.fixture(scope='module')
+def ee(tmp_path_factory):
+    try:
+        import instrbuilder  # noqa
+        fakes = {}
+    except ImportError:
+        fakes = fake_instrbuilder(str(tmp_path_factory.mktemp('data')))
+    with patch.dict(sys.modules, fakes):
+        sys.modules.pop('ophyd.ee_instruments', None)
+        yield importlib.import_module('ophyd.ee_instruments')
+
+
+def lowpass_input(points=2000, sample_rate=1000.):
+    rng = np.random.RandomState(0)
+    t = np.arange(points) / sample_rate
+    return 1 + np.sin(2 * np.pi * 3 * t) + 0.1 * rng.randn(points)
+
+
+def test_create_filter_sos(ee):
+    sos = ee.create_filter_sos(4, 1000., 0.01)
+    assert ee.create_filter_sos(4, 1000., 0.01) is sos
+    assert np.allclose(sos, ee.create_filter(4, 1000., 0.01, output='sos'))
+
+
+def test_decimate_filtered(ee):
+    arr = np.arange(200)
+    # 5 time constants of settling, then one point per time constant
+    assert list(ee.decimate_filtered(arr, 1000., 0.01)) == list(range(50, 200,
+                                                                      10))
+
+
+def test_filter_cache(ee):
+    arrays = [lowpass_input()]
+    cache = ee.FilterCache(lambda: arrays[-1])
+    sos = ee.create_filter_sos(4, 1000., 0.01)
+    expected = ee.decimate_filtered(signal.sosfiltfilt(sos, arrays[-1]),
+                                    1000., 0.01)
+    filtered = cache.get(4, 1000., 0.01)
+    assert np.allclose(filtered, expected)
+    assert cache.get(4, 1000., 0.01) is filtered
+
+    # a new array is filtered again
+    arrays.append(2 * arrays[-1])
+    assert np.allclose(cache.get(4, 1000., 0.01), 2 * expected)
+
+    arrays.append(None)
+    assert cache.get(4, 1000., 0.01) is None
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 64, 2000])
+def test_streaming_filter(ee, chunk_size):
+    arr = lowpass_input()
+    stream = ee.StreamingFilter(4, 1000., 0.01)
+    sos = ee.create_filter_sos(4, 1000., 0.01)
+    output_signal, _ = signal.sosfilt(sos, arr,
+                                      zi=signal.sosfilt_zi(sos) * arr[0])
+    expected = ee.decimate_filtered(output_signal, 1000., 0.01)
+
+    decimated = [stream.update(arr[start:start + chunk_size])
+                 for start in range(0, len(arr), chunk_size)]
+    assert np.allclose(np.concatenate(decimated), expected)
+    assert stream.get('len') == len(expected)
+    assert np.isclose(stream.get('mean'), np.mean(expected))
+    assert np.isclose(stream.get('std'), np.std(expected))
+
+    stream.reset()
+    assert stream.get('len') is None
+    assert np.allclose(stream.update(arr), expected)
+
+
+def stub_command(name, header, **kwargs):
+    cmd = dict(name=name, ascii_str=header + ' {value}', is_config=False,
+               setter=True, getter_inputs=0, setter_inputs=1,
+               read_write='R/W', getter_type=float)
+    cmd.update(kwargs)
+    return types.SimpleNamespace(**cmd)
+
+
+@pytest.fixture
+def scpi_obj(ee):
+    class StubScpi(ee.scpi.SCPI):
+        'A control layer with a command table and no instrument'
+        def __init__(self):
+            self.name = 'stub'
+            self.unconnected = True
+            self._cmds = {}
+            for cmd in (stub_command('nplc', 'VOLT:NPLC', is_config=True),
+                        stub_command('volt', 'MEAS:VOLT:DC', setter=False)):
+                self._cmds[cmd.name] = cmd
+
+    ee._plan_cache.clear()
+    ee._class_cache.clear()
+    yield StubScpi()
+    ee._plan_cache.clear()
+    ee._class_cache.clear()
+
+
+def test_generate_ophyd_obj(ee, scpi_obj):
+    cls, components = ee.generate_ophyd_obj('Stub', scpi_obj)
+    assert set(components) == {'nplc', 'volt', 'unconnected'}
+    assert components['nplc'].kind & ee.Kind.config
+    assert ee.generate_ophyd_obj('Stub', scpi_obj)[0] is cls
+
+    ttl_cls, ttl_components = ee.generate_ophyd_obj('Stub', scpi_obj,
+                                                    config_cache_ttl=5)
+    assert ttl_cls is not cls
+    assert ttl_components['nplc'].kwargs['cache_ttl'] == 5
+    assert 'cache_ttl' not in ttl_components['volt'].kwargs
+
+
+def test_generate_ophyd_obj_table_change(ee, scpi_obj):
+    key = ee.command_table_key(scpi_obj)
+    cls, _ = ee.generate_ophyd_obj('Stub', scpi_obj)
+
+    scpi_obj._cmds['curr'] = stub_command('curr', 'MEAS:CURR:DC',
+                                          setter=False)
+    assert ee.command_table_key(scpi_obj) != key
+    new_cls, components = ee.generate_ophyd_obj('Stub', scpi_obj)
+    assert new_cls is not cls
+    assert 'curr' in components
+
+
+def test_generate_ophyd_obj_cache_dir(ee, scpi_obj, tmp_path):
+    key = ee.command_table_key(scpi_obj)
+    path = tmp_path / '{}-{}.json'.format(*key)
+    ee.generate_ophyd_obj('Stub', scpi_obj, cache_dir=str(tmp_path))
+    assert [p.name for p in tmp_path.iterdir()] == [path.name]
+    cached = json.loads(path.read_text())
+    assert cached['key'] == list(key)
+    assert list(cached['plan']) == ['nplc', 'volt']
+
+    # a fresh session plans from the file
+    cached['plan'].pop('volt')
+    path.write_text(json.dumps(cached))
+    ee._plan_cache.clear()
+    ee._class_cache.clear()
+    _, components = ee.generate_ophyd_obj('Stub', scpi_obj,
+                                          cache_dir=str(tmp_path))
+    assert set(components) == {'nplc', 'unconnected'}
+
+    # corrupt and stale files are rebuilt
+    for text in ('{"key": ', json.dumps({'key': ['other', 'key'],
+                                         'plan': {}})):
+        path.write_text(text)
+        ee._plan_cache.clear()
+        ee._class_cache.clear()
+        _, components = ee.generate_ophyd_obj('Stub', scpi_obj,
+                                              cache_dir=str(tmp_path))
+        assert set(components) == {'nplc', 'volt', 'unconnected'}
+        assert json.loads(path.read_text())['key'] == list(key)
+    assert [p.name for p in tmp_path.iterdir()] == [path.name]
+
+
+def test_generate_ophyd_obj_releases_class(ee, scpi_obj):
+    cls, _ = ee.generate_ophyd_obj('Stub', scpi_obj)
+    cls_ref = weakref.ref(cls)
+    del cls
+    gc.collect()
+    assert cls_ref() is None
+    assert not ee._class_cache[scpi_obj]
+
+    # a class lives no longer than its control layer
+    other = type(scpi_obj)()
+    cls_ref = weakref.ref(ee.generate_ophyd_obj('Stub', other)[0])
+    assert len(ee._class_cache) == 2
+    del other
+    gc.collect()
+    assert cls_ref() is None
+    assert len(ee._class_cache) == 1
+
+
+def test_filter_statistics_streaming(ee):
+    class ChunkSource(OphydObject):
+        SUB_CHUNK = 'chunk'
+
+    def streamed(arr, order):
+        sos = ee.create_filter_sos(order, 1000., 0.01)
+        output_signal, _ = signal.sosfilt(sos, arr,
+                                          zi=signal.sosfilt_zi(sos) * arr[0])
+        return ee.decimate_filtered(output_signal, 1000., 0.01)
+
+    def stats(stat_name):
+        sig = getattr(fs, stat_name)
+        sig.trigger()
+        return sig.get()
+
+    def feed(arr):
+        for start in range(0, len(arr), 64):
+            source._run_subs(sub_type=source.SUB_CHUNK,
+                             chunk=arr[start:start + 64], timestamp=0.)
+
+    source = ChunkSource(name='src')
+    fs = ee.FilterStatistics(source, name='fs', sample_rate=1000.,
+                             tau=0.01, streaming=True)
+    assert fs.filtered is None
+    arr = lowpass_input()
+    feed(arr)
+    for func, order in fs.filter_orders.items():
+        expected = streamed(arr, order)
+        assert np.isclose(stats(func + '_mean'), np.mean(expected))
+        assert np.isclose(stats(func + '_std'), np.std(expected))
+
+    # a changed filter starts over; the others keep their statistics
+    fs.set_filter('filter_6dB', order=2)
+    assert stats('filter_6dB_mean') is None
+    assert stats('filter_24dB_mean') is not None
+    feed(arr)
+    assert np.isclose(stats('filter_6dB_mean'), np.mean(streamed(arr, 2)))
+
+    fs.reset()
+    assert stats('filter_24dB_mean') is None
+    fs.update(arr)
+    assert np.isclose(stats('filter_24dB_std'), np.std(streamed(arr, 4)))
@@ -154,3 +154,82 @@ def test_subscribe_no_default():
 
     with pytest.raises(ValueError):
         o.subscribe(lambda *a, **k: None)
+
+
+def test_subscription_table():
+    class TestObj(OphydObject):
+        SUB_TEST = 'value'
+        _SUB_PRIVATE = '_private'
+
+    class SubObj(TestObj):
+        SUB_OTHER = 'other'
+
+    assert TestObj._subscription_table == {'value', '_private'}
+    assert SubObj._subscription_table == {'value', '_private', 'other'}
+    assert OphydObject(name='name').event_types == ()
+
+    test_obj = SubObj(name='name', parent=None)
+    assert test_obj.subscriptions is SubObj._subscription_table
+    # nothing is allocated until it is needed
+    assert test_obj._callbacks is None
+    test_obj.unsubscribe(0)
+    test_obj.clear_sub(print)
+    test_obj.unsubscribe_all()
+    test_obj._run_subs(sub_type='value', value=1)
+    assert test_obj._callbacks is None
+
+    hits = []
+    test_obj.subscribe(lambda value, **kwargs: hits.append(value), 'value')
+    test_obj.subscribe(lambda **kwargs: hits.append(None), 'other')
+    assert hits == [1]
+
+    # assigned event types apply to this object only
+    test_obj.subscriptions = test_obj.subscriptions | {'extra'}
+    test_obj.subscribe(lambda value, **kwargs: hits.append(value), 'extra')
+    test_obj._run_subs(sub_type='extra', value=2)
+    assert hits == [1, 2]
+    assert 'extra' not in SubObj(name='other').subscriptions
+
+
+def test_callback_snapshot():
+    class TestObj(OphydObject):
+        SUB_TEST = 'value'
+
+    test_obj = TestObj(name='name', parent=None)
+    hits = []
+
+    def once(value, **kwargs):
+        hits.append(('once', value))
+        test_obj.unsubscribe(once_cid)
+
+    def late(value, **kwargs):
+        hits.append(('late', value))
+
+    def adder(value, **kwargs):
+        hits.append(('adder', value))
+        if value == 1:
+            test_obj.subscribe(late, 'value', run=False)
+
+    once_cid = test_obj.subscribe(once, 'value', run=False)
+    test_obj.subscribe(adder, 'value', run=False)
+    # changes made by callbacks apply from the next _run_subs on
+    test_obj._run_subs(sub_type='value', value=1)
+    assert hits == [('once', 1), ('adder', 1)]
+    test_obj._run_subs(sub_type='value', value=2)
+    assert hits[2:] == [('adder', 2), ('late', 2)]
+
+    # the cached arguments are replayed to new subscribers
+    test_obj.subscribe(late, 'value')
+    assert hits[-1] == ('late', 2)
+    test_obj.clear_sub(late)
+    test_obj.clear_sub(adder)
+    assert test_obj._callback_snapshot == {'value': ()}
+
+
+def test_logger_name():
+    parent = OphydObject(name='parent', parent=None)
+    child = OphydObject(name='parent_child', parent=parent)
+    assert child._log is None
+    assert parent.log.name == 'ophyd.ophydobj.parent'
+    assert child.log.name == 'ophyd.ophydobj.parent.child'
+    assert child.log is logging.getLogger('ophyd.ophydobj.parent.child')
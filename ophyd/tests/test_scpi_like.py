@@ -0,0 +1,751 @@
+import asyncio
+import logging
+import operator
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from ophyd import Component as Cpt
+from ophyd.ophydobj import Kind
+from ophyd.scpi_like import (ScpiSignal, ScpiSignalBase, ScpiDevice,
+                             ScpiCompositeSignal,
+                             ScpiSignalFileSave, ArrayRingBuffer,
+                             ScpiStatusMonitor, ScpiCommandQueue, batch_get,
+                             ScpiSetpointCache,
+                             AsyncControlLayerAdapter, AsyncScpiSignal,
+                             AsyncScpiSignalBase,
+                             ScpiHdf5StackHandler, ScpiNpyStackHandler,
+                             ArrayStatistics, StatCalculator,
+                             RunningStatistics,
+                             fused_statistics, parse_binary_block,
+                             encode_binary_block, decode_array,
+                             parse_ascii_array, _program_message)
+from ophyd.status import Status, wait
+from ophyd.utils.timers import timer_scheduler
+
+logger = logging.getLogger(__name__)
+
+
+def str_to_array(reply):
+    return np.array(reply.strip().split(','), dtype=float)
+
+
+str_to_array.returns_array = True
+
+
+class FakeCommand:
+    def __init__(self, name, ascii_str, *, getter_type=float, lookup=None,
+                 is_config=False):
+        self.name = name
+        self.ascii_str = ascii_str + ' {value}'
+        self.ascii_str_get = ascii_str + '?'
+        self.getter = True
+        self.getter_type = getter_type
+        self.getter_override = None
+        self.lookup = lookup or {}
+        self.is_config = is_config
+        self.doc = ''
+        self.returns_image = False
+
+
+class FakeInstrument:
+    '''A control layer that answers from a dictionary of SCPI headers'''
+    def __init__(self, name='inst'):
+        self.name = name
+        self.unconnected = False
+        self._cmds = {}
+        self.state = {}
+        self.messages = []
+
+    def add(self, name, header, value, **kwargs):
+        self._cmds[name] = FakeCommand(name, header, **kwargs)
+        self.state[header] = value
+
+    def _ask(self, message):
+        self.messages.append(message)
+        replies = []
+        for query in message.split(';'):
+            replies.append(str(self.state[query.lstrip(':').rstrip('?')]))
+        return ';'.join(replies) + '\n'
+
+    def _write(self, message):
+        self.messages.append(message)
+        for unit in message.split(';'):
+            header, _, value = unit.lstrip(':').partition(' ')
+            for cmd in self._cmds.values():
+                if value and cmd.ascii_str.split()[0] == header:
+                    self.state[header] = cmd.getter_type(value)
+
+    def get(self, name, configs={}):
+        cmd = self._cmds[name]
+        return cmd.getter_type(self._ask(cmd.ascii_str_get.format(**configs)))
+
+    def set(self, value, name, configs={}):
+        cmd = self._cmds[name]
+        if value is None:
+            self._write(cmd.ascii_str.format(value='', **configs).rstrip())
+            return (True, None)
+        self._write(cmd.ascii_str.format(value=value, **configs))
+        self.state[cmd.ascii_str.split()[0]] = value
+        return (True, None)
+
+
+@pytest.fixture
+def inst():
+    inst = FakeInstrument()
+    inst.add('volt', 'MEAS:VOLT:DC', 1.5)
+    inst.add('curr', 'MEAS:CURR:DC', 0.25)
+    inst.add('nplc', 'VOLT:NPLC', 10, is_config=True)
+    inst.add('mode', 'MODE', 1, getter_type=int, lookup={'FAST': 1},
+             is_config=True)
+    inst.add('trace', 'TRAC:DATA', '1,2,3,4', getter_type=str_to_array)
+    return inst
+
+
+@pytest.fixture
+def running_loop():
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield loop
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+def test_scpi_signal_get(inst):
+    sig = ScpiSignalBase(control_layer=inst, cmd_name='volt')
+    assert sig.get() == 1.5
+    assert sig.read()['inst_volt']['value'] == 1.5
+    assert inst.messages[-1] == 'MEAS:VOLT:DC?'
+
+
+def test_batch_get(inst):
+    sigs = [ScpiSignalBase(control_layer=inst, cmd_name=name)
+            for name in ('volt', 'curr', 'mode')]
+    values = batch_get(sigs)
+    assert [values[sig] for sig in sigs] == [1.5, 0.25, 'FAST']
+    assert inst.messages == [':MEAS:VOLT:DC?;:MEAS:CURR:DC?;:MODE?']
+
+
+def test_program_message():
+    message = _program_message(['MEAS:VOLT:DC?', 'MODE?', 'VOLT:NPLC 10',
+                                ':OUTP ON', '*OPC?'])
+    assert message == ':MEAS:VOLT:DC?;:MODE?;:VOLT:NPLC 10;:OUTP ON;*OPC?'
+
+
+def test_batch_get_max_commands(inst):
+    sigs = [ScpiSignalBase(control_layer=inst, cmd_name=name)
+            for name in ('volt', 'curr', 'nplc')]
+    batch_get(sigs, max_commands=2)
+    assert len(inst.messages) == 2
+
+
+def test_batch_get_fallback(inst):
+    sigs = [ScpiSignalBase(control_layer=inst, cmd_name=name)
+            for name in ('volt', 'curr')]
+
+    ask = inst._ask
+
+    def drop_replies(message):
+        # an instrument that only answers the first query of a message
+        return ask(message).split(';')[0]
+
+    inst._ask = drop_replies
+    values = batch_get(sigs)
+    assert [values[sig] for sig in sigs] == [1.5, 0.25]
+
+
+def test_scpi_device_read(inst):
+    class Meter(ScpiDevice):
+        volt = Cpt(ScpiSignalBase, control_layer=inst, cmd_name='volt')
+        curr = Cpt(ScpiSignalBase, control_layer=inst, cmd_name='curr')
+        nplc = Cpt(ScpiSignal, control_layer=inst, cmd_name='nplc',
+                   kind=Kind.config)
+
+    meter = Meter(name='meter')
+    reading = meter.read()
+    assert list(reading) == ['inst_volt', 'inst_curr']
+    assert reading['inst_curr']['value'] == 0.25
+    assert len(inst.messages) == 1
+
+    config = meter.read_configuration()
+    assert config['inst_nplc']['value'] == 10
+
+
+def test_status_monitor_backoff():
+    readings = iter(range(100))
+    monitor = ScpiStatusMonitor(read_func=lambda: next(readings),
+                                threshold_function=operator.ge,
+                                threshold_level=5, poll_time=0.001,
+                                max_poll_time=0.004, backoff=2)
+    st = monitor.watch(Status())
+    wait(st, timeout=1)
+    assert next(readings) == 6
+
+
+def test_status_monitor_timeout():
+    level = {'count': 0}
+    reads = []
+    reached = []
+
+    def read():
+        reads.append(level['count'])
+        return level['count']
+
+    monitor = ScpiStatusMonitor(read_func=read, threshold_function=operator.ge,
+                                threshold_level=1, poll_time=0.005,
+                                max_poll_time=0.005)
+    st = monitor.watch(Status(timeout=0.05),
+                       on_reached=lambda: reached.append(st))
+    with pytest.raises(RuntimeError):
+        wait(st, timeout=1)
+    # the timed out watch stops polling and never reports reaching it
+    time.sleep(0.05)
+    polled = len(reads)
+    level['count'] = 1
+    time.sleep(0.05)
+    assert len(reads) == polled
+    assert not reached
+
+    # a new watch after a cancel does not revive the cancelled one
+    level['count'] = 0
+    first = monitor.watch(Status(), on_reached=lambda: reached.append(first))
+    monitor.cancel()
+    second = monitor.watch(Status(),
+                           on_reached=lambda: reached.append(second))
+    with pytest.raises(RuntimeError):
+        wait(first, timeout=1)
+    level['count'] = 1
+    wait(second, timeout=1)
+    assert reached == [second]
+
+
+def test_status_monitor_trigger(inst):
+    inst.add('count', 'DATA:POIN', 0, getter_type=int)
+    inst.add('init', 'INIT', None)
+    inst.add('clear', 'DATA:CLE', None)
+    status_monitor = {'trig_name': ['init'], 'trig_configs': {},
+                      'name': 'count', 'configs': {},
+                      'threshold_function': operator.ge,
+                      'threshold_level': 3, 'poll_time': 0.001,
+                      'post_name': 'clear', 'post_configs': {}}
+    sig = ScpiSignalBase(control_layer=inst, cmd_name='volt',
+                         status_monitor=status_monitor)
+    st = sig.trigger()
+    assert not st.done
+    assert inst.messages[0] == 'INIT'
+    inst.state['DATA:POIN'] = 3
+    wait(st, timeout=1)
+    assert st.success
+    assert inst.messages[-1] == 'DATA:CLE'
+
+    inst.state['DATA:POIN'] = 0
+    st = sig.trigger()
+    sig.stop()
+    with pytest.raises(RuntimeError):
+        wait(st, timeout=1)
+
+
+@pytest.mark.parametrize('command_queue', [None, True])
+def test_delayed_set(inst, command_queue):
+    sig = ScpiSignal(control_layer=inst, cmd_name='nplc',
+                     command_queue=command_queue)
+    sig.delay = 0.05
+    st = sig.set(2)
+    wait(st, timeout=1)
+    assert st.success
+    assert inst.state['VOLT:NPLC'] == 2
+
+    sig.delay = 10
+    pending = timer_scheduler.pending
+    st = sig.set(3)
+    deadline = time.monotonic() + 1
+    while timer_scheduler.pending == pending and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert timer_scheduler.pending == pending + 1
+    sig.stop()
+    assert st.done and not st.success
+    assert timer_scheduler.pending == pending
+
+
+def test_delayed_set_threads(inst):
+    caller = threading.current_thread()
+    written = []
+    set_func = inst.set
+
+    def record_set(value, name, configs={}):
+        written.append((value, threading.current_thread()))
+        return set_func(value, name=name, configs=configs)
+
+    inst.set = record_set
+    sig = ScpiSignal(control_layer=inst, cmd_name='nplc')
+    sig.delay = 0.05
+    wait(sig.set(2), timeout=1)
+    (value, thread), = written
+    assert value == 2 and thread is not caller
+
+    # a composite waits out the delay before writing
+    composite = ScpiCompositeSignal(
+        get_func=lambda: inst.state['VOLT:NPLC'], name='nplc_composite',
+        set_func=lambda value: record_set(value, name='nplc'))
+    composite.delay = 10
+    st = composite.set(3)
+    time.sleep(0.05)
+    assert len(written) == 1
+    composite.stop()
+    assert st.done and not st.success
+    assert inst.state['VOLT:NPLC'] == 2
+
+    composite.delay = 0.05
+    wait(composite.set(4), timeout=1)
+    value, thread = written[-1]
+    assert value == 4 and thread is not caller
+    assert thread.name.startswith('scpi-set')
+
+
+def test_delayed_set_callback_waits(inst):
+    first = ScpiSignal(control_layer=inst, cmd_name='nplc')
+    second = ScpiSignal(control_layer=inst, cmd_name='nplc')
+    first.delay = second.delay = 0.05
+    settled = threading.Event()
+    result = {}
+
+    def wait_on_second():
+        # status callbacks run on the shared set pool rather than the timer
+        # scheduler, so waiting here does not hold up the other delay
+        st = second.set(3)
+        wait(st, timeout=2)
+        result['thread'] = threading.current_thread()
+        result['success'] = st.success
+        settled.set()
+
+    first.set(2).add_callback(wait_on_second)
+    assert settled.wait(3)
+    assert result['success']
+    assert result['thread'].name != timer_scheduler.name
+
+
+@pytest.mark.parametrize('command_queue', [None, True])
+def test_setpoint_cache(inst, command_queue):
+    sig = ScpiSignal(control_layer=inst, cmd_name='nplc',
+                     command_queue=command_queue, setpoint_cache=True)
+    other = ScpiSignal(control_layer=inst, cmd_name='nplc',
+                       setpoint_cache=True)
+    cache = sig.setpoint_cache
+    assert cache is other.setpoint_cache
+    assert cache is ScpiSetpointCache.for_control_layer(inst)
+
+    wait(sig.set(2), timeout=1)
+    writes = len(inst.messages)
+    st = other.set(2)
+    assert st.done and st.success
+    assert len(inst.messages) == writes
+    assert cache.stats['suppressed'] == 1
+
+    wait(sig.set(2, force=True), timeout=1)
+    assert len(inst.messages) == writes + 1
+
+    # reads record the instrument state too
+    inst.state['VOLT:NPLC'] = 5
+    assert sig.get() == 5
+    wait(sig.set(2), timeout=1)
+    assert inst.state['VOLT:NPLC'] == 2
+
+    inst.state['VOLT:NPLC'] = 7
+    cache.forget()
+    wait(sig.set(2), timeout=1)
+    assert inst.state['VOLT:NPLC'] == 2
+    assert cache.stats == {'suppressed': 1, 'written': 4, 'known': 1}
+    if command_queue:
+        sig.command_queue.close()
+
+
+def test_async_scpi_signal(inst, running_loop):
+    sig = AsyncScpiSignal(control_layer=AsyncControlLayerAdapter(inst),
+                          cmd_name='nplc', loop=running_loop)
+    sig.delay = 0.05
+    st = sig.set(2)
+    assert not st.done
+    wait(st, timeout=1)
+    assert st.success
+    assert sig.get() == 2
+
+    future = asyncio.run_coroutine_threadsafe(sig.get_async(), running_loop)
+    assert future.result(timeout=1) == 2
+
+    async def get_on_loop():
+        return sig.get()
+
+    future = asyncio.run_coroutine_threadsafe(get_on_loop(), running_loop)
+    with pytest.raises(RuntimeError):
+        future.result(timeout=1)
+
+
+def test_async_scpi_signal_stopped_loop(inst):
+    loop = asyncio.new_event_loop()
+    sig = AsyncScpiSignal(control_layer=AsyncControlLayerAdapter(inst),
+                          cmd_name='nplc', loop=loop)
+    st = sig.set(3)
+    assert st.done and st.success
+    assert sig.read()['inst_nplc']['value'] == 3
+    loop.close()
+
+
+def test_command_queue(inst):
+    queue = ScpiCommandQueue(inst)
+    started, block = threading.Event(), threading.Event()
+
+    def busy():
+        started.set()
+        block.wait()
+
+    queue.submit(busy)
+    started.wait()
+    writes = [queue.write('VOLT:NPLC {}'.format(v)) for v in (1, 2, 3)]
+    reply = queue.get('volt')
+    assert queue.depth == 4
+    block.set()
+
+    assert reply.result(timeout=1) == 1.5
+    assert all(write.done() for write in writes)
+    assert inst.messages == [':VOLT:NPLC 1;:VOLT:NPLC 2;:VOLT:NPLC 3',
+                             'MEAS:VOLT:DC?']
+    stats = queue.stats
+    assert stats['completed'] == 5
+    assert stats['pipelined'] == 2
+    assert stats['max_depth'] >= 4
+    assert stats['max_latency'] > 0
+    queue.close()
+
+
+def test_command_queue_signals(inst):
+    setter = ScpiSignal(control_layer=inst, cmd_name='nplc',
+                        command_queue=True)
+    getter = ScpiSignalBase(control_layer=inst, cmd_name='nplc',
+                            command_queue=True)
+    assert setter.command_queue is getter.command_queue
+    st = setter.set(5)
+    assert getter.get() == 5
+    wait(st, timeout=1)
+    assert setter.command_queue.stats['completed'] == 2
+
+    # sets are pipelined, and a status callback may read through the queue
+    started, block = threading.Event(), threading.Event()
+
+    def busy():
+        started.set()
+        block.wait()
+
+    setter.command_queue.submit(busy)
+    started.wait()
+    read_back = []
+    statuses = [setter.set(value) for value in (6, 7)]
+    statuses[-1].add_callback(lambda: read_back.append(getter.get()))
+    block.set()
+    for st in statuses:
+        wait(st, timeout=1)
+    assert inst.messages[-2] == ':VOLT:NPLC 6;:VOLT:NPLC 7'
+    assert read_back == [7]
+    setter.command_queue.close()
+
+
+def test_command_queue_write_error(inst):
+    triggered = []
+
+    def execute(message):
+        # units run in order until one is rejected, as on an instrument
+        inst.messages.append(message)
+        for unit in message.split(';'):
+            if unit == '*TRG':
+                triggered.append(unit)
+            elif 'BAD' in unit:
+                raise ValueError(unit)
+
+    inst._write = execute
+    queue = ScpiCommandQueue(inst)
+    started, block = threading.Event(), threading.Event()
+
+    def busy():
+        started.set()
+        block.wait()
+
+    queue.submit(busy)
+    started.wait()
+    writes = [queue.write(message)
+              for message in ('*TRG', 'BAD 2', 'VOLT:NPLC 3')]
+    block.set()
+    queue.flush(timeout=1)
+    # the whole batch fails and nothing is sent again
+    for future in writes:
+        with pytest.raises(ValueError):
+            future.result()
+    assert inst.messages == ['*TRG;:BAD 2;:VOLT:NPLC 3']
+    assert triggered == ['*TRG']
+    queue.close()
+
+
+def test_config_cache(inst):
+    setter = ScpiSignal(control_layer=inst, cmd_name='nplc', cache_ttl=60)
+    assert setter.get() == 10
+    inst.state['VOLT:NPLC'] = 1
+    assert setter.get() == 10
+    assert setter.cached
+    assert setter.refresh() == 1
+
+    inst.state['VOLT:NPLC'] = 2
+    setter.invalidate()
+    assert setter.get() == 2
+
+    wait(setter.set(5), timeout=1)
+    assert not setter.cached
+    assert setter.get() == 5
+
+
+def test_config_cache_expires(inst):
+    sig = ScpiSignalBase(control_layer=inst, cmd_name='nplc', cache_ttl=0.01)
+    assert sig.get() == 10
+    inst.state['VOLT:NPLC'] = 1
+    time.sleep(0.02)
+    assert sig.get() == 1
+
+
+def test_config_cache_batched(inst):
+    sigs = [ScpiSignalBase(control_layer=inst, cmd_name=name, cache_ttl=60)
+            for name in ('nplc', 'mode')]
+    batch_get(sigs)
+    assert all(sig.cached for sig in sigs)
+    batch_get(sigs)
+    assert len(inst.messages) == 1
+
+
+def test_file_save(inst, tmpdir):
+    sig = ScpiSignalFileSave(control_layer=inst, cmd_name='trace',
+                             save_path=str(tmpdir))
+    sig.stage()
+    st = sig.trigger()
+    assert st.done
+    datum_id = sig.read()['inst_trace']['value']
+    assert np.array_equal(np.load(str(tmpdir.join(datum_id))), [1, 2, 3, 4])
+    assert np.array_equal(sig.get_array(), [1, 2, 3, 4])
+    docs = [name for name, doc in sig.collect_asset_docs()]
+    assert docs == ['resource', 'datum']
+    sig.unstage()
+
+
+def test_file_save_background(inst, tmpdir):
+    release = threading.Event()
+    saved = []
+
+    def slow_save(file_path, array):
+        release.wait()
+        np.save(file_path, array)
+        saved.append(file_path)
+
+    sig = ScpiSignalFileSave(control_layer=inst, cmd_name='trace',
+                             save_path=str(tmpdir), save_func=slow_save,
+                             save_workers=2, max_pending_saves=2)
+    sig.stage()
+    statuses = [sig.trigger(), sig.trigger()]
+    assert not any(st.done for st in statuses)
+    release.set()
+    for st in statuses:
+        wait(st, timeout=1)
+    assert len(saved) == 2
+
+    release.clear()
+    sig.trigger()
+    threading.Timer(0.05, release.set).start()
+    sig.unstage()
+    assert len(saved) == 3
+
+
+@pytest.mark.parametrize('container, container_kwargs, handler_cls',
+                         [('hdf5', {'chunk_frames': 2}, ScpiHdf5StackHandler),
+                          ('npy_stack', {'max_frames': 5},
+                           ScpiNpyStackHandler)])
+def test_file_save_container(inst, tmpdir, container, container_kwargs,
+                             handler_cls):
+    if container == 'hdf5':
+        pytest.importorskip('h5py')
+    sig = ScpiSignalFileSave(control_layer=inst, cmd_name='trace',
+                             save_path=str(tmpdir), container=container,
+                             container_kwargs=container_kwargs)
+    sig.stage()
+    for value in range(3):
+        inst.state['TRAC:DATA'] = ','.join([str(value)] * 4)
+        sig.trigger()
+    docs = list(sig.collect_asset_docs())
+    sig.unstage()
+    assert len(tmpdir.listdir()) == 1
+
+    (_, resource), datums = docs[0], [doc for _, doc in docs[1:]]
+    assert resource['spec'] in handler_cls.specs
+    handler = handler_cls(resource['resource_path'], root=resource['root'],
+                          **resource['resource_kwargs'])
+    for value, datum in enumerate(datums):
+        assert np.array_equal(handler(**datum['datum_kwargs']), [value] * 4)
+
+
+def test_ring_buffer():
+    ring = ArrayRingBuffer(2)
+    slot, view = ring.store(np.arange(4))
+    assert slot == 0
+    assert not view.flags.writeable
+    _, second = ring.store(np.arange(4) + 10)
+    _, third = ring.store(np.arange(4) + 20)
+    assert np.shares_memory(view, third)
+    assert np.array_equal(view, [20, 21, 22, 23])
+
+    _, other = ring.store(np.zeros(3, dtype=np.float32))
+    assert ring.shape == (3, )
+    assert ring.dtype == np.float32
+
+
+def test_ring_buffer_hold(tmpdir):
+    ring = ArrayRingBuffer(1, memmap_dir=str(tmpdir))
+    slot, view = ring.store(np.ones(4))
+    assert len(tmpdir.listdir()) == 1
+
+    release = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=1)
+    ring.hold(slot, executor.submit(release.wait))
+    threading.Timer(0.05, release.set).start()
+    ring.store(np.zeros(4))
+    assert release.is_set()
+    ring.close()
+    assert tmpdir.listdir() == []
+
+
+def test_file_save_ring_buffer(inst, tmpdir):
+    sig = ScpiSignalFileSave(control_layer=inst, cmd_name='trace',
+                             save_path=str(tmpdir), save_workers=1,
+                             max_pending_saves=1, buffer_count=2)
+    sig.stage()
+    arrays = []
+    for value in range(3):
+        inst.state['TRAC:DATA'] = ','.join([str(value)] * 4)
+        wait(sig.trigger(), timeout=1)
+        arrays.append(sig.get_array())
+    sig.unstage()
+    assert np.shares_memory(arrays[0], arrays[2])
+    assert np.array_equal(arrays[1], [1] * 4)
+    sig.destroy()
+
+
+@pytest.mark.parametrize('array', [np.random.randn(1000) * 3 + 1e4,
+                                   np.arange(12, dtype=np.int16)
+                                   .reshape(3, 4),
+                                   np.array([1 + 1j, 2 - 1j]),
+                                   np.array([1, np.nan, 3]),
+                                   np.r_[np.arange(100.), np.nan]])
+def test_fused_statistics(array):
+    stats = fused_statistics(array, block_size=64)
+    for func in (np.sum, np.mean, np.std, np.min, np.max, len):
+        name = ArrayStatistics.stat_name(func)
+        assert np.allclose(stats[name], func(array), equal_nan=True)
+
+
+def test_stat_calculator_shared_statistics(inst, tmpdir):
+    sig = ScpiSignalFileSave(control_layer=inst, cmd_name='trace',
+                             save_path=str(tmpdir))
+    statistics = ArrayStatistics(sig.get_array,
+                                 get_key=lambda: sig.array_count)
+    calcs = [StatCalculator(name=func.__name__, stat_func=func,
+                            statistics=statistics)
+             for func in (np.mean, np.max, len)]
+    sig.stage()
+    for value in range(2):
+        inst.state['TRAC:DATA'] = ','.join([str(value)] * 4)
+        sig.trigger()
+        calcs[0].trigger()
+        computed = statistics._stats
+        for calc in calcs[1:]:
+            calc.trigger()
+        # computed once per array, then served from the cache
+        assert statistics._stats is computed
+        assert [calc.get() for calc in calcs] == [value, value, 4]
+    sig.unstage()
+
+
+def test_running_statistics():
+    array = 1e6 + np.random.RandomState(0).standard_normal(1000)
+    stats = RunningStatistics()
+    assert stats.get('mean') is None
+    for chunk in np.array_split(array, 7):
+        stats.update(chunk)
+    stats.update([])
+    for func in (np.sum, np.mean, np.std, np.min, np.max, len):
+        name = ArrayStatistics.stat_name(func)
+        assert np.allclose(stats.get(name), func(array), rtol=1e-12)
+
+    calc = StatCalculator(name='std', stat_func=np.std, statistics=stats)
+    calc.trigger()
+    assert np.isclose(calc.get(), np.std(array))
+    stats.reset()
+    assert stats.count == 0
+
+    # NaN propagates, as with np.min/np.max
+    stats.update([1, 2])
+    stats.update([np.nan, 3])
+    assert np.isnan(stats.get('min')) and np.isnan(stats.get('max'))
+
+
+def test_binary_block():
+    block = encode_binary_block(np.arange(5), '>i4')
+    assert block[:4] == b'#220'
+    data = b'x' + block + b'\n'
+    array, end = parse_binary_block(data, '>i4', offset=1)
+    assert array.dtype == np.dtype('>i4')
+    assert np.array_equal(array, np.arange(5))
+    assert np.shares_memory(array, np.frombuffer(data, dtype=np.uint8))
+    assert data[end:] == b'\n'
+
+    array, _ = parse_binary_block(b'#0' + np.arange(3, dtype='<f4').tobytes()
+                                  + b'\n', '<f4')
+    assert np.array_equal(array, [0, 1, 2])
+    with pytest.raises(ValueError):
+        parse_binary_block(block[:-1], '>i4')
+
+
+@pytest.mark.parametrize('reply', [
+    encode_binary_block([1, 2, 3], '>f4'),
+    encode_binary_block([1, 2, 3], '>f4').decode('latin-1'),
+    '+1.000E+00,+2.000E+00,+3.000E+00\n',
+    b'1,2,3',
+    [1, 2, 3]])
+def test_decode_array(reply):
+    array = decode_array(reply, '>f4')
+    assert np.array_equal(array, [1, 2, 3])
+    assert array.dtype.kind == 'f'
+
+
+def test_parse_ascii_array():
+    assert np.array_equal(parse_ascii_array('"1", "2"'), [1, 2])
+    assert len(parse_ascii_array('\n')) == 0
+    array = parse_ascii_array(b'1.5, -2e3,4\n', np.dtype('f4'))
+    assert array.dtype == np.dtype('f4') and len(array) == 3
+    assert np.array_equal(parse_ascii_array('1, 2,3', 'i2'), [1, 2, 3])
+    for reply in ('1,2,x', '1,,3', '1,2,'):
+        with pytest.raises(ValueError):
+            parse_ascii_array(reply)
+
+
+def test_signal_array_dtype(inst):
+    inst.add('wave', 'WAV:DATA',
+             encode_binary_block(np.arange(4), '>i2').decode('latin-1'),
+             getter_type=str)
+    sig = ScpiSignalBase(control_layer=inst, cmd_name='wave',
+                         array_dtype='>i2')
+    assert not sig.batchable
+    assert np.array_equal(sig.get(), np.arange(4))
+
+    loop = asyncio.new_event_loop()
+    async_sig = AsyncScpiSignalBase(
+        control_layer=AsyncControlLayerAdapter(inst), cmd_name='wave',
+        loop=loop, array_dtype='>i2')
+    assert np.array_equal(async_sig.get(), np.arange(4))
+    loop.close()
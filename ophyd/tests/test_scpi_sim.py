@@ -0,0 +1,323 @@
+import logging
+import time
+
+import numpy as np
+import pytest
+
+from ophyd import Component as Cpt
+from ophyd.ophydobj import Kind
+from ophyd.scpi_like import (ScpiSignal, ScpiSignalBase, ScpiSignalFileSave,
+                             ScpiBurstFlyer, ScpiDevice, ScpiCompositeBase,
+                             ScpiCompositeSignal, ScpiTransaction,
+                             batch_get, parallel_get)
+from ophyd.scpi_sim import (SimCommand, SimControlLayer, SimScpiInstrument,
+                            SimScpiServer, sim_multimeter)
+from ophyd.sim import NumpySeqHandler
+from ophyd.status import wait
+
+logger = logging.getLogger(__name__)
+
+
+@pytest.fixture(params=['in-process', 'socket'])
+def dmm(request):
+    dmm = sim_multimeter(points=100, seed=0)
+    if request.param == 'in-process':
+        yield dmm
+        return
+
+    with SimScpiServer(dmm.instrument) as server:
+        client = SimControlLayer(dmm.instrument, address=server.address,
+                                 name='dmm')
+        yield client
+        client.close()
+
+
+def test_sim_get_set(dmm):
+    volt = ScpiSignalBase(control_layer=dmm, cmd_name='volt')
+    assert volt.get() == 1.5
+
+    nplc = ScpiSignal(control_layer=dmm, cmd_name='nplc')
+    wait(nplc.set(1))
+    assert nplc.get() == 1.
+    assert dmm.instrument['VOLT:NPLC'] == 1.
+
+    fetch = ScpiSignalBase(control_layer=dmm, cmd_name='fetch')
+    dmm.set(None, name='init')
+    assert fetch.get().dtype == np.dtype('<f4')
+
+    mode = ScpiSignal(control_layer=dmm, cmd_name='mode')
+    wait(mode.set('AC'))
+    assert mode.get() == 'AC'
+    assert dmm._ask('*IDN?').startswith('OPHYD')
+
+    dmm._write('NOT:A:COMMAND 1')
+    assert dmm._ask('SYST:ERR?').startswith('-113')
+    assert dmm._ask('SYST:ERR?').startswith('0,')
+
+
+def test_sim_batching(dmm):
+    sigs = [ScpiSignalBase(control_layer=dmm, cmd_name=name)
+            for name in ('volt', 'curr', 'nplc', 'mode')]
+    messages = dmm.instrument.stats['messages']
+    values = batch_get(sigs)
+    assert [values[sig] for sig in sigs] == [1.5, 1e-3, 10., 'DC']
+    assert dmm.instrument.stats['messages'] == messages + 1
+
+
+def test_sim_header_path():
+    instrument = sim_multimeter(points=10, seed=0).instrument
+    assert instrument.handle('MEAS:VOLT:DC?;:VOLT:NPLC?') == b'1.5;10.0'
+    # relative to the path of the previous header, across common commands
+    assert instrument.handle('VOLT:NPLC?;*OPC?;MODE?') == b'10.0;1;1'
+    assert instrument.handle('MEAS:VOLT:DC?;VOLT:NPLC?') == b'1.5;'
+    assert instrument.handle('SYST:ERR?').startswith(b'-113')
+
+    instrument.add_command(SimCommand('output', 'OUTP', value=0))
+    dmm = SimControlLayer(instrument, name='dmm')
+    sigs = [ScpiSignal(control_layer=dmm, cmd_name=name)
+            for name in ('nplc', 'output')]
+    values = batch_get(sigs)
+    assert [values[sig] for sig in sigs] == [10., 0]
+
+    class Meter(ScpiDevice):
+        nplc = Cpt(ScpiSignal, control_layer=dmm, cmd_name='nplc',
+                   kind=Kind.config)
+        output = Cpt(ScpiSignal, control_layer=dmm, cmd_name='output',
+                     kind=Kind.config)
+
+    meter = Meter(name='meter')
+    meter.configure({'nplc': 2, 'output': 1})
+    assert instrument['VOLT:NPLC'] == 2.
+    assert instrument['OUTP'] == 1
+    assert not instrument.errors
+
+
+def test_sim_configure(dmm):
+    class Meter(ScpiDevice):
+        volt = Cpt(ScpiSignalBase, control_layer=dmm, cmd_name='volt')
+        nplc = Cpt(ScpiSignal, control_layer=dmm, cmd_name='nplc',
+                   kind=Kind.config)
+        mode = Cpt(ScpiSignal, control_layer=dmm, cmd_name='mode',
+                   kind=Kind.config)
+
+    meter = Meter(name='meter')
+    messages = dmm.instrument.stats['messages']
+    old, new = meter.configure({'nplc': 1, 'mode': 'AC'})
+    assert old['dmm_nplc']['value'] == 10.
+    assert new['dmm_nplc']['value'] == 1.
+    assert new['dmm_mode']['value'] == 'AC'
+    # read_configuration, the compound write, read_configuration
+    assert dmm.instrument.stats['messages'] == messages + 3
+
+    with pytest.raises(ValueError):
+        meter.configure({'volt': 1})
+
+    meter.nplc.delay = 0.05
+    with meter.transaction() as txn:
+        txn.set(meter.nplc, 2)
+        txn.set(meter.mode, 'DC')
+        txn.set(meter.nplc, 5)
+    assert not txn.status.done
+    wait(txn.status, timeout=1)
+    assert dmm.instrument['VOLT:NPLC'] == 5.
+    assert dmm.instrument['VOLT:MODE'] == 1
+
+    # the instrument rejects the value but still answers *OPC?
+    meter.check_errors = True
+    with meter.transaction() as txn:
+        txn.set(meter.nplc, 'fast')
+    assert txn.status.done and not txn.status.success
+
+
+def test_sim_transaction_order():
+    dmm = sim_multimeter(points=10, seed=0)
+    instrument = dmm.instrument
+    messages = []
+    handle = instrument.handle
+
+    def record(message):
+        messages.append(message)
+        return handle(message)
+
+    instrument.handle = record
+    nplc = ScpiSignal(control_layer=dmm, cmd_name='nplc')
+    mode = ScpiSignal(control_layer=dmm, cmd_name='mode')
+    count = ScpiSignal(control_layer=dmm, cmd_name='sample_count')
+    source = ScpiCompositeSignal(
+        get_func=lambda: dmm.get(name='trig_source'), name='source',
+        set_func=lambda value: dmm.set(value, name='trig_source'))
+
+    # the individual set is written between the batches staged around it
+    with ScpiTransaction() as txn:
+        txn.set(nplc, 1)
+        txn.set(source, 'BUS')
+        txn.set(mode, 'AC')
+    wait(txn.status, timeout=1)
+    assert messages == [':VOLT:NPLC 1;*OPC?', 'TRIG:SOUR BUS',
+                        ':VOLT:MODE 2;*OPC?']
+    assert not txn.unapplied
+
+    # a value missing from the lookup table fails its batch; the settings
+    # after it are reported, not written
+    with ScpiTransaction(max_commands=1) as txn:
+        txn.set(nplc, 2)
+        txn.set(mode, 'RMS')
+        txn.set(count, 5)
+    assert txn.status.done and not txn.status.success
+    assert txn.unapplied == [(count, 5)]
+    assert instrument['VOLT:NPLC'] == 2.
+    assert instrument['SAMP:COUN'] == 10
+
+
+def test_sim_triggered_array(dmm, tmpdir):
+    status_monitor = {'name': 'npts', 'configs': {},
+                      'threshold_function': lambda read, thresh: read >= thresh,
+                      'threshold_level': 100, 'poll_time': 0.001,
+                      'trig_name': ['init'], 'trig_configs': {},
+                      'post_name': 'trig_source', 'post_configs': {}}
+    sig = ScpiSignalFileSave(control_layer=dmm, cmd_name='fetch',
+                             save_path=str(tmpdir),
+                             status_monitor=status_monitor)
+    sig.stage()
+    wait(sig.trigger(), timeout=5)
+    array = sig.get_array()
+    assert array.dtype == np.float32
+    assert len(array) == 100
+    datum_id = sig.read()['dmm_fetch']['value']
+    assert np.array_equal(np.load(str(tmpdir.join(datum_id))), array)
+    sig.unstage()
+
+
+def test_sim_latency():
+    inst = SimScpiInstrument([SimCommand('a', 'A', value=1.),
+                              SimCommand('b', 'B', value=2., latency=0.01)],
+                             latency=0.02)
+    dmm = SimControlLayer(inst)
+    sigs = [ScpiSignalBase(control_layer=dmm, cmd_name=name)
+            for name in ('a', 'b')]
+
+    t0 = time.monotonic()
+    for sig in sigs:
+        sig.get()
+    separate = time.monotonic() - t0
+
+    t0 = time.monotonic()
+    batch_get(sigs)
+    batched = time.monotonic() - t0
+    assert separate >= 0.05
+    assert 0.03 <= batched < separate
+
+
+def test_sim_parallel_composite():
+    dmm = sim_multimeter(name='dmm', latency=0.05)
+    supply = sim_multimeter(name='supply', latency=0.05)
+    volt = ScpiSignalBase(control_layer=dmm, cmd_name='volt')
+    curr = ScpiSignalBase(control_layer=supply, cmd_name='curr')
+
+    class Bench(ScpiDevice):
+        power = Cpt(ScpiCompositeBase, get_func=lambda v, i: v * i,
+                    sub_reads=[volt, curr])
+        nplc = Cpt(ScpiSignalBase, control_layer=dmm, cmd_name='nplc')
+        mode = Cpt(ScpiSignalBase, control_layer=supply, cmd_name='mode')
+
+    bench = Bench(name='bench')
+    messages = [inst.instrument.stats['messages'] for inst in (dmm, supply)]
+    t0 = time.monotonic()
+    reading = bench.read()
+    elapsed = time.monotonic() - t0
+    assert reading['bench_power']['value'] == 1.5 * 1e-3
+    assert reading['dmm_nplc']['value'] == 10.
+    assert reading['supply_mode']['value'] == 'DC'
+    # one compound query per instrument, at the same time
+    assert [inst.instrument.stats['messages'] for inst in (dmm, supply)] == \
+        [count + 1 for count in messages]
+    assert elapsed < 0.09
+
+    assert bench.power.get() == 1.5 * 1e-3
+    assert parallel_get([volt, curr, volt]) == {volt: 1.5, curr: 1e-3}
+
+
+def test_sim_parallel_nested_composite():
+    dmm = sim_multimeter(name='dmm')
+    supply = sim_multimeter(name='supply')
+    volt = ScpiSignalBase(control_layer=dmm, cmd_name='volt')
+    nplc = ScpiSignalBase(control_layer=dmm, cmd_name='nplc')
+    curr = ScpiSignalBase(control_layer=supply, cmd_name='curr')
+    power = ScpiCompositeBase(get_func=lambda v, i: v * i, name='power',
+                              sub_reads=[volt, curr])
+    scaled = ScpiCompositeBase(get_func=lambda p, n: p * n, name='scaled',
+                               sub_reads=[power, nplc])
+
+    messages = [inst.instrument.stats['messages'] for inst in (dmm, supply)]
+    assert scaled.get() == pytest.approx(1.5 * 1e-3 * 10)
+    # the sub-reads of the inner composite join the compound query of
+    # their instrument
+    assert [inst.instrument.stats['messages'] for inst in (dmm, supply)] == \
+        [count + 1 for count in messages]
+    assert power.get() == 1.5 * 1e-3
+
+
+def test_burst_flyer():
+    dmm = sim_multimeter(sample_rate=50000, seed=0)
+    flyer = ScpiBurstFlyer(control_layer=dmm, fetch_name='data_remove',
+                           count_name='npts', num_points=2000,
+                           configs={'sample_count': 2000}, chunk_size=300)
+    chunks = []
+    flyer.subscribe(lambda chunk, **kwargs: chunks.append(chunk),
+                    event_type=flyer.SUB_CHUNK, run=False)
+    wait(flyer.kickoff(), timeout=1)
+    wait(flyer.complete(), timeout=5)
+    pages = list(flyer.collect_pages())
+    assert max(len(page['time']) for page in pages) <= 300
+    readings = np.concatenate([page['data'][flyer.name] for page in pages])
+    assert np.array_equal(readings, dmm.instrument.buffer.fetch())
+    assert np.array_equal(np.concatenate(chunks), readings)
+    assert list(flyer.describe_collect()) == [flyer.name]
+    assert list(flyer.collect()) == []
+
+
+def test_burst_flyer_command_queue():
+    dmm = sim_multimeter(sample_rate=50000, seed=0)
+    flyer = ScpiBurstFlyer(control_layer=dmm, fetch_name='data_remove',
+                           count_name='npts', num_points=1000,
+                           configs={'sample_count': 1000}, chunk_size=300,
+                           command_queue=True)
+    submitted = flyer.command_queue.submitted
+    wait(flyer.kickoff(), timeout=1)
+    wait(flyer.complete(), timeout=5)
+    readings = np.concatenate([page['data'][flyer.name]
+                               for page in flyer.collect_pages()])
+    assert np.array_equal(readings, dmm.instrument.buffer.fetch())
+    # the configs, the trigger and every poll and fetch were queued
+    assert flyer.command_queue.submitted - submitted >= 4
+    flyer.command_queue.close()
+
+
+def test_burst_flyer_continuous(tmpdir):
+    dmm = sim_multimeter(points=10 ** 6, sample_rate=20000, seed=0)
+    flyer = ScpiBurstFlyer(control_layer=dmm, fetch_name='data_remove',
+                           count_name='npts', abort_name='abort',
+                           save_path=str(tmpdir), chunk_size=500)
+    wait(flyer.kickoff(), timeout=1)
+    time.sleep(0.1)
+    events = list(flyer.collect())
+    wait(flyer.complete(), timeout=5)
+    events += list(flyer.collect())
+    assert flyer.collected == dmm.instrument.buffer.acquired
+    assert 0 < flyer.collected < 10 ** 6
+
+    docs = list(flyer.collect_asset_docs())
+    (_, resource), datums = docs[0], [doc for _, doc in docs[1:]]
+    assert [event['data'][flyer.name] for event in events] == \
+        [datum['datum_id'] for datum in datums]
+    handler = NumpySeqHandler(resource['resource_path'],
+                              root=resource['root'])
+    chunks = [handler(**datum['datum_kwargs']) for datum in datums]
+    # every chunk has the described shape; the last one is padded
+    shape, = {chunk.shape for chunk in chunks}
+    assert list(shape) == \
+        flyer.describe_collect()[flyer.name][flyer.name]['shape']
+    readings = np.concatenate(chunks)
+    assert np.isnan(readings[flyer.collected:]).all()
+    assert np.array_equal(readings[:flyer.collected],
+                          dmm.instrument.buffer.fetch())
@@ -1,6 +1,8 @@
 import logging
+import threading
 import time
 import copy
+from types import SimpleNamespace
 import pytest
 
 from ophyd.signal import (Signal, EpicsSignal, EpicsSignalRO, DerivedSignal)
@@ -92,6 +94,137 @@ def test_signal_copy():
     assert signal.timestamp == sig_copy.timestamp
 
 
+def test_signal_shared_metadata():
+    signal = Signal(name='signal')
+    other = Signal(name='other')
+    # the attributes of Signal live in slots
+    assert 'cl' not in vars(signal)
+
+    # fresh signals share one metadata object, also after reading it
+    assert signal.metadata == {'connected': True, 'read_access': True,
+                               'write_access': True}
+    assert signal.connected and other.connected
+    assert signal._own_metadata is None and other._own_metadata is None
+    assert signal._current_metadata is Signal._default_metadata
+    assert other._current_metadata is signal._current_metadata
+
+    # a write gives the signal its own copy
+    signal._metadata['connected'] = False
+    assert signal._own_metadata is not None
+    assert signal._current_metadata is not Signal._default_metadata
+    assert not signal.connected
+    assert other.connected
+    assert other._own_metadata is None
+    assert other._current_metadata is Signal._default_metadata
+    assert Signal._default_metadata['connected']
+
+
+def _wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    assert condition()
+
+
+def test_signal_coalesced_subscription():
+    signal = Signal(name='signal', value=0)
+    release = threading.Event()
+    slow, fast = [], []
+
+    def slow_cb(value, **kwargs):
+        release.wait()
+        slow.append(value)
+
+    cid = signal.subscribe(slow_cb, run=False, coalesce=True)
+    throttled = signal._callbacks[signal._default_sub][cid]
+    signal.subscribe(lambda value, **kwargs: fast.append(value), run=False)
+    for value in range(1, 101):
+        signal.put(value)
+    # every put returned, and the other subscriber ran, while the slow
+    # subscriber was still blocked
+    assert fast == list(range(1, 101))
+    assert not slow
+
+    release.set()
+    _wait_for(lambda: slow and slow[-1] == 100)
+    # at most the first value, then only the newest of the rest
+    assert len(slow) <= 2
+    assert len(slow) + throttled.dropped == 100
+
+
+class _FakeTimer:
+    def __init__(self, when, func, args):
+        self.when, self.func, self.args = when, func, args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+        return True
+
+
+def test_signal_rate_limited_subscription(monkeypatch):
+    from ophyd import ophydobj
+
+    # a fake clock, scheduler and callback pool, run by hand
+    clock = [100.]
+    timers, submitted = [], []
+
+    class Scheduler:
+        def call_later(self, delay, func, *args):
+            timers.append(_FakeTimer(clock[0] + delay, func, args))
+            return timers[-1]
+
+    class Executor:
+        def submit(self, func, *args):
+            submitted.append((func, args))
+
+    def run_submitted():
+        while submitted:
+            func, args = submitted.pop(0)
+            func(*args)
+
+    executor = Executor()
+    monkeypatch.setattr(ophydobj, 'timer_scheduler', Scheduler())
+    monkeypatch.setattr(ophydobj, '_get_callback_executor', lambda: executor)
+    monkeypatch.setattr(ophydobj, 'time',
+                        SimpleNamespace(monotonic=lambda: clock[0],
+                                        time=time.time))
+
+    signal = Signal(name='signal')
+    signal.put(0)
+    calls = []
+    cid = signal.subscribe(lambda value, **kwargs: calls.append(value),
+                           max_rate=20)
+    run_submitted()
+    assert calls == [0]
+
+    # within the period the newest value waits for the rest of it
+    clock[0] += 0.01
+    signal.put(1)
+    signal.put(2)
+    run_submitted()
+    assert calls == [0]
+    timer, = timers
+    assert timer.when == pytest.approx(100.05)
+
+    clock[0] = timer.when
+    timer.func(*timer.args)
+    run_submitted()
+    assert calls == [0, 2]
+    throttled = signal._callbacks[signal._default_sub][cid]
+    assert throttled.dropped == 1
+
+    # unsubscribing cancels the pending delivery
+    clock[0] += 0.01
+    signal.put(3)
+    signal.unsubscribe(cid)
+    assert timers[-1].cancelled
+    assert calls == [0, 2]
+
+    with pytest.raises(ValueError):
+        signal.subscribe(lambda **kwargs: None, max_rate=0)
+
+
 def test_rw_removal(cleanup, signal_test_ioc):
     # rw kwarg is no longer used
     with pytest.raises(RuntimeError):
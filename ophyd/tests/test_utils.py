@@ -3,6 +3,7 @@ import os
 import logging
 import numpy as np
 import tempfile
+import threading
 
 from ophyd.utils import epics_pvs as epics_utils
 from ophyd.utils import (make_dir_tree, makedirs, set_and_wait)
@@ -117,3 +118,24 @@ def test_array_into_softsignal():
     s = Signal(name='np.array')
     set_and_wait(s, data)
     assert np.all(s.get() == data)
+
+
+def test_timer_scheduler():
+    from ophyd.utils.timers import TimerScheduler
+
+    scheduler = TimerScheduler(name='test-timers')
+    fired = []
+    done = threading.Event()
+    scheduler.call_later(0.05, fired.append, 'late')
+    cancelled = scheduler.call_later(0.01, fired.append, 'cancelled')
+    scheduler.call_later(0.02, fired.append, 'early')
+    scheduler.call_later(0.06, done.set)
+    assert scheduler.pending == 4
+
+    assert cancelled.cancel()
+    assert not cancelled.cancel()
+    assert scheduler.pending == 3
+    assert done.wait(1)
+    assert fired == ['early', 'late']
+    assert scheduler.pending == 0
+    assert scheduler.stats['fired'] == 3
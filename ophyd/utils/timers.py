@@ -0,0 +1,152 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class TimerHandle:
+    '''A callback scheduled on a `TimerScheduler`
+
+    Returned by `TimerScheduler.call_later`; use `cancel` to drop it before
+    it runs.
+    '''
+    __slots__ = ('when', 'func', 'args', 'kwargs', '_scheduler', '_state')
+
+    def __init__(self, scheduler, when, func, args, kwargs):
+        self.when = when
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self._scheduler = scheduler
+        self._state = 'pending'
+
+    def cancel(self):
+        '''Cancel the callback
+
+        Returns
+        -------
+        cancelled : bool
+            False if the callback already ran (or is running) or was
+            cancelled before
+        '''
+        return self._scheduler._cancel(self)
+
+    @property
+    def pending(self):
+        '''The callback has neither run nor been cancelled'''
+        return self._state == 'pending'
+
+    @property
+    def cancelled(self):
+        return self._state == 'cancelled'
+
+    def __repr__(self):
+        return '<{} {!r} in {:.3f} s ({})>'.format(
+            self.__class__.__name__, self.func, self.when - time.monotonic(),
+            self._state)
+
+
+class TimerScheduler:
+    '''Run delayed callbacks from a single thread
+
+    Callbacks are kept in a heap ordered by deadline; one daemon thread
+    (started on first use) sleeps until the earliest deadline and runs the
+    callbacks that are due. Callbacks should be short: they run on the
+    scheduler thread and delay every timer behind them.
+
+    Parameters
+    ----------
+    name : str, optional
+        The name of the scheduler thread
+    '''
+    def __init__(self, *, name='ophyd-timers'):
+        self.name = name
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pending = 0
+        self._fired = 0
+
+    def call_later(self, delay, func, *args, **kwargs):
+        '''Run ``func(*args, **kwargs)`` on the scheduler thread after delay
+
+        Parameters
+        ----------
+        delay : float
+            Seconds from now; non-positive delays run as soon as possible
+
+        Returns
+        -------
+        handle : TimerHandle
+        '''
+        handle = TimerHandle(self, time.monotonic() + max(delay, 0), func,
+                             args, kwargs)
+        with self._cond:
+            heapq.heappush(self._heap,
+                           (handle.when, next(self._counter), handle))
+            self._pending += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name=self.name, daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return handle
+
+    def _cancel(self, handle):
+        with self._cond:
+            if handle._state != 'pending':
+                return False
+            handle._state = 'cancelled'
+            self._pending -= 1
+            # the entry stays in the heap and is dropped when it comes due
+            return True
+
+    @property
+    def pending(self):
+        '''The number of callbacks waiting to run'''
+        return self._pending
+
+    @property
+    def stats(self):
+        '''Counters of the scheduler, for diagnostics'''
+        with self._cond:
+            return {'pending': self._pending,
+                    'heap_size': len(self._heap),
+                    'fired': self._fired}
+
+    def _next_due(self):
+        '''Wait for, pop and return the next due handle (lock held)'''
+        while True:
+            while self._heap and self._heap[0][2]._state != 'pending':
+                heapq.heappop(self._heap)
+            if not self._heap:
+                self._cond.wait()
+                continue
+            timeout = self._heap[0][0] - time.monotonic()
+            if timeout <= 0:
+                _, _, handle = heapq.heappop(self._heap)
+                handle._state = 'running'
+                self._pending -= 1
+                return handle
+            self._cond.wait(timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                handle = self._next_due()
+            try:
+                handle.func(*handle.args, **handle.kwargs)
+            except Exception:
+                logger.exception('Timer callback %r failed', handle.func)
+            finally:
+                handle._state = 'done'
+                self._fired += 1
+
+
+# the process-wide scheduler for delayed callbacks (e.g. delayed SCPI sets)
+timer_scheduler = TimerScheduler()
@@ -20,7 +20,7 @@ setup(name='ophyd',
       long_description_content_type='text/markdown',
       license='BSD',
       install_requires=requirements,
-      packages=find_packages(),
+      packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
       classifiers=[
           "Development Status :: 5 - Production/Stable",
           "Programming Language :: Python :: 3.6",